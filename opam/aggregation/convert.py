@@ -0,0 +1,38 @@
+import argparse
+import logging
+from os import listdir
+from os.path import isfile, join
+
+from opam.utils.io import EPISODE_CACHE_SUFFIX, convert_episode_file, episode_cache_path, \
+    is_episode_cache_fresh
+
+if __name__ == '__main__':
+    #Convert JSON episode files into binary episode caches that
+    #Aggregator.load_episodes uses in place of the JSON files
+
+    parser = argparse.ArgumentParser(description='Convert episode files to binary episode caches.')
+    parser.add_argument('paths', nargs='+',
+        help='Episode files, or directories of episode files, to convert')
+    parser.add_argument('--pix-per-meter', type=int, default=None,
+        help='Number of pixels per meter of the maps the episodes belong to')
+    parser.add_argument('--force', action='store_true',
+        help='Convert files even if their cache is up to date')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    episode_file_paths = []
+    for path in args.paths:
+        if isfile(path):
+            episode_file_paths.append(path)
+        else:
+            episode_file_paths.extend(join(path, name) for name in sorted(listdir(path))
+                if isfile(join(path, name)) and not name.endswith(EPISODE_CACHE_SUFFIX))
+
+    for episode_file_path in episode_file_paths:
+        if not args.force and is_episode_cache_fresh(episode_file_path):
+            logging.info('Cache of %s is up to date', episode_file_path)
+            continue
+        header = convert_episode_file(episode_file_path, pix_per_meter=args.pix_per_meter)
+        logging.info('Converted %s episodes (%s points) from %s to %s', header['num_episodes'],
+            header['num_points'], episode_file_path, episode_cache_path(episode_file_path))
@@ -1,11 +1,21 @@
 import numpy as np
+import logging
 from json import load, dump
 from os import listdir
-from typing import Any, DefaultDict, Dict, List, NamedTuple, Optional, Set, Tuple, Union, BinaryIO
-from PIL import Image
+from os.path import getsize, join
+from typing import Any, DefaultDict, Dict, Iterator, List, NamedTuple, Optional, Set, TextIO, Tuple, Union
 
-from opam.environment import Environment
-from opam.simulation.orca import Orca
+from opam.aggregation import parallel
+from opam.environment import Environment, EpisodeStore, TemporalCounts
+from opam.learning.data import PatchDataset
+from opam.learning.inference import predict_tiled
+from opam.evaluation.core import evaluate_occupancy
+from opam.utils.annotation import sparse_counts
+from opam.utils.cache import ContributionCache
+from opam.utils.metrics import metrics
+from opam.utils.io import EPISODE_CACHE_SUFFIX, EpisodeWriter, convert_episode_file, \
+    episode_cache_path, is_episode_cache_fresh, iter_episodes, read_episode_cache
+from opam.simulation.registry import get_simulator
 
 class Aggregator:
     def __init__(self):
@@ -19,7 +29,7 @@ class Aggregator:
             is the Map object
         episodes
             Dictionary of episodes, where the key is the map name and the 
-            value is a list of episodes for that map
+            value is an EpisodeStore with the episodes for that map
         images
             Dictionary of images, where the key is the map name and the value
             is a a dictionary of images for that map, where the key is the
@@ -56,14 +66,329 @@ class Aggregator:
         
         """
 
+        from PIL import Image
         for map_name in listdir(map_path):
             map = Image.open(map_path + map_name)
             map = np.asarray(map)
             self.maps[map_name[:-4]] = Environment(map_name[:-4], map, pix_per_meter)
 
+    def compute_all_visitation_counts(self, 
+        workers: int = 1,
+        cache: Optional[ContributionCache] = None
+        )-> None:
+        """Compute the visitation counts of all the maps, replacing any
+        previous counts.
+
+        Parameters
+        ----------
+        workers
+            Number of worker processes. With more than one worker, the maps
+            and their episodes are split into shards that are processed on
+            a process pool and the partial counts are summed per map.
+        cache
+            Cache of the contribution of each episode to the counts, see
+            Environment.compute_visitation_counts
+        """
+        if workers <= 1:
+            for env in self.maps.values():
+                env.compute_visitation_counts(cache)
+            return
+
+        results = parallel.compute_visitation_counts(self.maps, workers, cache)
+        for map_name, env in self.maps.items():
+            env.visitation_counts[...] = 0
+            if map_name in results:
+                env._add_visitation_counts(*results[map_name])
+
+    def compute_all_temporal_counts(self,
+        bin_size: float = 1.0,
+        time_step: float = 1.0,
+        workers: int = 1
+        )-> Dict[str, TemporalCounts]:
+        """Compute the visitation counts in time bins of all the maps, see
+        Environment.compute_temporal_counts.
+
+        Parameters
+        ----------
+        bin_size
+            Duration of a bin, in the unit of time_step
+        time_step
+            Duration of a step of the episodes
+        workers
+            Number of worker processes. With more than one worker, the
+            episodes are split into shards on a process pool as in
+            compute_all_visitation_counts.
+
+        Returns
+        -------
+        Dict[str, TemporalCounts]
+            Dictionary where the key is the map name and the value is the
+            counts of the map, also stored in its temporal_counts
+        """
+        if workers <= 1:
+            return {map_name: env.compute_temporal_counts(bin_size, time_step)
+                for map_name, env in self.maps.items()}
+
+        if not bin_size > 0 or not time_step > 0:
+            raise ValueError('The bin size and time step must be positive')
+        results = parallel.compute_visitation_counts(self.maps, workers, time_bins=(bin_size, time_step))
+        empty = sparse_counts([])
+        for map_name, env in self.maps.items():
+            env.temporal_counts = TemporalCounts.from_keys(*results.get(map_name, empty), env.map.shape,
+                bin_size, time_step)
+        return {map_name: env.temporal_counts for map_name, env in self.maps.items()}
+
+    def get_segmentation_masks(self,
+        num_classes: int,
+        class_distribution: List[float],
+        workers: int = 1
+        )-> Dict[str, np.ndarray]:
+        """Get the segmentation masks of all the maps based on their
+        visitation counts, see Environment.get_segmentation_mask.
+
+        Parameters
+        ----------
+        num_classes
+            Number of classes in the segmentation masks
+        class_distribution
+            List defining the distribution of the classes in the
+            segmentation masks
+        workers
+            Number of worker processes. With more than one worker, the maps
+            are segmented in parallel on a process pool.
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+            Dictionary where the key is the map name and the value is the
+            segmentation mask of the map
+        """
+        if workers <= 1:
+            return {map_name: env.get_segmentation_mask(num_classes, class_distribution)
+                for map_name, env in self.maps.items()}
+        return parallel.segmentation_masks(self.maps, num_classes, class_distribution, workers)
+
+    def training_batches(self,
+        patch_size: int = 256,
+        batch_size: int = 16,
+        label: str = 'occupancy',
+        num_classes: Optional[int] = None,
+        class_distribution: Optional[List[float]] = None,
+        augment: bool = True,
+        seed: int = 0,
+        num_samples: Optional[int] = None,
+        shard: int = 0,
+        num_shards: int = 1,
+        prefetch: int = 4,
+        workers: int = 2
+        )-> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Stream batches of (map patch, label) training samples cropped
+        from all the maps, see opam.learning.data.PatchDataset.
+
+        Patches are cropped as they are drawn instead of materializing
+        the features and labels of every map, and are prepared ahead on
+        a thread pool.
+
+        Parameters
+        ----------
+        patch_size
+            Number of rows and columns of the patches
+        batch_size
+            Number of samples in each batch
+        label
+            Kind of label, 'occupancy' or 'segmentation'
+        num_classes
+            Number of classes of segmentation labels
+        class_distribution
+            Distribution of the classes of segmentation labels
+        augment
+            If True, patches are randomly rotated and flipped
+        seed
+            Seed of the samples
+        num_samples
+            Total number of samples over all the shards, or None for an
+            endless stream
+        shard
+            Index of the shard to draw from
+        num_shards
+            Number of shards the samples are split into, so several
+            consumers can read disjoint samples
+        prefetch
+            Maximum number of batches prepared ahead
+        workers
+            Number of threads preparing batches
+
+        Returns
+        -------
+        Iterator[Tuple[np.ndarray, np.ndarray]]
+            Generator of the features and labels of each batch
+        """
+        dataset = PatchDataset(self.maps, patch_size, label, num_classes, class_distribution, augment, seed)
+        return dataset.batches(batch_size, num_samples, shard, num_shards, prefetch, workers)
+
+    def predict_all_occupancy(self,
+        model_name: str,
+        tile_size: int = 1024,
+        overlap: int = 128,
+        batch_size: int = 4,
+        workers: int = 1
+        )-> None:
+        """Predict the occupancy of all the maps with a model of the models
+        dictionary, storing the predictions in the predicted_occupancy of
+        each environment. Maps are predicted in overlapping tiles, see
+        opam.learning.inference.predict_tiled.
+
+        Parameters
+        ----------
+        model_name
+            Name of the model in the models dictionary
+        tile_size
+            Number of rows and columns of the tiles
+        overlap
+            Number of rows and columns shared by neighboring tiles
+        batch_size
+            Number of tiles predicted at a time
+        workers
+            Number of threads predicting tiles
+        """
+        if model_name not in self.models:
+            raise ValueError('Unknown model: ' + str(model_name))
+        model = self.models[model_name]
+        for env in self.maps.values():
+            predict_tiled(model, env, tile_size, overlap, batch_size, workers, model_name)
+
+    def evaluate(self,
+        model_names: Optional[List[str]] = None,
+        num_classes: Optional[int] = None,
+        class_distribution: Optional[List[float]] = None,
+        bins: int = 100,
+        workers: int = 1
+        )-> List[Dict[str, Any]]:
+        """Score the predicted occupancy of the models against the
+        visitation counts of every map, over the free pixels of each map,
+        see opam.evaluation.core.evaluate_occupancy.
+
+        Parameters
+        ----------
+        model_names
+            Names of the models to score, defaults to all the models with
+            a prediction for any map
+        num_classes
+            Number of classes of the segmentation masks compared with the
+            per-class IoU, or None to skip it
+        class_distribution
+            Distribution of the classes of the segmentation masks
+        bins
+            Number of bins of the histograms compared with the earth
+            mover's distance
+        workers
+            Number of worker processes. With more than one worker, the maps
+            are scored in parallel on a process pool, which needs dense
+            visitation counts. With a single worker, tiled counts are
+            materialized one map at a time.
+
+        Returns
+        -------
+        List[Dict[str, Any]]
+            Tidy table with one row per map and model, with the 'map' and
+            'model' names and the scores
+        """
+        if model_names is None:
+            model_names = sorted({name for env in self.maps.values() for name in env.predicted_occupancy})
+        if num_classes is not None:
+            class_distribution = Environment._check_class_distribution(num_classes, class_distribution)
+        options = dict(num_classes=num_classes, class_distribution=class_distribution, bins=bins)
+
+        if workers > 1:
+            return parallel.evaluate_predictions(self.maps, model_names, workers, **options)
+        rows = []
+        for map_name, env in self.maps.items():
+            free = env.map == env.free
+            counts = np.asarray(env.visitation_counts)
+            for model_name in model_names:
+                if model_name in env.predicted_occupancy:
+                    rows.append(dict(map=map_name, model=model_name, **evaluate_occupancy(
+                        env.predicted_occupancy[model_name], counts, free, **options)))
+        return rows
+
+    def export_heatmaps(self,
+        directory: str,
+        source: str = 'visitation_counts',
+        workers: int = 1,
+        **options: Any
+        )-> Dict[str, Dict[str, int]]:
+        """Write heatmaps of all the maps as pyramids of PNG tiles in one
+        subdirectory per map, see Environment.export_heatmap.
+
+        Parameters
+        ----------
+        directory
+            Directory of the tiles
+        source
+            'visitation_counts', or the name of a model in
+            predicted_occupancy
+        workers
+            Number of worker processes. With more than one worker, the maps
+            are exported in parallel on a process pool.
+        **options
+            Options of opam.visualization.core.export_tile_pyramid, like
+            tile_size, colormap, scale and vmax
+
+        Returns
+        -------
+        Dict[str, Dict[str, int]]
+            Dictionary where the key is the map name and the value is the
+            number of tiles written, skipped and removed, and the largest
+            zoom level
+        """
+        if workers > 1:
+            return parallel.export_heatmaps(self.maps, directory, source, workers, **options)
+        return {map_name: env.export_heatmap(join(directory, map_name), source, **options)
+            for map_name, env in self.maps.items()}
+
+    def enable_metrics(self, profiling: bool = False, reset: bool = True)-> None:
+        """Start recording the timers and counters of loading and
+        annotation, see opam.utils.metrics.Metrics.
+
+        Parameters
+        ----------
+        profiling
+            If True, also run Environment.compute_visitation_counts under
+            cProfile. Workers of parallel annotation are timed and counted
+            but not profiled.
+        reset
+            If True, discard what was recorded before
+        """
+        if reset:
+            metrics.reset()
+        metrics.enable(profiling)
+
+    def disable_metrics(self)-> None:
+        """Stop recording timers and counters, keeping what was recorded"""
+        metrics.disable()
+
+    def metrics_report(self, profile_limit: int = 20)-> str:
+        """Summarize the time spent in each stage of loading and annotation,
+        the counters and the profiles recorded since enable_metrics.
+
+        Parameters
+        ----------
+        profile_limit
+            Number of functions listed for each profile
+
+        Returns
+        -------
+        str
+            Text report
+        """
+        return metrics.report(profile_limit)
+
     def load_episodes(self, 
         episodes_path: str, 
-        num_episodes: int = 1
+        num_episodes: int = 1,
+        stream: bool = True,
+        use_cache: bool = True,
+        build_cache: bool = False
         )-> None:
         """Load episodes from the episodes_path directory.
 
@@ -73,65 +398,144 @@ class Aggregator:
             Path to the directory containing the episodes
         num_episodes
             Number of episodes to load from each file
+        stream
+            If True, parse the episode files incrementally and stop reading
+            once num_episodes have been loaded, otherwise parse each file
+            as a whole
+        use_cache
+            If True, load episodes from the binary episode cache of an
+            episode file (see opam.utils.io.write_episode_cache) instead
+            of the file itself when the cache is at least as recent
+        build_cache
+            If True, convert episode files without a recent binary cache
+            before loading them, so later loads can use the cache
         """
         for map_name in self.maps.keys():
             found_episode = False
-            for episode_file_name in listdir(episodes_path):
-                if episode_file_name.startswith(map_name):
-                    found_episode = True
-                    file = open(episodes_path + episode_file_name, 'r')
-                    ep_list = self._process_episodes(file, num_episodes)
-                    self.maps[map_name].episodes = ep_list
-                    self.episodes[map_name] = ep_list
-                    print("Loaded " + str(len(ep_list)) + " episodes for " + map_name)
+            episode_file_names = [name for name in listdir(episodes_path) if name.startswith(map_name)]
+            for episode_file_name in episode_file_names:
+                episode_file_path = episodes_path + episode_file_name
+
+                if episode_file_name.endswith(EPISODE_CACHE_SUFFIX):
+                    #Caches are only loaded directly when their episode file is missing
+                    if not use_cache or any(episode_cache_path(name) == episode_file_name
+                        for name in episode_file_names if name != episode_file_name):
+                        continue
+                    ep_list = self._load_episode_cache(map_name, episode_file_path, num_episodes)
+                else:
+                    if use_cache and build_cache and not is_episode_cache_fresh(episode_file_path):
+                        convert_episode_file(episode_file_path, map_name=map_name,
+                            pix_per_meter=self.maps[map_name].pix_per_meter)
+                    if use_cache and is_episode_cache_fresh(episode_file_path):
+                        ep_list = self._load_episode_cache(map_name,
+                            episode_cache_path(episode_file_path), num_episodes)
+                    else:
+                        with metrics.timer('load'), open(episode_file_path, 'r') as file:
+                            ep_list = self._process_episodes(file, num_episodes, stream)
+                            #Streaming may stop before the end of the file
+                            metrics.count('bytes read', file.buffer.tell())
+
+                found_episode = True
+                self.maps[map_name].episodes = ep_list
+                self.episodes[map_name] = ep_list
+                metrics.count('episodes loaded', len(ep_list))
+                logging.info('Loaded %d episodes for %s', len(ep_list), map_name)
         
             if not found_episode:
-                print('No episode found for map: ' + map_name)
+                logging.warning('No episode found for map: %s', map_name)
 
-    def _process_episodes(self, 
-        file: BinaryIO, 
+    def _load_episode_cache(self, 
+        map_name: str, 
+        cache_path: str, 
         num_episodes: int
-        ) -> List[List[List[float]]]:
-        """Process the episode file and return a list of episodes.
+        ) -> EpisodeStore:
+        """Open the binary episode cache of a map with memory-mapped coordinates.
+
+        The header and offsets are read whole, while only the coordinates
+        of the kept episodes are read, as they are accessed, so these are
+        the bytes counted as read.
+
+        Parameters
+        ----------
+        map_name
+            Name of the map the episodes are loaded for
+        cache_path
+            Path of the cache directory
+        num_episodes
+            Number of episodes to keep from the cache, or 0 to keep all
+
+        Returns
+        -------
+        EpisodeStore
+            Store backed by the memory-mapped cache
+        """
+        with metrics.timer('load'):
+            store, header = read_episode_cache(cache_path)
+        pix_per_meter = header.get('pix_per_meter')
+        if pix_per_meter is not None and pix_per_meter != self.maps[map_name].pix_per_meter:
+            logging.warning('Episode cache %s was written for %s pixels per meter, map %s uses %s',
+                cache_path, pix_per_meter, map_name, self.maps[map_name].pix_per_meter)
+
+        store = store[:num_episodes] if num_episodes else store
+        metrics.count('bytes read', sum(getsize(join(cache_path, name))
+            for name in ('header.json', 'path_offsets.npy', 'episode_offsets.npy'))
+            + store.coords[store.path_offsets[0]:store.path_offsets[-1]].nbytes)
+        return store
+
+    def _process_episodes(self, 
+        file: TextIO, 
+        num_episodes: int,
+        stream: bool = True
+        ) -> EpisodeStore:
+        """Process the episode file and return the episodes in an EpisodeStore.
 
         Parameters
         ----------
         file
             File object to read the episode data from
         num_episodes
-            Number of episodes to save from the file
+            Number of episodes to save from the file, or 0 to save all
+        stream
+            If True, decode the file one episode at a time with
+            iter_episodes instead of loading it whole
 
         Returns
         -------
-        List[List[float]]   
-            List of episodes
+        EpisodeStore   
+            Store with the episodes
         """
 
+        if stream:
+            return EpisodeStore.from_lists(iter_episodes(file, num_episodes))
+
         episodes = load(file)
-        ep_list =[]
 
         if num_episodes == 0:
             num_episodes = len(episodes['episodes'])
 
-        for i, episode in enumerate(episodes['episodes']):
-            if i >= num_episodes:
-                break
-            ped_list = []
-            for ped in episode['pedestrians']:
-                ped_list.append(ped['path'])
-            ep_list.append(ped_list)
+        ep_list = ([ped['path'] for ped in episode['pedestrians']]
+            for episode in episodes['episodes'][:num_episodes])
         
-        return ep_list
+        return EpisodeStore.from_lists(ep_list)
 
-    #TODO: Add code to simulate episodes over the maps, this may only be useful 
-    # for users that don't have data and adds the orca dependency
     def simulate_episodes(
         self, 
         num_episodes: int, 
         map_name: str, 
+        num_steps: int = 600,
+        workers: int = 1,
+        seed: int = 0,
+        episodes_path: Optional[str] = None,
+        simulator: Union[str, type] = 'orca',
         **kwargs: dict
         ) -> None:
         """Simulate episodes over a map and save the data to a the episodes dictionary.
+
+        Episodes are simulated in batches on a process pool, each seeded from
+        (seed, episode index) so the results do not depend on the number of
+        workers. If episodes_path is given, the episodes are instead streamed
+        to an episode file named after the map in that directory as they
+        finish, which load_episodes can read later.
         
         Parameters
         ----------
@@ -139,12 +543,33 @@ class Aggregator:
             Number of episodes to simulate.
         map_name
             Name of the map to simulate episodes over.
+        num_steps
+            Number of timesteps of each episode.
+        workers
+            Number of worker processes.
+        seed
+            Seed of the simulated episodes.
+        episodes_path
+            Path to the directory to write the episode file to, or None to
+            keep the episodes in memory.
+        simulator
+            Name of a simulator backend registered in
+            opam.simulation.registry, like 'orca' or 'social_force', or a
+            Simulator subclass to simulate with.
         **kwargs
-            Keyword arguments to pass to the ORCA class.
+            Keyword arguments to pass to the simulator class.
         """
+        env = self.maps[map_name]
+        episodes = parallel.simulate_episodes(env, get_simulator(simulator), num_episodes, num_steps,
+            workers, seed, **kwargs)
+
+        if episodes_path is None:
+            ep_list = EpisodeStore.from_lists(episodes)
+            env.episodes = ep_list
+            self.episodes[map_name] = ep_list
+            return
 
-        orca = orca(self.maps[map_name].map, self.maps[map_name].pix_per_meter, **kwargs)
-        orca.process_map()
-        orca.add_agents()
-        self.episodes[map_name] = orca.get_episode_data()
-        
\ No newline at end of file
+        with EpisodeWriter(episodes_path + map_name + '_simulated.json') as writer:
+            for episode in episodes:
+                writer.write(episode)
+        logging.info('Simulated %d episodes for %s', writer.num_episodes, map_name)
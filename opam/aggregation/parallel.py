@@ -0,0 +1,663 @@
+import numpy as np
+from collections import OrderedDict, deque
+from copy import copy
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from os.path import join
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from opam.environment import Environment, EpisodeStore
+from opam.utils.annotation import class_thresholds, segmentation_mask, sparse_counts
+from opam.utils.cache import ContributionCache
+from opam.evaluation.core import evaluate_occupancy
+from opam.utils.metrics import metrics
+from opam.utils.tiles import TiledArray
+from opam.visualization.core import export_tile_pyramid
+
+
+class SharedArray(NamedTuple):
+    """Picklable description of a NumPy array in shared memory
+
+    Attributes
+    ----------
+    name
+        Name of the shared memory block
+    shape
+        Shape of the array
+    dtype
+        Data type of the array
+    """
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def share_array(array: np.ndarray)-> Tuple[shared_memory.SharedMemory, SharedArray]:
+    """Copy an array into a new shared memory block.
+
+    The caller owns the returned block and must close and unlink it once
+    the workers are done with it.
+
+    Parameters
+    ----------
+    array
+        Array to share
+
+    Returns
+    -------
+    shared_memory.SharedMemory
+        Shared memory block holding the array
+    SharedArray
+        Description of the array that workers can attach to
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, SharedArray(block.name, array.shape, array.dtype.str)
+
+
+def attach_array(shared: SharedArray)-> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Attach to an array shared with share_array without copying it.
+
+    Workers share the resource tracker of the process that created the
+    block, so only that process unlinks it.
+
+    Parameters
+    ----------
+    shared
+        Description of the shared array
+
+    Returns
+    -------
+    shared_memory.SharedMemory
+        Shared memory block, which must be kept alive while the array is used
+    np.ndarray
+        Read-only view of the shared array
+    """
+    block = shared_memory.SharedMemory(name=shared.name)
+    array = np.ndarray(shared.shape, dtype=np.dtype(shared.dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return block, array
+
+
+def detached_environment(env: Environment)-> Environment:
+    """Return a shallow copy of an environment without its map, episodes
+    or results, which is cheap to send to a worker process.
+    """
+    detached = copy(env)
+    detached.map = None
+    detached.episodes = None
+    detached.visitation_counts = None
+    detached.predicted_occupancy = {}
+    detached.temporal_counts = None
+    detached.agent_radii = None
+    detached._configuration_space = None
+    detached._configuration_spaces = OrderedDict()
+    detached._free_space = None
+    detached._navigation = None
+    return detached
+
+
+class _ShardTask(NamedTuple):
+    """Episodes of one environment processed by a worker"""
+    env_name: str
+    env: Environment
+    map: SharedArray
+    configuration_space: Optional[SharedArray]
+    configuration_spaces: Dict[float, SharedArray]
+    coords: SharedArray
+    path_offsets: np.ndarray
+    episode_offsets: np.ndarray
+    cache: Optional[ContributionCache]
+    collect_metrics: bool
+    time_bins: Optional[Tuple[float, float]]
+
+
+def _annotate_shard(task: _ShardTask)-> Tuple[str, np.ndarray, np.ndarray, Optional[Dict[str, Dict[str, Any]]]]:
+    """Compute the sparse visitation counts of a shard of episodes, and the
+    snapshot of its metrics if they are collected
+    """
+    blocks = []
+    snapshot = None
+    if task.collect_metrics:
+        metrics.reset()
+        metrics.enable()
+    try:
+        indices, counts = _shard_counts(task, blocks)
+        if task.collect_metrics:
+            snapshot = metrics.snapshot()
+    finally:
+        for block in blocks:
+            block.close()
+        #Workers are reused, so a failed shard must not leave them recording
+        if task.collect_metrics:
+            metrics.disable()
+    return task.env_name, indices, counts, snapshot
+
+
+def _shard_counts(task: _ShardTask, blocks: List[shared_memory.SharedMemory])-> Tuple[np.ndarray, np.ndarray]:
+    """Attach to the shared arrays of a shard and compute its counts.
+
+    The attached blocks are appended to blocks, and no view into them
+    outlives this call so the caller can close them.
+    """
+    map_block, map = attach_array(task.map)
+    blocks.append(map_block)
+    coords_block, coords = attach_array(task.coords)
+    blocks.append(coords_block)
+
+    env = task.env
+    env.map = map
+    if task.configuration_space is not None:
+        configuration_space_block, env._configuration_space = attach_array(task.configuration_space)
+        blocks.append(configuration_space_block)
+    for radius, shared in task.configuration_spaces.items():
+        configuration_space_block, env._configuration_spaces[radius] = attach_array(shared)
+        blocks.append(configuration_space_block)
+    try:
+        store = EpisodeStore(coords, task.path_offsets, task.episode_offsets)
+        return env._sparse_visitation_counts(store, task.cache, task.time_bins)
+    finally:
+        env.map = None
+        env._configuration_space = None
+        env._configuration_spaces.clear()
+
+
+def _episode_shards(store: EpisodeStore, num_shards: int)-> List[Tuple[int, int]]:
+    """Split a store into contiguous ranges of episodes with a similar
+    number of points.
+    """
+    points = store.path_offsets[store.episode_offsets] - store.path_offsets[0]
+    bounds = np.searchsorted(points, np.linspace(0, points[-1], num_shards + 1)[1:-1])
+    bounds = np.unique(np.concatenate(([0], bounds, [len(store)])))
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def compute_visitation_counts(
+    environments: Dict[str, Environment],
+    workers: int,
+    cache: Optional[ContributionCache] = None,
+    shards_per_worker: int = 4,
+    time_bins: Optional[Tuple[float, float]] = None
+    )-> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """Compute the visitation counts of several environments on a process pool.
+
+    Maps, their configuration spaces and episode coordinates are placed in
+    shared memory once and the
+    workers attach to them, so only offsets and small environment copies
+    are pickled. The episodes of each environment are split into shards
+    with a similar number of points, so a single large map is also spread
+    over several workers.
+
+    Parameters
+    ----------
+    environments
+        Dictionary of environments, where the key is the map name
+    workers
+        Number of worker processes
+    cache
+        Cache of the contribution of each episode, shared by the workers
+    shards_per_worker
+        Number of shards to create per worker to balance the load
+    time_bins
+        Bin size and time step to count visits in time bins, see
+        Environment.compute_temporal_counts
+
+    Returns
+    -------
+    Dict[str, Tuple[np.ndarray, np.ndarray]]
+        Dictionary where the key is the map name and the value is the
+        sorted flat indices of the visited pixels, or their keys
+        bin*map size + flat index with time bins, and their counts
+
+    If opam.utils.metrics.metrics is enabled, the timers and counters of
+    the workers are merged into it.
+    """
+    stores = {}
+    for name, env in environments.items():
+        if env.episodes:
+            episodes = env.episodes
+            if not isinstance(episodes, EpisodeStore):
+                episodes = EpisodeStore.from_lists(episodes, dtype=np.float64)
+            stores[name] = episodes
+
+    total_points = sum(store.num_points for store in stores.values())
+    points_per_shard = max(total_points / max(workers * shards_per_worker, 1), 1)
+
+    blocks = []
+    results = {name: ([], []) for name in stores}
+    try:
+        tasks = []
+        for name, store in stores.items():
+            env = environments[name]
+            map_block, shared_map = share_array(env.map)
+            start, stop = store.path_offsets[0], store.path_offsets[-1]
+            coords_block, shared_coords = share_array(store.coords[start:stop])
+            blocks.extend([map_block, coords_block])
+            shared_configuration_space = None
+            shared_configuration_spaces = {}
+            if env.path_validation == 'footprint':
+                configuration_space_block, shared_configuration_space = share_array(env.configuration_space)
+                blocks.append(configuration_space_block)
+                #The configuration spaces of the other radius buckets are
+                #built once here instead of once per shard
+                if env.agent_radii is not None:
+                    buckets = np.unique(env._radius_buckets(np.asarray(env.agent_radii, dtype=float)[:store.num_paths]))
+                    for radius in buckets[buckets != env.agent_radius]:
+                        configuration_space_block, shared_configuration_spaces[float(radius)] = \
+                            share_array(env._configuration_space_for(radius))
+                        blocks.append(configuration_space_block)
+
+            num_shards = max(1, min(len(store), ceil(store.num_points / points_per_shard)))
+            for first, last in _episode_shards(store, num_shards):
+                path_offsets = store.path_offsets[store.episode_offsets[first]:store.episode_offsets[last]+1]
+                episode_offsets = store.episode_offsets[first:last+1] - store.episode_offsets[first]
+                detached = detached_environment(env)
+                shard_configuration_spaces = {}
+                if env.agent_radii is not None:
+                    #Radii of the paths of the shard
+                    detached.agent_radii = np.asarray(env.agent_radii, dtype=float)[
+                        store.episode_offsets[first]:store.episode_offsets[last]]
+                    shard_configuration_spaces = {float(radius): shared_configuration_spaces[float(radius)]
+                        for radius in np.unique(env._radius_buckets(detached.agent_radii))
+                        if float(radius) in shared_configuration_spaces}
+                tasks.append(_ShardTask(name, detached, shared_map,
+                    shared_configuration_space, shard_configuration_spaces, shared_coords, path_offsets - start,
+                    episode_offsets, cache, metrics.enabled, time_bins))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for name, indices, counts, snapshot in executor.map(_annotate_shard, tasks):
+                results[name][0].append(indices)
+                results[name][1].append(counts)
+                metrics.merge(snapshot)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    with metrics.timer('reduce'):
+        return {name: sparse_counts(indices, counts) for name, (indices, counts) in results.items()}
+
+
+
+class _SimulationTask(NamedTuple):
+    """Range of episodes of one environment simulated by a worker"""
+    env: Environment
+    map: SharedArray
+    configuration_space: SharedArray
+    simulator: type
+    simulator_kwargs: Dict[str, Any]
+    seed: int
+    first: int
+    last: int
+    num_steps: int
+
+
+def _simulate_batch(task: _SimulationTask)-> List[np.ndarray]:
+    """Simulate a range of episodes"""
+    blocks = []
+    try:
+        return _simulate_episode_range(task, blocks)
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def _simulate_episode_range(task: _SimulationTask, blocks: List[shared_memory.SharedMemory])-> List[np.ndarray]:
+    """Attach to the shared arrays of a simulation task and run it.
+
+    The attached blocks are appended to blocks, and no view into them
+    outlives this call so the caller can close them.
+    """
+    map_block, map = attach_array(task.map)
+    blocks.append(map_block)
+    configuration_space_block, configuration_space = attach_array(task.configuration_space)
+    blocks.append(configuration_space_block)
+
+    env = task.env
+    env.map = map
+    env._configuration_space = configuration_space
+    try:
+        return list(_run_episodes(env, task.simulator, task.simulator_kwargs,
+            task.seed, task.first, task.last, task.num_steps))
+    finally:
+        env.map = None
+        env._configuration_space = None
+
+
+def _run_episodes(
+    env: Environment,
+    simulator: type,
+    simulator_kwargs: Dict[str, Any],
+    seed: int,
+    first: int,
+    last: int,
+    num_steps: int
+    )-> Iterator[np.ndarray]:
+    """Simulate the episodes first to last - 1 of an environment.
+
+    Each episode is seeded from (seed, episode index), so the episodes do
+    not depend on how they are split between workers.
+    """
+    sim = simulator(env, **simulator_kwargs)
+    for index in range(first, last):
+        sim.reset(np.random.SeedSequence([seed, index]))
+        yield sim.get_episode_data(num_steps)
+
+
+def simulate_episodes(
+    env: Environment,
+    simulator: type,
+    num_episodes: int,
+    num_steps: int,
+    workers: int = 1,
+    seed: int = 0,
+    batch_size: int = 16,
+    **simulator_kwargs: Any
+    )-> Iterator[np.ndarray]:
+    """Simulate episodes over an environment on a process pool.
+
+    The map and its configuration space are placed in shared memory once,
+    batches of episodes are simulated by the workers and the episodes are
+    yielded in order as they finish. At most two batches per worker are in
+    flight, so the episodes can be streamed to disk without holding all
+    of them in memory.
+
+    Parameters
+    ----------
+    env
+        Environment to simulate in
+    simulator
+        Simulator subclass to simulate with
+    num_episodes
+        Number of episodes to simulate
+    num_steps
+        Number of timesteps of each episode
+    workers
+        Number of worker processes, episodes are simulated in this process
+        if 1
+    seed
+        Seed of the episodes, episode i is seeded from (seed, i)
+    batch_size
+        Number of episodes simulated by a worker at a time
+    **simulator_kwargs
+        Keyword arguments to pass to the simulator
+
+    Yields
+    ------
+    np.ndarray
+        Positions of the agents of each episode with shape
+        (agents x timesteps x 2)
+    """
+    if workers <= 1:
+        yield from _run_episodes(env, simulator, simulator_kwargs, seed, 0, num_episodes, num_steps)
+        return
+
+    map_block, shared_map = share_array(env.map)
+    configuration_space_block, shared_configuration_space = share_array(env.configuration_space)
+    try:
+        detached = detached_environment(env)
+        tasks = (_SimulationTask(detached, shared_map, shared_configuration_space, simulator,
+            simulator_kwargs, seed, first, min(first + batch_size, num_episodes), num_steps)
+            for first in range(0, num_episodes, batch_size))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for task in tasks:
+                pending.append(executor.submit(_simulate_batch, task))
+                if len(pending) >= 2*workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+    finally:
+        for block in (map_block, configuration_space_block):
+            block.close()
+            block.unlink()
+
+
+class _SegmentationTask(NamedTuple):
+    """Visitation counts of one environment segmented by a worker"""
+    env_name: str
+    counts: SharedArray
+    class_distribution: np.ndarray
+    dtype: str
+
+
+def _segment_counts(task: _SegmentationTask)-> Tuple[str, np.ndarray]:
+    """Compute the segmentation mask of shared visitation counts"""
+    block, counts = attach_array(task.counts)
+    try:
+        thresholds = class_thresholds(counts[counts > 0], task.class_distribution)
+        mask = segmentation_mask(counts, thresholds, np.dtype(task.dtype))
+    finally:
+        del counts
+        block.close()
+    return task.env_name, mask
+
+
+def segmentation_masks(
+    environments: Dict[str, Environment],
+    num_classes: int,
+    class_distribution: List[float],
+    workers: int
+    )-> Dict[str, np.ndarray]:
+    """Compute the segmentation masks of several environments on a process pool.
+
+    The arguments are validated before any work starts, then the visitation
+    counts of each environment are placed in shared memory and each worker
+    segments one map at a time, as Environment.get_segmentation_mask does.
+    Tiled counts are not copied into a dense array, their maps are
+    segmented tile by tile with Environment.get_segmentation_mask while
+    the workers segment the maps with dense counts.
+
+    Parameters
+    ----------
+    environments
+        Dictionary of environments, where the key is the map name
+    num_classes
+        Number of classes in the segmentation masks
+    class_distribution
+        Fraction of the visited pixels in each class
+    workers
+        Number of worker processes
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Dictionary where the key is the map name and the value is the
+        segmentation mask of the map
+    """
+    class_distribution = Environment._check_class_distribution(num_classes, class_distribution)
+    for name, env in environments.items():
+        if env.visitation_counts is None or not env.visitation_counts.max() > 0:
+            raise ValueError('No visitation counts to segment for ' + name)
+    dtype = np.dtype(np.uint8 if num_classes <= 256 else np.uint16).str
+
+    blocks = []
+    try:
+        tasks = []
+        for name, env in environments.items():
+            if isinstance(env.visitation_counts, TiledArray):
+                continue
+            block, shared_counts = share_array(env.visitation_counts)
+            blocks.append(block)
+            tasks.append(_SegmentationTask(name, shared_counts, class_distribution, dtype))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_segment_counts, tasks)
+            masks = {name: env.get_segmentation_mask(num_classes, class_distribution)
+                for name, env in environments.items() if isinstance(env.visitation_counts, TiledArray)}
+            masks.update(results)
+        return {name: masks[name] for name in environments}
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+class _EvaluationTask(NamedTuple):
+    """Predictions of several models for one environment scored by a worker"""
+    env_name: str
+    free: SharedArray
+    counts: SharedArray
+    predictions: Dict[str, SharedArray]
+    options: Dict[str, Any]
+
+
+def _evaluate_predictions(task: _EvaluationTask)-> List[Dict[str, Any]]:
+    """Score the shared predictions of a task"""
+    blocks = []
+    try:
+        free_block, free = attach_array(task.free)
+        blocks.append(free_block)
+        counts_block, counts = attach_array(task.counts)
+        blocks.append(counts_block)
+        rows = []
+        for model_name, shared in task.predictions.items():
+            prediction_block, prediction = attach_array(shared)
+            blocks.append(prediction_block)
+            rows.append(dict(map=task.env_name, model=model_name,
+                **evaluate_occupancy(prediction, counts, free, **task.options)))
+            del prediction
+        del free, counts
+        return rows
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def evaluate_predictions(
+    environments: Dict[str, Environment],
+    model_names: List[str],
+    workers: int,
+    **options: Any
+    )-> List[Dict[str, Any]]:
+    """Score the predicted occupancy of several environments on a process pool.
+
+    The free space, visitation counts and predictions of each environment
+    are placed in shared memory and each worker scores all the models of
+    one map with opam.evaluation.core.evaluate_occupancy. This needs dense
+    visitation counts, since sharing tiled counts would materialize those
+    of every map at once. Environments with tiled counts are evaluated
+    serially by Aggregator.evaluate, which materializes one map at a time.
+
+    Parameters
+    ----------
+    environments
+        Dictionary of environments, where the key is the map name
+    model_names
+        Names of the models to score, maps without a prediction of a model
+        are skipped for that model
+    workers
+        Number of worker processes
+    **options
+        Keyword arguments to pass to evaluate_occupancy
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One row per map and model, with the 'map' and 'model' names and
+        the scores
+
+    Raises
+    ------
+    ValueError
+        If an environment has tiled visitation counts
+    """
+    for name, env in environments.items():
+        if isinstance(env.visitation_counts, TiledArray):
+            raise ValueError('Parallel evaluation needs dense visitation counts, evaluate ' + name
+                + ' with a single worker')
+    blocks = []
+    try:
+        tasks = []
+        for name, env in environments.items():
+            predictions = {}
+            for model_name in model_names:
+                if model_name in env.predicted_occupancy:
+                    block, predictions[model_name] = share_array(env.predicted_occupancy[model_name])
+                    blocks.append(block)
+            if not predictions:
+                continue
+            free_block, shared_free = share_array(env.map == env.free)
+            counts_block, shared_counts = share_array(env.visitation_counts)
+            blocks.extend([free_block, counts_block])
+            tasks.append(_EvaluationTask(name, shared_free, shared_counts, predictions, options))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return [row for rows in executor.map(_evaluate_predictions, tasks) for row in rows]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+class _HeatmapTask(NamedTuple):
+    """Heatmap of one environment exported by a worker"""
+    env_name: str
+    values: SharedArray
+    free: SharedArray
+    directory: str
+    options: Dict[str, Any]
+
+
+def _export_heatmap(task: _HeatmapTask)-> Tuple[str, Dict[str, int]]:
+    """Write the tile pyramid of shared heatmap values"""
+    values_block, values = attach_array(task.values)
+    free_block, free = attach_array(task.free)
+    try:
+        stats = export_tile_pyramid(values, free, task.directory, **task.options)
+    finally:
+        del values, free
+        values_block.close()
+        free_block.close()
+    return task.env_name, stats
+
+
+def export_heatmaps(
+    environments: Dict[str, Environment],
+    directory: str,
+    source: str,
+    workers: int,
+    **options: Any
+    )-> Dict[str, Dict[str, int]]:
+    """Write the heatmap tile pyramids of several environments on a process
+    pool, one map per worker at a time, as Environment.export_heatmap does.
+
+    Parameters
+    ----------
+    environments
+        Dictionary of environments, where the key is the map name
+    directory
+        Directory with one subdirectory of tiles per map
+    source
+        'visitation_counts', or the name of a model in predicted_occupancy
+    workers
+        Number of worker processes
+    **options
+        Options of opam.visualization.core.export_tile_pyramid
+
+    Returns
+    -------
+    Dict[str, Dict[str, int]]
+        Dictionary where the key is the map name and the value is the
+        number of tiles written, skipped and removed, and the largest zoom
+        level
+    """
+    blocks = []
+    try:
+        tasks = []
+        for name, env in environments.items():
+            values_block, shared_values = share_array(env.heatmap_values(source))
+            blocks.append(values_block)
+            free_block, shared_free = share_array(env.map == env.free)
+            blocks.append(free_block)
+            tasks.append(_HeatmapTask(name, shared_values, shared_free, join(directory, name), options))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(_export_heatmap, tasks))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -0,0 +1,47 @@
+import numpy as np
+from typing import Tuple
+
+
+#The 8 orientations of a square, as (quarter turns, flip) pairs
+NUM_ORIENTATIONS = 8
+
+
+def random_orientation(rng: np.random.Generator)-> Tuple[int, bool]:
+    """Draw one of the 8 rotations and reflections of a square uniformly
+
+    Parameters
+    ----------
+    rng
+        Random number generator
+
+    Returns
+    -------
+    Tuple[int, bool]
+        Number of counterclockwise quarter turns and whether to flip the
+        columns after turning
+    """
+    orientation = int(rng.integers(NUM_ORIENTATIONS))
+    return orientation % 4, orientation >= 4
+
+
+def orient(array: np.ndarray, quarter_turns: int, flip: bool)-> np.ndarray:
+    """Rotate and reflect the first two axes of an array.
+
+    The result is a view, so orienting a patch does not copy it.
+
+    Parameters
+    ----------
+    array
+        Array with at least two dimensions, e.g. a map patch or a label
+    quarter_turns
+        Number of counterclockwise quarter turns
+    flip
+        Whether to flip the columns after turning
+
+    Returns
+    -------
+    np.ndarray
+        Oriented view of the array
+    """
+    oriented = np.rot90(array, quarter_turns, axes=(0, 1))
+    return oriented[:, ::-1] if flip else oriented
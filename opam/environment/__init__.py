@@ -0,0 +1,3 @@
+from opam.environment.core import Environment
+from opam.environment.episodes import Episode, EpisodeStore
+from opam.environment.temporal import TemporalCounts
@@ -1,10 +1,27 @@
 import numpy as np
-from math import ceil, isnan
-from PIL import Image
-from typing import Any, DefaultDict, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+import weakref
+from collections import OrderedDict
+from math import ceil
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from typing import Any, DefaultDict, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
 import logging
 
-from utils.annotation import make_gaussian, make_gaussian, bresenham_line
+from opam.utils.annotation import make_gaussian, binary_dilate, bresenham_segments, class_thresholds, \
+    segmentation_mask, sparse_counts, swept_area
+from opam.utils.cache import ContributionCache, content_hash
+from opam.utils.metrics import metrics
+from opam.utils.tiles import TiledArray
+from opam.environment.footprints import FootprintCache, stamp_footprints
+from opam.environment.free_space import FreeSpaceIndex, free_space_index
+from opam.environment.navigation import Navigation
+from opam.environment.temporal import TemporalCounts
+from opam.visualization.core import export_tile_pyramid
+
+
+#Largest number of configuration spaces of radius buckets kept by an environment
+_CONFIGURATION_SPACE_CACHE_SIZE = 8
 
 
 class Environment:
@@ -24,6 +41,52 @@ class Environment:
         Value of the obstacle pixels in the map
     free
         Value of the free pixels in the map
+    swept_area_engine
+        Name of the engine used to compute the swept area of a path,
+        one of 'dense', 'sparse', 'dilate' or 'auto' to pick the
+        cheapest engine for each path
+    path_validation
+        How paths are checked against obstacles, either 'footprint' to
+        reject positions where any pixel of the agent overlaps an obstacle
+        or 'center' to only check the pixel at the agent position
+    truncate_invalid_paths
+        If True, invalid paths are stamped up to their first invalid
+        position, otherwise they are discarded entirely
+    counts_storage
+        How the visitation counts are stored, either 'dense' for a NumPy
+        array of the size of the map, 'tiled' for a TiledArray that only
+        allocates tiles where trajectories land, or 'memmap' for a
+        TiledArray whose tiles are memory-mapped files in spill_dir
+    counts_dtype
+        Data type of the visitation counts, e.g. np.uint16 or np.uint32
+        to store them compactly
+    map_dtype
+        Data type to store the map with, e.g. np.uint8, or None to keep
+        the data type of the given map
+    tile_size
+        Number of rows and columns of each tile of tiled counts
+    spill_dir
+        Directory of the memory-mapped tiles of 'memmap' counts and of the
+        memory-mapped 'memmap' map. If None, a temporary directory is
+        created, which is removed when the environment is garbage
+        collected
+    radius_resolution
+        Size in pixels of the radius buckets of agents with a radius of
+        their own, see agent_radii. With footprint validation, each bucket
+        in use has a configuration space of the size of the map, built
+        with a dilation of the map and shared with the workers of parallel
+        annotation, so a fine resolution over a wide spread of radii
+        costs a dilation and a map of booleans per bucket. Only the
+        _CONFIGURATION_SPACE_CACHE_SIZE most recently used are kept.
+    subpixel_steps
+        Number of levels per pixel of the sub-pixel offset of the agents
+        from the pixels they are stamped on, 1 to stamp agents centered on
+        the nearest pixel
+    map_storage
+        How the map is stored, either 'dense' for a NumPy array or
+        'memmap' for a read-only array memory-mapped from a file in
+        spill_dir, so the operating system can page out the parts of a
+        large map that are not in use
 
     Attributes
     ----------
@@ -39,16 +102,47 @@ class Environment:
         See above
     free
         See above
+    swept_area_engine
+        See above
+    path_validation
+        See above
+    truncate_invalid_paths
+        See above
+    spill_dir
+        Directory of the memory-mapped counts and map, None if neither is
+        memory-mapped
+    agent_radii
+        Radius of the agent of each path, in the unit of agent_radius,
+        for the paths of all the episodes in order, or None for agents
+        of agent_radius. NaN radii also stand for agent_radius. Paths are
+        stamped with the footprint of their radius rounded to
+        radius_resolution, and validated against the configuration space
+        of that footprint.
+    configuration_space
+        Boolean array of the size of the map that is True where an agent
+        centered on the pixel would overlap an obstacle, computed on
+        first use
+    free_space
+        Index of the pixels outside the configuration space grouped by
+        connected component, built on first use
+    navigation
+        Navigation layer used to route simulated agents to their goals,
+        created on first use
     map_size
         Size of the map in pixels
     episodes
-        List of episodes for the environment
+        Episodes for the environment, either an EpisodeStore or a list
+        of episodes where each episode is a list of paths
     visitation_counts
         Number of times each pixel has been visited based 
-        on episode data
+        on episode data, a NumPy array or a TiledArray depending
+        on counts_storage
     predicted_occupancy
         Dictionary where the keys are the model names
         and the values are the predicted occupancy maps
+    temporal_counts
+        Visitation counts resolved in time of the last call to
+        compute_temporal_counts, None before it
     _max_agent_radius 
         Maximum radius of the agents in pixels
     _min_agent_radius
@@ -57,6 +151,21 @@ class Environment:
         Diameter of the agents in pixels
     _agent_mask
         Array defining the shape of the agent
+    _sparse_merge_size
+        Number of pending swept pixels after which sparse visitation
+        counts are merged
+    _configuration_space
+        Cached configuration space, None until it is first used
+    _free_space
+        Cached free space index, None until it is first used
+    _navigation
+        Cached navigation layer, None until it is first used
+    _footprints
+        Cache of the footprint stamps of each radius bucket and sub-pixel
+        offset
+    _configuration_spaces
+        Cached configuration spaces of the radius buckets of agent_radii,
+        least recently used first
     """
 
     def __init__(self, 
@@ -65,34 +174,505 @@ class Environment:
         pix_per_meter: int = 10, 
         agent_radius: float = 1.5,
         obstacle: int = 0,
-        free: int = 1
+        free: int = 1,
+        swept_area_engine: str = 'auto',
+        path_validation: str = 'footprint',
+        truncate_invalid_paths: bool = False,
+        counts_storage: str = 'dense',
+        counts_dtype: Any = np.float64,
+        map_dtype: Any = None,
+        tile_size: int = 256,
+        spill_dir: Optional[str] = None,
+        radius_resolution: float = 0.1,
+        subpixel_steps: int = 1,
+        map_storage: str = 'dense'
         )-> None:
 
         self.env_name = env_name
-        self.map = np.asarray(map)
+        self.spill_dir = spill_dir
+        if spill_dir is None and 'memmap' in (counts_storage, map_storage):
+            self.spill_dir = mkdtemp(prefix='opam_' + env_name + '_')
+            weakref.finalize(self, rmtree, self.spill_dir, ignore_errors=True)
+        if map_storage == 'dense':
+            self.map = np.asarray(map, dtype=map_dtype)
+        elif map_storage == 'memmap':
+            map_path = join(self.spill_dir, 'map.npy')
+            np.save(map_path, np.asarray(map, dtype=map_dtype))
+            self.map = np.load(map_path, mmap_mode='r')
+        else:
+            raise ValueError('Unknown map storage: ' + str(map_storage))
         self.pix_per_meter = pix_per_meter
         self.agent_radius = agent_radius*(pix_per_meter/10)
         self.obstacle = obstacle
         self.free = free
+        self.swept_area_engine = swept_area_engine
+        self.path_validation = path_validation
+        self.truncate_invalid_paths = truncate_invalid_paths
         self.map_size = self.map.shape
         self.episodes = None
-        self.visitation_counts = np.zeros(self.map.shape)
+        if counts_storage == 'dense':
+            self.visitation_counts = np.zeros(self.map.shape, dtype=counts_dtype)
+        elif counts_storage == 'tiled':
+            self.visitation_counts = TiledArray(self.map.shape, counts_dtype, tile_size)
+        elif counts_storage == 'memmap':
+            self.visitation_counts = TiledArray(self.map.shape, counts_dtype, tile_size, self.spill_dir)
+        else:
+            raise ValueError('Unknown counts storage: ' + str(counts_storage))
         self.predicted_occupancy = {}
+        self.temporal_counts = None
         self._max_agent_radius = ceil(self.agent_radius)
         self._min_agent_radius = round(self.agent_radius)
         self._agent_diameter = self._max_agent_radius + self._min_agent_radius
         self._agent_mask = np.rint(make_gaussian(self._agent_diameter, fwhm=self._agent_diameter))
+        self.agent_radii = None
+        self._footprints = FootprintCache(self.agent_radius, radius_resolution, subpixel_steps)
+        self._configuration_spaces = OrderedDict()
+        self._sparse_merge_size = 1 << 22
+        self._configuration_space = None
+        self._free_space = None
+        self._navigation = None
+
+        if path_validation not in ('footprint', 'center'):
+            raise ValueError('Unknown path validation: ' + str(path_validation))
+
+    @property
+    def configuration_space(self)-> np.ndarray:
+        """Boolean array that is True where an agent centered on the pixel
+        would overlap an obstacle, with the agent footprint given by
+        _agent_mask. The footprint is clipped to the map like when it is
+        stamped, so only obstacle pixels inside the map count.
+        """
+        if self._configuration_space is None:
+            #Dilating with the reflected footprint marks each pixel whose
+            #footprint covers an obstacle
+            size = self._agent_mask.shape[0]
+            self._configuration_space = binary_dilate(self.map == self.obstacle,
+                self._agent_mask[::-1, ::-1], size - 1 - self._max_agent_radius)
+        return self._configuration_space
+
+    def _configuration_space_for(self, radius: Optional[float] = None)-> np.ndarray:
+        """Configuration space of agents of a radius bucket in pixels, the
+        configuration_space of agent_radius if radius is None or equal to
+        it, built on first use and cached for the most recently used radii
+        otherwise
+        """
+        if radius is None or radius == self.agent_radius:
+            return self.configuration_space
+        radius = float(radius)
+        if radius in self._configuration_spaces:
+            self._configuration_spaces.move_to_end(radius)
+            return self._configuration_spaces[radius]
+
+        footprint = self._footprints.stamp(radius)
+        size = footprint.mask.shape[0]
+        configuration_space = binary_dilate(self.map == self.obstacle,
+            footprint.mask[::-1, ::-1], size - 1 - footprint.anchor)
+        self._configuration_spaces[radius] = configuration_space
+        if len(self._configuration_spaces) > _CONFIGURATION_SPACE_CACHE_SIZE:
+            self._configuration_spaces.popitem(last=False)
+        return configuration_space
+
+    def _radius_buckets(self, radii: np.ndarray)-> np.ndarray:
+        """Radius buckets in pixels of agent radii in the unit of
+        agent_radius, NaN radii being agent_radius
+        """
+        return self._footprints.radius_buckets(np.asarray(radii, dtype=float) * (self.pix_per_meter/10))
+
+    @property
+    def free_space(self)-> FreeSpaceIndex:
+        """Index of the pixels where an agent fits, grouped by connected
+        component to sample positions that can reach each other
+        """
+        if self._free_space is None:
+            self._free_space = free_space_index(self)
+        return self._free_space
+
+    @property
+    def navigation(self)-> Navigation:
+        """Navigation layer that routes agents to their goals around the
+        obstacles of the configuration space, created on first use
+        """
+        if self._navigation is None:
+            self._navigation = Navigation(self)
+        return self._navigation
+
+    def compute_visitation_counts(self, cache: Optional[ContributionCache] = None)-> None:
+        """Compute the number of times each pixel has been visited by the agents
+
+        Any previous counts are discarded, so calling this again after
+        changing the episodes recomputes the counts from scratch. The
+        computation is profiled when profiling is enabled on
+        opam.utils.metrics.metrics.
+
+        Parameters
+        ----------
+            cache
+                Cache of the contribution of each episode to the counts.
+                Episodes already in the cache are not recomputed, which
+                makes recomputing after adding or removing episodes only
+                process the new ones.
+        """
+        logging.debug('Computing visitation counts for %s...', self.env_name)
+        with metrics.profile('compute_visitation_counts'):
+            self.visitation_counts[...] = 0
+            if self.episodes:
+                key = self._contribution_key() if cache is not None else None
+                for paths, radii in self._episodes_with_radii(self.episodes):
+                    indices, counts = self._episode_visitation_counts(paths, cache, key, radii)
+                    self._add_visitation_counts(indices, counts)
+
+    def _add_visitation_counts(self, indices: np.ndarray, counts: np.ndarray)-> None:
+        """Add sparse counts to the visitation counts. Integer counts
+        saturate at the largest value of their data type, with either
+        storage, instead of wrapping around.
+
+        Parameters
+        ----------
+            indices
+                Unique flat indices into the map
+            counts
+                Count to add at each index
+        """
+        with metrics.timer('reduce'):
+            if isinstance(self.visitation_counts, TiledArray):
+                self.visitation_counts.add_at(indices, counts)
+            elif self.visitation_counts.dtype.kind in 'iu' and self.visitation_counts.dtype.itemsize < 8:
+                #Accumulate in 64 bits and saturate like TiledArray.add_at
+                total = self.visitation_counts.flat[indices].astype(np.int64) + counts
+                self.visitation_counts.flat[indices] = np.minimum(total, np.iinfo(self.visitation_counts.dtype).max)
+            else:
+                self.visitation_counts.flat[indices] += counts.astype(self.visitation_counts.dtype)
+
+    def compute_temporal_counts(self, bin_size: float = 1.0, time_step: float = 1.0)-> TemporalCounts:
+        """Compute the visitation counts of the agents in time bins
+
+        Paths are aligned in time within an episode (see
+        _check_path_lengths), so the time of step t of every path is
+        t*time_step from the start of its episode. The move from step t to
+        step t + 1 falls in the bin of step t, and the counts of a bin are
+        the number of paths whose swept area during the bin covers each
+        pixel. A path sweeping a pixel in several bins is counted once in
+        each of them. The counts are kept sparse, see TemporalCounts.
+
+        Parameters
+        ----------
+            bin_size
+                Duration of a bin, in the unit of time_step, e.g. 10 with
+                the default time_step for bins of 10 steps, or 1 with the
+                time step of the simulation in seconds for bins of a
+                second
+            time_step
+                Duration of a step of the episodes
+
+        Returns
+        -------
+            TemporalCounts
+                Counts of each bin, also stored in temporal_counts
+        """
+        if not bin_size > 0 or not time_step > 0:
+            raise ValueError('The bin size and time step must be positive')
+        logging.debug('Computing temporal counts for %s...', self.env_name)
+        keys, counts = self._sparse_visitation_counts(self.episodes or [], time_bins=(bin_size, time_step))
+        self.temporal_counts = TemporalCounts.from_keys(keys, counts, self.map.shape, bin_size, time_step)
+        return self.temporal_counts
+
+    def _contribution_key(self)-> str:
+        """Hash of everything other than the episode data that determines
+        the contribution of an episode to the visitation counts
+        """
+        key = content_hash(self.map, self.pix_per_meter, self.agent_radius,
+            self.obstacle, self._agent_mask, self._max_agent_radius,
+            self.path_validation, self.truncate_invalid_paths)
+        if self._uses_footprint_stamps:
+            key = content_hash(key, self._footprints.radius_resolution, self._footprints.subpixel_steps)
+        return key
+
+    @property
+    def _uses_footprint_stamps(self)-> bool:
+        """Whether paths are stamped with the footprints of their own radius
+        or sub-pixel offset rather than with _agent_mask
+        """
+        return self.agent_radii is not None or self._footprints.subpixel_steps > 1
+
+    def _episodes_with_radii(self,
+        episodes: Iterable[List[List[List[float]]]]
+        )-> Iterator[Tuple[List[List[List[float]]], Optional[np.ndarray]]]:
+        """Pair each episode with the radii of its paths in agent_radii
+
+        Yields
+        ------
+            List[List[List[float]]]
+                Paths of the episode
+            Optional[np.ndarray]
+                Radius of the agent of each path, or None if agent_radii
+                is None
+
+        Raises
+        ------
+            ValueError
+                If agent_radii has fewer radii than there are paths
+        """
+        start = 0
+        for paths in episodes:
+            radii = None
+            if self.agent_radii is not None:
+                radii = np.asarray(self.agent_radii[start:start + len(paths)], dtype=float)
+                if len(radii) != len(paths):
+                    raise ValueError('agent_radii has fewer radii than the episodes have paths')
+            start += len(paths)
+            yield paths, radii
+
+    def _episode_visitation_counts(self, 
+        paths: List[List[List[float]]],
+        cache: Optional[ContributionCache] = None,
+        key: Optional[str] = None,
+        radii: Optional[np.ndarray] = None
+        )-> Tuple[np.ndarray, np.ndarray]:
+        """Compute the visitation counts of a single episode
+
+        Parameters
+        ----------
+            paths
+                List of paths for the agents of the episode
+            cache
+                Cache to look up and store the counts of the episode in
+            key
+                Result of _contribution_key, computed if not given
+            radii
+                Radius of the agent of each path, see agent_radii
+
+        Returns
+        -------
+            np.ndarray
+                Sorted flat indices into the map of the visited pixels
+            np.ndarray
+                Number of times each of those pixels has been visited
+        """
+        if cache is None:
+            swept_areas = list(self._episode_swept_areas(paths, radii))
+            with metrics.timer('reduce'):
+                return sparse_counts(swept_areas)
+
+        episode_key = content_hash(key or self._contribution_key(), np.asarray(paths, dtype=float))
+        if radii is not None:
+            episode_key = content_hash(episode_key, radii)
+        contribution = cache.get(episode_key)
+        if contribution is None:
+            metrics.count('cache misses')
+            swept_areas = list(self._episode_swept_areas(paths, radii))
+            with metrics.timer('reduce'):
+                contribution = sparse_counts(swept_areas)
+            cache.put(episode_key, *contribution)
+        else:
+            metrics.count('cache hits')
+        return contribution
+
+    def _episode_temporal_counts(self,
+        paths: List[List[List[float]]],
+        bin_size: float,
+        time_step: float,
+        radii: Optional[np.ndarray] = None
+        )-> Tuple[np.ndarray, np.ndarray]:
+        """Compute the visitation counts of a single episode in time bins
+
+        Parameters
+        ----------
+            paths
+                List of paths for the agents of the episode
+            bin_size
+                Duration of a bin
+            time_step
+                Duration of a step
+            radii
+                Radius of the agent of each path, see agent_radii
+
+        Returns
+        -------
+            np.ndarray
+                Sorted keys bin*map size + flat index into the map of the
+                visited pixels in each bin
+            np.ndarray
+                Number of times each of those pixels has been visited in
+                the bin
+        """
+        if self._uses_footprint_stamps:
+            keys, num_bins = self._stamp_episode(paths, radii, (bin_size, time_step))
+            owners, indices = np.divmod(keys, self.map.size)
+            with metrics.timer('reduce'):
+                return sparse_counts([owners % num_bins * self.map.size + indices])
+
+        self._check_path_lengths(paths)
+        paths = np.asarray(paths, dtype=float).reshape(len(paths), -1, 2)
+        pixels, offsets, steps = self._raytrace_paths(paths, return_steps=True)
+        bins = self._time_bins(steps, bin_size, time_step)
+        size = self.map.size
+
+        keys = []
+        for i in range(len(offsets) - 1):
+            path = self._valid_path(pixels[offsets[i]:offsets[i+1]])
+            path_bins = bins[offsets[i]:offsets[i] + len(path)]
+            #Stamp the part of the path in each bin separately
+            bounds = np.flatnonzero(np.diff(path_bins)) + 1
+            for start, stop in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(path)]))):
+                if stop > start:
+                    keys.append(path_bins[start] * size + self._stamp_path(path[start:stop]))
+        with metrics.timer('reduce'):
+            return sparse_counts(keys)
+
+    @staticmethod
+    def _time_bins(steps: np.ndarray, bin_size: float, time_step: float)-> np.ndarray:
+        """Time bin of each step"""
+        #Tolerate rounding in the product, e.g. 30*0.1 = 2.9999...
+        return np.floor(steps * (time_step / bin_size) + 1e-9).astype(np.int64)
+
+    def _sparse_visitation_counts(self, 
+        episodes: Iterable[List[List[List[float]]]],
+        cache: Optional[ContributionCache] = None,
+        time_bins: Optional[Tuple[float, float]] = None
+        )-> Tuple[np.ndarray, np.ndarray]:
+        """Compute the visitation counts of a set of episodes without
+        allocating an array of the size of the map.
+
+        Parameters
+        ----------
+            episodes
+                Episodes to compute the visitation counts of
+            cache
+                Cache of the contribution of each episode to the counts,
+                not used for counts in time bins
+            time_bins
+                Bin size and time step to count visits in time bins, see
+                compute_temporal_counts, or None to count all the visits
+                together
+
+        Returns
+        -------
+            np.ndarray
+                Sorted flat indices into the map of the visited pixels, or
+                keys bin*map size + flat index with time bins
+            np.ndarray
+                Number of times each of those pixels has been visited
+        """
+        key = self._contribution_key() if cache is not None and time_bins is None else None
+        indices, counts = sparse_counts([])
+        pending_indices, pending_counts = [], []
+        pending_size = 0
+
+        for paths, radii in self._episodes_with_radii(episodes):
+            if time_bins is None:
+                episode_indices, episode_counts = self._episode_visitation_counts(paths, cache, key, radii)
+            else:
+                episode_indices, episode_counts = self._episode_temporal_counts(paths, *time_bins, radii)
+            pending_indices.append(episode_indices)
+            pending_counts.append(episode_counts)
+            pending_size += len(episode_indices)
+            #Merge periodically to bound the memory of the pending indices
+            if pending_size > self._sparse_merge_size:
+                with metrics.timer('reduce'):
+                    indices, counts = sparse_counts([indices] + pending_indices, [counts] + pending_counts)
+                pending_indices, pending_counts, pending_size = [], [], 0
+
+        with metrics.timer('reduce'):
+            return sparse_counts([indices] + pending_indices, [counts] + pending_counts)
+
+    def _episode_swept_areas(self,
+        paths: List[List[List[float]]],
+        radii: Optional[np.ndarray] = None
+        )-> Iterator[np.ndarray]:
+        """Compute the swept area of each path of an episode
 
-    def compute_visitation_counts(self)-> None:
-        """Compute the number of times each pixel has been visited by the agents"""
-        logging.debug('Computing visitation counts for '+self.env_name+"...")
-        if self.episodes:
-            for paths in self.episodes:
-                self._check_path_lengths(paths)
-                for path in paths:
-                    pixel_path = self._raytrace_path(path)
-                    swept_area = self._swept_area(pixel_path)
-                    self.visitation_counts += swept_area
+        Parameters
+        ----------
+            paths
+                List of paths for the agents of the episode
+            radii
+                Radius of the agent of each path, see agent_radii
+
+        Yields
+        ------
+            np.ndarray
+                Sorted flat indices into the map of the pixels visited
+                along each path
+        """
+        if self._uses_footprint_stamps:
+            keys, _ = self._stamp_episode(paths, radii)
+            bounds = np.searchsorted(keys, np.arange(len(paths) + 1) * self.map.size)
+            for i in range(len(paths)):
+                yield keys[bounds[i]:bounds[i+1]] - i * self.map.size
+            return
+
+        self._check_path_lengths(paths)
+        paths = np.asarray(paths, dtype=float).reshape(len(paths), -1, 2)
+        pixels, offsets = self._raytrace_paths(paths)
+        for i in range(len(offsets) - 1):
+            yield self._swept_area(pixels[offsets[i]:offsets[i+1]])
+
+    def _stamp_episode(self,
+        paths: List[List[List[float]]],
+        radii: Optional[np.ndarray] = None,
+        time_bins: Optional[Tuple[float, float]] = None
+        )-> Tuple[np.ndarray, int]:
+        """Compute the swept areas of the paths of an episode with the
+        footprint stamps of their radius and sub-pixel offset
+
+        Each path is validated against the configuration space of its
+        radius bucket, then the traced pixels of all the paths are grouped
+        by footprint stamp and stamped in batches, see stamp_footprints.
+        The pixels traced during the move from one position to the next
+        use the sub-pixel offset of the position the move starts from.
+
+        Parameters
+        ----------
+            paths
+                List of paths for the agents of the episode
+            radii
+                Radius of the agent of each path, see agent_radii
+            time_bins
+                Bin size and time step to split the swept area of each path
+                into time bins, see compute_temporal_counts
+
+        Returns
+        -------
+            np.ndarray
+                Sorted unique keys owner*map size + flat index into the map
+                of the swept pixels, where the owner is path*bins + bin
+            int
+                Number of time bins, 1 without time bins
+        """
+        self._check_path_lengths(paths)
+        paths = np.asarray(paths, dtype=float).reshape(len(paths), -1, 2)
+        pixels, offsets, steps = self._raytrace_paths(paths, return_steps=True)
+        path_ids = np.repeat(np.arange(len(paths)), np.diff(offsets))
+
+        if radii is None:
+            radii = np.full(len(paths), np.nan)
+        path_radii = self._radius_buckets(radii)
+
+        keep = np.zeros(len(pixels), dtype=bool)
+        for i in range(len(paths)):
+            valid = self._valid_path(pixels[offsets[i]:offsets[i+1]], path_radii[i])
+            keep[offsets[i]:offsets[i] + len(valid)] = True
+
+        if self._footprints.subpixel_steps > 1:
+            positions = paths[path_ids, steps][:, ::-1] * self.pix_per_meter
+            levels = self._footprints.offset_levels(positions - np.rint(positions))
+        else:
+            levels = np.zeros((len(pixels), 2), dtype=np.int64)
+
+        num_bins = 1
+        owners = path_ids
+        if time_bins is not None:
+            bins = self._time_bins(steps, *time_bins)
+            num_bins = int(bins.max()) + 1 if len(bins) else 1
+            owners = path_ids * num_bins + bins
+
+        stamp_keys, stamps = np.unique(np.column_stack((path_radii[path_ids], levels))[keep],
+            axis=0, return_inverse=True)
+        footprints = [self._footprints.stamp(*stamp_key) for stamp_key in stamp_keys]
+        with metrics.timer('stamping'):
+            keys = stamp_footprints(pixels[keep], owners[keep], footprints, stamps.reshape(-1), self.map.shape)
+        metrics.count('pixels stamped', len(keys))
+        return keys, num_bins
 
     def _swept_area(self, path: List[List[float]])-> np.ndarray:
         """Compute the swept area of the agent for a given path
@@ -105,21 +685,60 @@ class Environment:
         Returns
         -------
         np.ndarray
-            Array of the same size as the map, where the each pixel visited
-            by the agent is set to 1, and the rest are set to 0
+            Sorted flat indices into the map of each pixel visited by
+            the agent, empty if the path is not valid
         """
-        logging.debug('Computing swept area for '+self.env_name+"...")
-        swept_area = np.zeros(self.map.shape)
+        return self._stamp_path(self._valid_path(path))
 
-        if self._is_path_valid(path):
-            for pos in path:
-                min_col = pos[1] - self._max_agent_radius
-                max_col = pos[1] + self._min_agent_radius
-                min_row = pos[0] - self._max_agent_radius
-                max_row = pos[0] + self._min_agent_radius
-                swept_area[min_row:max_row, min_col:max_col] += self._agent_mask
+    def _valid_path(self, path: List[List[float]], radius: Optional[float] = None)-> np.ndarray:
+        """Get the part of a path that is counted: the whole path if it is
+        valid, otherwise the part before its first invalid position if
+        truncate_invalid_paths is set, or nothing
 
-        return (swept_area>0).astype(int)
+        Parameters
+        ----------
+        path
+            List of pixel positions of the agent
+        radius
+            Radius bucket of the agent in pixels, see
+            FootprintCache.radius_buckets, or None for agent_radius
+
+        Returns
+        -------
+        np.ndarray
+            Array of the pixel positions to count
+        """
+        path = np.asarray(path, dtype=np.int64).reshape(-1, 2)
+        metrics.count('paths processed')
+        with metrics.timer('validity'):
+            invalid_index = self._first_invalid_index(path, radius)
+        if invalid_index >= 0:
+            metrics.count('paths truncated' if self.truncate_invalid_paths else 'paths rejected')
+            path = path[:invalid_index] if self.truncate_invalid_paths else path[:0]
+        return path
+
+    def _stamp_path(self, path: np.ndarray)-> np.ndarray:
+        """Compute the swept area of the agent along valid pixel positions
+
+        Parameters
+        ----------
+        path
+            Array of pixel positions of the agent, see _valid_path
+
+        Returns
+        -------
+        np.ndarray
+            Sorted flat indices into the map of each pixel visited by
+            the agent
+        """
+        if len(path) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        with metrics.timer('stamping'):
+            area = swept_area(path, self.map.shape, self._agent_mask,
+                self._max_agent_radius, self.swept_area_engine)
+        metrics.count('pixels stamped', len(area))
+        return area
 
     def _is_path_valid(self, path: List[List[float]])-> bool:
         """Check if a path goes through obstacles
@@ -134,10 +753,37 @@ class Environment:
             bool
                 True if the path is valid, False otherwise
         """
-        for pos in path:
-            if self.map[pos[0], pos[1]] == self.obstacle:
-                return False
-        return True
+        return self._first_invalid_index(path) < 0
+
+    def _first_invalid_index(self, path: List[List[float]], radius: Optional[float] = None)-> int:
+        """Find the first position of a path that is outside the map or
+        in collision with an obstacle, according to path_validation
+
+        Parameters
+        ----------
+            path
+                List of pixel positions of the agent
+            radius
+                Radius bucket of the agent in pixels, or None for
+                agent_radius
+
+        Returns
+        -------
+            int
+                Index of the first invalid position, -1 if the path is valid
+        """
+        path = np.asarray(path, dtype=np.int64).reshape(-1, 2)
+        rows, cols = path[:, 0], path[:, 1]
+        outside = (rows < 0) | (rows >= self.map.shape[0]) | (cols < 0) | (cols >= self.map.shape[1])
+        rows = np.where(outside, 0, rows)
+        cols = np.where(outside, 0, cols)
+
+        if self.path_validation == 'footprint':
+            invalid = outside | self._configuration_space_for(radius)[rows, cols]
+        else:
+            invalid = outside | (self.map[rows, cols] == self.obstacle)
+
+        return int(np.argmax(invalid)) if invalid.any() else -1
 
     def _check_path_lengths(self, paths: List[List[List[float]]])-> None:
         """Check if the paths are of the same length
@@ -157,7 +803,7 @@ class Environment:
         if not all(len(p) == path_len for p in it):
             raise ValueError('Paths of varying lengths')
 
-    def _path_world_to_pixel(self, path: List[List[float]])-> List[List[float]]:
+    def _path_world_to_pixel(self, path: List[List[float]])-> np.ndarray:
         """Convert a path from world coordinates to pixel coordinates.
         
         Parameters
@@ -167,24 +813,88 @@ class Environment:
             
         Returns
         -------
-            List[List[float]]  
-                List of agent positions in pixel coordinates
+            np.ndarray  
+                Array of agent positions in pixel coordinates, positions
+                with NaN coordinates are dropped
+        """
+        pixels, _ = self._paths_world_to_pixel(np.asarray(path, dtype=float).reshape(1, -1, 2))
+        return pixels
+
+    def _paths_world_to_pixel(self,
+        paths: np.ndarray,
+        return_steps: bool = False
+        )-> Tuple[np.ndarray, ...]:
+        """Convert all the paths of an episode from world coordinates to
+        pixel coordinates.
+
+        Parameters
+        ----------
+            paths
+                Array of agent positions in world coordinates, with shape
+                (paths x timesteps x 2)
+            return_steps
+                If True, also return the step of each position
+
+        Returns
+        -------
+            np.ndarray
+                Array of agent positions in pixel coordinates for all paths,
+                positions with NaN coordinates are dropped
+            np.ndarray
+                Offsets into the pixel array, where the positions of path i
+                are pixels[offsets[i]:offsets[i+1]]
+            np.ndarray
+                Step of each position in its path, if return_steps is True
         """
         #Assume center of map is at (0,0)
-        offset_x = self.map.shape[1]//2
-        offset_y = self.map.shape[0]//2
-        pixel_path = []
+        with metrics.timer('world_to_pixel'):
+            paths = np.asarray(paths, dtype=float)
+            valid = ~np.isnan(paths).any(axis=2)
 
-        for pos in path:
-            if isnan(pos[0]) or isnan(pos[1]):
-                continue
-            x_pos = offset_x + round(pos[0]*self.pix_per_meter)
-            y_pos = offset_y + round(pos[1]*self.pix_per_meter)
-            pixel_path.append([y_pos, x_pos])
+            pixels = self._world_to_pixel(paths[valid])
+            offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+            np.cumsum(valid.sum(axis=1), out=offsets[1:])
 
-        return pixel_path
+        if return_steps:
+            return pixels, offsets, np.nonzero(valid)[1]
+        return pixels, offsets
 
-    def _raytrace_path(self, path: List[List[float]])-> List[List[float]]:
+    def _world_to_pixel(self, positions: np.ndarray)-> np.ndarray:
+        """Convert positions from world coordinates to the nearest pixel,
+        without dropping positions outside the map
+
+        Parameters
+        ----------
+            positions
+                Array of (x, y) positions in world coordinates
+
+        Returns
+        -------
+            np.ndarray
+                Array of (row, col) pixel positions
+        """
+        offset = np.array([self.map.shape[0]//2, self.map.shape[1]//2])
+        positions = np.asarray(positions, dtype=float)
+        return offset + np.rint(positions[..., ::-1]*self.pix_per_meter).astype(np.int64)
+
+    def _pixel_to_world(self, pixels: np.ndarray)-> np.ndarray:
+        """Convert pixel positions to the world coordinates of the pixel
+        centers, the inverse of _world_to_pixel
+
+        Parameters
+        ----------
+            pixels
+                Array of (row, col) pixel positions
+
+        Returns
+        -------
+            np.ndarray
+                Array of (x, y) positions in world coordinates
+        """
+        offset = np.array([self.map.shape[0]//2, self.map.shape[1]//2])
+        return (np.asarray(pixels)[..., ::-1] - offset[::-1]) / self.pix_per_meter
+
+    def _raytrace_path(self, path: List[List[float]])-> np.ndarray:
         """Raytrace a path to find all the pixels visited by the agent.
 
         Parameters 
@@ -194,18 +904,56 @@ class Environment:
         
         Returns
         -------
-            List[List[float]]
-                List of all agent positions in pixel coordinates
+            np.ndarray
+                Array of all agent positions in pixel coordinates
         """
-        coarse_pixel_path = self._path_world_to_pixel(path)
-        pixel_path = []
+        pixels, _ = self._raytrace_paths(np.asarray(path, dtype=float).reshape(1, -1, 2))
+        return pixels
 
-        for i in range(1, len(coarse_pixel_path)):
-            prev_pixel = np.asarray([coarse_pixel_path[i-1]])
-            next_pixel = np.asarray([coarse_pixel_path[i]])
-            pixel_path.extend(bresenham_line(prev_pixel, next_pixel, -1))
+    def _raytrace_paths(self,
+        paths: np.ndarray,
+        return_steps: bool = False
+        )-> Tuple[np.ndarray, ...]:
+        """Raytrace all the paths of an episode at once to find the pixels
+        visited by each agent.
 
-        return pixel_path
+        Parameters
+        ----------
+            paths
+                Array of agent positions in world coordinates, with shape
+                (paths x timesteps x 2)
+            return_steps
+                If True, also return the step each pixel is visited at,
+                which is the step at the start of the move through it
+
+        Returns
+        -------
+            np.ndarray
+                Array of all agent positions in pixel coordinates for all
+                paths
+            np.ndarray
+                Offsets into the pixel array, where the positions of path i
+                are pixels[offsets[i]:offsets[i+1]]
+            np.ndarray
+                Step of each pixel, if return_steps is True
+        """
+        coarse = self._paths_world_to_pixel(paths, return_steps)
+        coarse_pixels, coarse_offsets = coarse[:2]
+
+        with metrics.timer('raytrace'):
+            #Segments join consecutive positions of the same path
+            is_start = np.ones(len(coarse_pixels), dtype=bool)
+            is_start[coarse_offsets[1:][np.diff(coarse_offsets) > 0] - 1] = False
+            is_start = np.flatnonzero(is_start[:-1])
+            pixels, segment = bresenham_segments(coarse_pixels[is_start], coarse_pixels[is_start + 1])
+
+            path_of_start = np.searchsorted(coarse_offsets, is_start, side='right') - 1
+            offsets = np.zeros(len(coarse_offsets), dtype=np.int64)
+            np.cumsum(np.bincount(path_of_start[segment], minlength=len(paths)), out=offsets[1:])
+
+        if return_steps:
+            return pixels, offsets, coarse[2][is_start][segment]
+        return pixels, offsets
 
     def display_map(self)-> None:
         """Display the map"""
@@ -213,14 +961,17 @@ class Environment:
         im = im / np.max(im)
         im *= 255
         
+        from PIL import Image
         image = Image.fromarray(im.astype(np.uint8))
         image.show()
 
     def display_visitation_counts(self)-> None:
         """Display the visitation counts"""
         im = np.copy(self.map) 
-        normalized_vis_counts = self.visitation_counts / np.max(self.visitation_counts)
-        im[self.visitation_counts>0] = normalized_vis_counts[self.visitation_counts>0]*255
+        visitation_counts = np.asarray(self.visitation_counts)
+        normalized_vis_counts = visitation_counts / np.max(visitation_counts)
+        im[visitation_counts>0] = normalized_vis_counts[visitation_counts>0]*255
+        from PIL import Image
         image = Image.fromarray(im.astype(np.uint8))
         image.show()   
 
@@ -236,14 +987,71 @@ class Environment:
         preds = self.predicted_occupancy[model_name]
         normalized_vis_counts = preds / np.max(preds)
         im[preds>0] = normalized_vis_counts[preds>0]*255
+        from PIL import Image
         image = Image.fromarray(im.astype(np.uint8))
         image.show()   
 
+    def heatmap_values(self, source: str = 'visitation_counts')-> np.ndarray:
+        """Get the values shown by a heatmap of the map
+
+        Parameters
+        ----------
+            source
+                'visitation_counts', or the name of a model in
+                predicted_occupancy
+
+        Returns
+        -------
+            np.ndarray
+                Array of the values, of the shape of the map
+        """
+        if source == 'visitation_counts':
+            return np.asarray(self.visitation_counts)
+        if source not in self.predicted_occupancy:
+            raise ValueError('No occupancy predicted by ' + str(source) + ' for ' + self.env_name)
+        return np.asarray(self.predicted_occupancy[source])
+
+    def export_heatmap(self,
+        directory: str,
+        source: str = 'visitation_counts',
+        **options: Any
+        )-> Dict[str, int]:
+        """Write a heatmap of the visitation counts or of predicted occupancy
+        as a pyramid of PNG tiles, without displaying anything. Tiles whose
+        source region did not change since the last export to the same
+        directory are skipped, see opam.visualization.core.export_tile_pyramid.
+
+        Parameters
+        ----------
+            directory
+                Directory of the tiles
+            source
+                'visitation_counts', or the name of a model in
+                predicted_occupancy
+            **options
+                Options of export_tile_pyramid, like tile_size, colormap,
+                scale and vmax
+
+        Returns
+        -------
+            Dict[str, int]
+                Number of tiles written, skipped and removed, and the
+                largest zoom level
+        """
+        return export_tile_pyramid(self.heatmap_values(source), self.map == self.free, directory, **options)
+
     def get_segmentation_mask(self, 
         num_classes: int, 
         class_distribution: List[float]
         )-> np.ndarray:
         """Get the segmentation mask of the map based on the visitation counts.
+
+        Visited pixels are split into classes of increasing visitation
+        counts, with the fraction of visited pixels in each class given
+        by class_distribution. Pixels that were never visited, including
+        obstacles, belong to class 0. Thresholds are found from a
+        histogram or a partition of the non-zero counts, without sorting
+        the map (see opam.utils.annotation.class_thresholds).
         
         Parameters
         ----------
@@ -251,13 +1059,84 @@ class Environment:
                 Number of classes in the segmentation mask
             class_distribution
                 List defininng the distribution of the classes in 
-                the segmentation mask."""
+                the segmentation mask.
 
-        #TODO: Check class_distribution is valid (non-negative, sum to 1)
-        #TODO: Check num_classes is valid (>= 2)
-        #TODO: Check visitation_counts is not empty
-        #TODO: Check num_classes == len(class_distribution)
-        pass
+        Returns
+        -------
+            np.ndarray
+                Array of the size of the map with the class of each pixel
+
+        Raises
+        ------
+            ValueError
+                If the arguments are not valid or the environment has no
+                visitation counts
+        """
+        thresholds = self.get_segmentation_thresholds(num_classes, class_distribution)
+        blocks = self._count_blocks()
+
+        dtype = np.uint8 if num_classes <= 256 else np.uint16
+        mask = np.zeros(self.map.shape, dtype=dtype)
+        size = self.visitation_counts.tile_size if isinstance(self.visitation_counts, TiledArray) else 0
+        for (row, col), block in blocks:
+            mask[row*size:row*size + block.shape[0], col*size:col*size + block.shape[1]] = \
+                segmentation_mask(block, thresholds, dtype)
+        return mask
+
+    def get_segmentation_thresholds(self,
+        num_classes: int,
+        class_distribution: List[float]
+        )-> np.ndarray:
+        """Get the visitation count thresholds between the classes of the
+        segmentation mask, see get_segmentation_mask. Class k holds the
+        visited pixels with counts in (thresholds[k-1], thresholds[k]].
+
+        Parameters
+        ----------
+            num_classes
+                Number of classes in the segmentation mask
+            class_distribution
+                List defininng the distribution of the classes in 
+                the segmentation mask.
+
+        Returns
+        -------
+            np.ndarray
+                Array of num_classes - 1 increasing thresholds
+
+        Raises
+        ------
+            ValueError
+                If the arguments are not valid or the environment has no
+                visitation counts
+        """
+        class_distribution = self._check_class_distribution(num_classes, class_distribution)
+        if self.visitation_counts is None or not self.visitation_counts.max() > 0:
+            raise ValueError('No visitation counts to segment for ' + self.env_name)
+        return class_thresholds(np.concatenate([block[block > 0] for _, block in self._count_blocks()]),
+            class_distribution)
+
+    def _count_blocks(self)-> List[Tuple[Tuple[int, int], np.ndarray]]:
+        """Blocks of the visitation counts with their (row, col) tile index,
+        the allocated tiles of tiled counts or a single block otherwise
+        """
+        if isinstance(self.visitation_counts, TiledArray):
+            return list(self.visitation_counts.tiles.items())
+        return [((0, 0), self.visitation_counts)]
+
+    @staticmethod
+    def _check_class_distribution(num_classes: int, class_distribution: List[float])-> np.ndarray:
+        """Validate the arguments of get_segmentation_mask and return the
+        class distribution as an array.
+        """
+        if num_classes < 2:
+            raise ValueError('The segmentation mask needs at least 2 classes, got ' + str(num_classes))
+        class_distribution = np.asarray(class_distribution, dtype=float)
+        if class_distribution.ndim != 1 or len(class_distribution) != num_classes:
+            raise ValueError('Expected a class distribution of length ' + str(num_classes))
+        if np.any(class_distribution < 0) or not np.isclose(class_distribution.sum(), 1):
+            raise ValueError('The class distribution must be non-negative and sum to 1')
+        return class_distribution
     
 
 
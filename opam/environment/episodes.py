@@ -0,0 +1,218 @@
+import numpy as np
+from typing import Any, Iterable, Iterator, List, Optional, Union
+
+
+class Episode:
+    """Read-only view of the paths of a single episode in an EpisodeStore
+
+    Behaves like the list of paths used for episodes elsewhere in OPAM,
+    where each path is a zero-copy (timesteps x 2) view into the store.
+
+    Parameters
+    ----------
+    coords
+        Array of positions of all the paths in the store
+    path_offsets
+        Offsets of the paths of this episode into coords, where path i
+        is coords[path_offsets[i]:path_offsets[i+1]]
+    """
+
+    def __init__(self, coords: np.ndarray, path_offsets: np.ndarray)-> None:
+        self._coords = coords
+        self._path_offsets = path_offsets
+
+    def __len__(self)-> int:
+        return len(self._path_offsets) - 1
+
+    def __getitem__(self, index: int)-> np.ndarray:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Path index out of range')
+        return self._coords[self._path_offsets[index]:self._path_offsets[index+1]]
+
+    def __iter__(self)-> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype: Any = None, copy: Optional[bool] = None)-> np.ndarray:
+        array = self.as_array()
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    @property
+    def path_lengths(self)-> np.ndarray:
+        """Number of positions in each path"""
+        return np.diff(self._path_offsets)
+
+    def as_array(self)-> np.ndarray:
+        """Return the paths of the episode as a (paths x timesteps x 2) view
+
+        Raises
+        ------
+            ValueError
+                If the paths are not of the same length
+        """
+        lengths = self.path_lengths
+        if len(lengths) and np.any(lengths != lengths[0]):
+            raise ValueError('Paths of varying lengths')
+        num_steps = lengths[0] if len(lengths) else 0
+        start = self._path_offsets[0]
+        return self._coords[start:start + len(self)*num_steps].reshape(len(self), num_steps, 2)
+
+
+class EpisodeStore:
+    """Columnar storage of the episodes of an environment
+
+    All positions are kept in a single contiguous (points x 2) array and
+    the paths and episodes are indexed with offsets, which avoids keeping
+    a Python object per coordinate. Iterating over the store yields one
+    Episode per episode, so it can be used wherever a list of episodes
+    (List[List[List[float]]]) is expected.
+
+    Parameters
+    ----------
+    coords
+        Array of positions of all the paths, with shape (points x 2)
+    path_offsets
+        Offsets of the paths into coords, where path i is
+        coords[path_offsets[i]:path_offsets[i+1]]
+    episode_offsets
+        Offsets of the episodes into the paths, where episode i has
+        paths episode_offsets[i] to episode_offsets[i+1] - 1
+
+    Attributes
+    ----------
+    coords
+        See above
+    path_offsets
+        See above
+    episode_offsets
+        See above
+    """
+
+    def __init__(self,
+        coords: np.ndarray,
+        path_offsets: np.ndarray,
+        episode_offsets: np.ndarray
+        )-> None:
+
+        self.coords = coords
+        self.path_offsets = np.asarray(path_offsets, dtype=np.int64)
+        self.episode_offsets = np.asarray(episode_offsets, dtype=np.int64)
+
+        if self.coords.ndim != 2 or self.coords.shape[1] != 2:
+            raise ValueError('Coordinates must have shape (points x 2)')
+        if self.path_offsets[-1] > len(self.coords) \
+            or self.episode_offsets[-1] >= len(self.path_offsets):
+            raise ValueError('Offsets out of range of the coordinates')
+
+    @classmethod
+    def from_lists(cls,
+        episodes: Iterable[List[List[List[float]]]],
+        dtype: Any = np.float32
+        )-> 'EpisodeStore':
+        """Build a store from nested lists of episodes, paths and positions.
+
+        Parameters
+        ----------
+            episodes
+                Iterable of episodes, where each episode is a list of
+                paths and each path a list of [x, y] positions
+            dtype
+                Data type of the stored coordinates
+
+        Returns
+        -------
+            EpisodeStore
+                Store holding a copy of the episodes
+        """
+        blocks = []
+        path_lengths = []
+        episode_lengths = []
+
+        for paths in episodes:
+            episode_lengths.append(len(paths))
+            for path in paths:
+                block = np.asarray(path, dtype=dtype).reshape(-1, 2)
+                blocks.append(block)
+                path_lengths.append(len(block))
+
+        coords = np.concatenate(blocks) if blocks else np.zeros((0, 2), dtype=dtype)
+        return cls(coords, _offsets(path_lengths), _offsets(episode_lengths))
+
+    @classmethod
+    def concatenate(cls, stores: Iterable['EpisodeStore'])-> 'EpisodeStore':
+        """Concatenate several stores into a new one.
+
+        Parameters
+        ----------
+            stores
+                Stores to concatenate, in order
+
+        Returns
+        -------
+            EpisodeStore
+                Store holding a copy of the episodes of all the stores
+        """
+        stores = list(stores)
+        if not stores:
+            return cls.from_lists([])
+        coords = np.concatenate([s.coords[s.path_offsets[0]:s.path_offsets[-1]] for s in stores])
+        path_lengths = np.concatenate([np.diff(s.path_offsets) for s in stores])
+        episode_lengths = np.concatenate([np.diff(s.episode_offsets) for s in stores])
+        return cls(coords, _offsets(path_lengths), _offsets(episode_lengths))
+
+    def __len__(self)-> int:
+        return len(self.episode_offsets) - 1
+
+    def __getitem__(self, index: Union[int, slice])-> Union[Episode, 'EpisodeStore']:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('Episode slices must be contiguous')
+            stop = max(start, stop)
+            episode_offsets = self.episode_offsets[start:stop+1]
+            path_offsets = self.path_offsets[episode_offsets[0]:episode_offsets[-1]+1]
+            return EpisodeStore(self.coords, path_offsets, episode_offsets - episode_offsets[0])
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Episode index out of range')
+        first, last = self.episode_offsets[index], self.episode_offsets[index+1]
+        return Episode(self.coords, self.path_offsets[first:last+1])
+
+    def __iter__(self)-> Iterator[Episode]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def num_paths(self)-> int:
+        """Total number of paths in the store"""
+        return int(self.episode_offsets[-1] - self.episode_offsets[0])
+
+    @property
+    def num_points(self)-> int:
+        """Total number of positions in the store"""
+        return int(self.path_offsets[-1] - self.path_offsets[0])
+
+    @property
+    def nbytes(self)-> int:
+        """Number of bytes used by the coordinates and offsets"""
+        return self.coords.nbytes + self.path_offsets.nbytes + self.episode_offsets.nbytes
+
+    def path(self, index: int)-> np.ndarray:
+        """Return a zero-copy view of a path, indexed across all episodes"""
+        return self.coords[self.path_offsets[index]:self.path_offsets[index+1]]
+
+    def to_lists(self)-> List[List[List[List[float]]]]:
+        """Return the episodes as nested lists of Python floats"""
+        return [[path.tolist() for path in episode] for episode in self]
+
+
+def _offsets(lengths: Iterable[int])-> np.ndarray:
+    """Convert a sequence of lengths into an offset array"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
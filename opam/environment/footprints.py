@@ -0,0 +1,209 @@
+import numpy as np
+from math import ceil
+from typing import Dict, List, NamedTuple, Tuple
+
+from opam.utils.annotation import footprint_offsets, make_gaussian
+
+
+def footprint_mask(radius: float, offset: Tuple[float, float] = (0.0, 0.0))-> Tuple[np.ndarray, int]:
+    """Footprint of an agent centered at a sub-pixel offset from the pixel
+    it is stamped on
+
+    With a zero offset this is the mask Environment has always used for
+    agent_radius: a disk of the pixels where a gaussian whose full width at
+    half maximum is the diameter of the agent rounds to 1. Offset masks get
+    a border of one pixel so the shifted disk fits.
+
+    Parameters
+    ----------
+    radius
+        Radius of the agent in pixels
+    offset
+        Offset in pixels of the (row, col) center of the agent from its
+        anchor pixel, between -0.5 and 0.5
+
+    Returns
+    -------
+    np.ndarray
+        Square footprint mask
+    int
+        Index of the mask pixel placed on the agent position
+    """
+    max_radius = ceil(radius)
+    diameter = max_radius + round(radius)
+    if offset[0] == 0 and offset[1] == 0:
+        return np.rint(make_gaussian(diameter, fwhm=diameter)), max_radius
+    center = diameter // 2 + 1
+    mask = make_gaussian(diameter + 2, fwhm=diameter, center=(center + offset[1], center + offset[0]))
+    return np.rint(mask), max_radius + 1
+
+
+class Footprint(NamedTuple):
+    """Footprint stamp of an agent
+
+    Attributes
+    ----------
+    mask
+        Square footprint mask
+    anchor
+        Index of the mask pixel placed on the agent position
+    rows
+        Row offsets of the pixels of the footprint from the agent position
+    cols
+        Column offsets of the pixels of the footprint from the agent
+        position
+    """
+    mask: np.ndarray
+    anchor: int
+    rows: np.ndarray
+    cols: np.ndarray
+
+
+class FootprintCache:
+    """Footprint stamps of agents of different radii, keyed by radius
+    bucket and quantized sub-pixel offset
+
+    Radii are rounded to multiples of radius_resolution, except the
+    default radius of the environment, which is kept exact so its stamp
+    is the mask of Environment._agent_mask. Sub-pixel offsets are split
+    into subpixel_steps levels of 1/subpixel_steps of a pixel, each stamped
+    at the center of its level, so offsets of -0.5 and 0.5, which are the
+    same footprint on neighbouring pixels, never get stamps of their own.
+    Each stamp is built once, the first time it is needed.
+
+    Parameters
+    ----------
+    default_radius
+        Radius in pixels of agents without a radius of their own
+    radius_resolution
+        Size in pixels of the radius buckets
+    subpixel_steps
+        Number of offset levels per pixel, 1 to always stamp at the
+        nearest pixel
+
+    Attributes
+    ----------
+    default_radius
+        See above
+    radius_resolution
+        See above
+    subpixel_steps
+        See above
+    """
+
+    def __init__(self,
+        default_radius: float,
+        radius_resolution: float = 0.1,
+        subpixel_steps: int = 1
+        )-> None:
+        if not radius_resolution > 0:
+            raise ValueError('The radius resolution must be positive, got ' + str(radius_resolution))
+        if subpixel_steps < 1:
+            raise ValueError('The number of sub-pixel steps must be positive, got ' + str(subpixel_steps))
+        self.default_radius = default_radius
+        self.radius_resolution = radius_resolution
+        self.subpixel_steps = subpixel_steps
+        self._stamps: Dict[Tuple[float, int, int], Footprint] = {}
+
+    def radius_buckets(self, radii: np.ndarray)-> np.ndarray:
+        """Round radii in pixels to their bucket, NaN radii and radii
+        equal to the default radius being the default radius
+        """
+        radii = np.asarray(radii, dtype=float)
+        #Round away the floating point error of the product so equal buckets compare equal
+        buckets = np.round(np.rint(radii / self.radius_resolution) * self.radius_resolution, 10)
+        default = np.isnan(radii) | np.isclose(radii, self.default_radius)
+        return np.where(default, self.default_radius, buckets)
+
+    def offset_levels(self, fractions: np.ndarray)-> np.ndarray:
+        """Quantize sub-pixel offsets between -0.5 and 0.5 into the
+        subpixel_steps levels from -subpixel_steps // 2 to
+        (subpixel_steps - 1) // 2
+        """
+        half = self.subpixel_steps // 2
+        levels = np.floor((np.asarray(fractions) + 0.5) * self.subpixel_steps) - half
+        return np.clip(levels, -half, (self.subpixel_steps - 1) // 2).astype(np.int64)
+
+    def level_offset(self, level: int)-> float:
+        """Offset in pixels of the center of an offset level"""
+        #With an even number of steps no level is centered on the pixel
+        return (level + (1 - self.subpixel_steps % 2) / 2) / self.subpixel_steps
+
+    def stamp(self, radius: float, row_level: int = 0, col_level: int = 0)-> Footprint:
+        """Get the footprint of a radius bucket at a quantized offset"""
+        key = (float(radius), int(row_level), int(col_level))
+        footprint = self._stamps.get(key)
+        if footprint is None:
+            offset = (self.level_offset(row_level), self.level_offset(col_level))
+            mask, anchor = footprint_mask(radius, offset)
+            footprint = Footprint(mask, anchor, *footprint_offsets(mask, anchor))
+            self._stamps[key] = footprint
+        return footprint
+
+    def __len__(self)-> int:
+        return len(self._stamps)
+
+
+def stamp_footprints(
+    pixels: np.ndarray,
+    owners: np.ndarray,
+    footprints: List[Footprint],
+    stamps: np.ndarray,
+    shape: Tuple[int, int],
+    max_entries: int = 1 << 24
+    )-> np.ndarray:
+    """Stamp the footprints of many points at once, grouped by stamp
+
+    Each point belongs to an owner, like a path, and has a footprint. The
+    points are deduplicated, then all the points of each footprint are
+    stamped together with vectorized offsets, in chunks of at most
+    max_entries stamped pixels, so the cost does not depend on how the
+    points are spread over paths.
+
+    Parameters
+    ----------
+    pixels
+        Array of (row, col) pixel positions
+    owners
+        Non-negative owner of each point
+    footprints
+        Footprints used by the points
+    stamps
+        Index into footprints of the footprint of each point
+    shape
+        Shape of the map
+    max_entries
+        Largest number of pixels stamped at a time
+
+    Returns
+    -------
+    np.ndarray
+        Sorted unique keys owner*map size + flat index into the map of
+        the pixels covered by the footprints of each owner
+    """
+    size = shape[0] * shape[1]
+    pixels = np.asarray(pixels, dtype=np.int64).reshape(-1, 2)
+    if len(pixels) == 0:
+        return np.zeros(0, dtype=np.int64)
+    owners = np.asarray(owners, dtype=np.int64)
+    num_owners = int(owners.max()) + 1
+    flat = pixels[:, 0] * shape[1] + pixels[:, 1]
+    points = np.unique((np.asarray(stamps, dtype=np.int64) * num_owners + owners) * size + flat)
+    owner_stamps, flat = np.divmod(points, size)
+    point_stamps, point_owners = np.divmod(owner_stamps, num_owners)
+    rows, cols = np.divmod(flat, shape[1])
+
+    keys = []
+    bounds = np.searchsorted(point_stamps, np.arange(len(footprints) + 1))
+    for index, footprint in enumerate(footprints):
+        chunk = max(max_entries // max(len(footprint.rows), 1), 1)
+        for start in range(bounds[index], bounds[index + 1], chunk):
+            stop = min(start + chunk, bounds[index + 1])
+            stamped_rows = (rows[start:stop, np.newaxis] + footprint.rows).ravel()
+            stamped_cols = (cols[start:stop, np.newaxis] + footprint.cols).ravel()
+            inside = (stamped_rows >= 0) & (stamped_rows < shape[0]) \
+                & (stamped_cols >= 0) & (stamped_cols < shape[1])
+            stamped_owners = np.repeat(point_owners[start:stop], len(footprint.rows))
+            keys.append(np.unique(stamped_owners[inside] * size
+                + stamped_rows[inside] * shape[1] + stamped_cols[inside]))
+    return np.unique(np.concatenate(keys)) if keys else np.zeros(0, dtype=np.int64)
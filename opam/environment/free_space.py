@@ -0,0 +1,187 @@
+import numpy as np
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from opam.utils.cache import content_hash
+
+
+def connected_components(mask: np.ndarray)-> Tuple[np.ndarray, np.ndarray]:
+    """Label the 8-connected components of the True pixels of a mask.
+
+    Components are found with vectorized union-find over all the pairs
+    of neighboring pixels: each pair hooks the larger label onto the
+    smaller one, then pointer jumping flattens the label trees, until the
+    two pixels of every pair share a label.
+
+    Parameters
+    ----------
+    mask
+        Boolean array of the pixels to label
+
+    Returns
+    -------
+    np.ndarray
+        Flat indices of the True pixels of the mask, in increasing order
+    np.ndarray
+        Component of each of these pixels, numbered from 0 in order of
+        their first pixel
+    """
+    mask = np.asarray(mask, dtype=bool)
+    h, w = mask.shape
+    indices = np.flatnonzero(mask)
+    compact = np.full(mask.size, -1, dtype=np.int64)
+    compact[indices] = np.arange(len(indices))
+    compact = compact.reshape(h, w)
+
+    #Pairs of neighboring pixels to the right, below and on both diagonals below
+    pairs = []
+    for first, second in (
+        (compact[:, :-1], compact[:, 1:]),
+        (compact[:-1, :], compact[1:, :]),
+        (compact[:-1, :-1], compact[1:, 1:]),
+        (compact[:-1, 1:], compact[1:, :-1])):
+        both = (first >= 0) & (second >= 0)
+        pairs.append((first[both], second[both]))
+    u = np.concatenate([first for first, _ in pairs])
+    v = np.concatenate([second for _, second in pairs])
+
+    parent = np.arange(len(indices))
+    while True:
+        parent_u, parent_v = parent[u], parent[v]
+        linked = parent_u != parent_v
+        if not linked.any():
+            break
+        u, v = u[linked], v[linked]
+        parent_u, parent_v = parent_u[linked], parent_v[linked]
+        low = np.minimum(parent_u, parent_v)
+        np.minimum.at(parent, np.maximum(parent_u, parent_v), low)
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+    _, labels = np.unique(parent, return_inverse=True)
+    return indices, labels.reshape(-1)
+
+
+class FreeSpaceIndex:
+    """Index of the pixels where an agent fits, for fast position sampling
+
+    Free pixels are those outside the configuration space, i.e. the map
+    eroded by the agent footprint. They are grouped by 8-connected
+    component, so sampling a position is a random index into a table and
+    sampling a start and goal that are reachable from each other only
+    needs a random offset into the table of the start's component.
+
+    Parameters
+    ----------
+    free
+        Boolean array that is True where an agent fits
+
+    Attributes
+    ----------
+    shape
+        Shape of the map
+    pixels
+        Flat indices of the free pixels, sorted by component
+    component_offsets
+        Offsets of the components into pixels, where the pixels of
+        component i are pixels[component_offsets[i]:component_offsets[i+1]]
+    """
+
+    def __init__(self, free: np.ndarray)-> None:
+        self.shape = free.shape
+        indices, labels = connected_components(free)
+        order = np.argsort(labels, kind='stable')
+        self.pixels = indices[order]
+        sizes = np.bincount(labels)
+        self.component_offsets = np.concatenate(([0], np.cumsum(sizes)))
+
+    def __len__(self)-> int:
+        return len(self.pixels)
+
+    @property
+    def num_components(self)-> int:
+        return len(self.component_offsets) - 1
+
+    @property
+    def component_sizes(self)-> np.ndarray:
+        """Number of free pixels in each component"""
+        return np.diff(self.component_offsets)
+
+    def _check_not_empty(self)-> None:
+        if len(self.pixels) == 0:
+            raise ValueError('No free space to sample positions from')
+
+    def sample(self, rng: np.random.Generator, num_positions: int)-> np.ndarray:
+        """Sample free pixels uniformly
+
+        Returns
+        -------
+        np.ndarray
+            Array of (row, col) pixels
+        """
+        self._check_not_empty()
+        pixels = self.pixels[rng.integers(len(self.pixels), size=num_positions)]
+        return np.stack(np.divmod(pixels, self.shape[1]), axis=-1)
+
+    def sample_pairs(self,
+        rng: np.random.Generator,
+        num_pairs: int,
+        num_goals: Optional[int] = None
+        )-> Tuple[np.ndarray, np.ndarray]:
+        """Sample pairs of free pixels connected through free space
+
+        Starts are uniform over the free pixels and each goal is uniform
+        over the component of its start. With num_goals, goals are instead
+        drawn uniformly from a pool of num_goals free pixels, and each
+        start is uniform over the component of its goal, so there are at
+        most num_goals distinct goals.
+
+        Returns
+        -------
+        np.ndarray
+            Array of (row, col) start pixels
+        np.ndarray
+            Array of (row, col) goal pixels
+        """
+        self._check_not_empty()
+        if num_goals is not None:
+            pool = rng.integers(len(self.pixels), size=num_goals)
+            goals = pool[rng.integers(num_goals, size=num_pairs)]
+            components = np.searchsorted(self.component_offsets, goals, side='right') - 1
+            starts = self.component_offsets[components] + rng.integers(self.component_sizes[components])
+        else:
+            starts = rng.integers(len(self.pixels), size=num_pairs)
+            components = np.searchsorted(self.component_offsets, starts, side='right') - 1
+            goals = self.component_offsets[components] + rng.integers(self.component_sizes[components])
+        return (np.stack(np.divmod(self.pixels[starts], self.shape[1]), axis=-1),
+            np.stack(np.divmod(self.pixels[goals], self.shape[1]), axis=-1))
+
+
+_free_space_cache = OrderedDict()
+_FREE_SPACE_CACHE_SIZE = 8
+
+
+def free_space_index(env: 'Environment')-> FreeSpaceIndex:
+    """Build the free space index of an environment.
+
+    Results are cached by the content of the configuration space, so
+    environments sharing a map, and worker processes simulating several
+    batches of episodes, only build the index once.
+    """
+    key = content_hash(env.configuration_space)
+    if key in _free_space_cache:
+        _free_space_cache.move_to_end(key)
+        return _free_space_cache[key]
+
+    index = FreeSpaceIndex(~env.configuration_space)
+    logging.info('Indexed %d free pixels in %d components of %s',
+        len(index), index.num_components, env.env_name)
+
+    _free_space_cache[key] = index
+    if len(_free_space_cache) > _FREE_SPACE_CACHE_SIZE:
+        _free_space_cache.popitem(last=False)
+    return index
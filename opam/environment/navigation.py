@@ -0,0 +1,236 @@
+import numpy as np
+import logging
+from collections import OrderedDict
+from typing import Tuple
+
+from opam.utils.cache import content_hash
+
+
+#Neighbor offsets in (row, col) and their chamfer costs, where 2 and 3
+#approximate the lengths 1 and sqrt(2) of straight and diagonal steps
+_NEIGHBORS = np.array([[-1, 0], [1, 0], [0, -1], [0, 1], [-1, -1], [-1, 1], [1, -1], [1, 1]])
+_COSTS = np.array([2, 2, 2, 2, 3, 3, 3, 3])
+_COST_PER_PIXEL = 2
+
+#Distance fields by map and goal cell, least recently used first. The
+#size is a number of fields, each as large as the map, and grows to hold
+#the goal cells of any simulator, see reserve_fields
+_field_cache = OrderedDict()
+_field_cache_size = 32
+
+
+def reserve_fields(count: int)-> None:
+    """Make the distance field cache hold at least count fields"""
+    global _field_cache_size
+    _field_cache_size = max(_field_cache_size, count)
+
+
+def geodesic_distance(free: np.ndarray, sources: np.ndarray)-> np.ndarray:
+    """Distance from each free pixel to the nearest source pixel along
+    paths through free pixels.
+
+    Distances are computed with a bucketed Dijkstra search over the
+    8-connected pixel grid with chamfer costs of 2 for straight steps and
+    3 for diagonal steps. Costs are small integers, so the search keeps
+    one bucket per distance and expands whole buckets at a time.
+
+    Parameters
+    ----------
+    free
+        Boolean array that is True for the pixels paths can go through
+    sources
+        Flat indices of the source pixels into free, which must be free
+
+    Returns
+    -------
+    np.ndarray
+        Array of distances in pixels with the shape of free, inf for
+        obstacle pixels and pixels not connected to a source
+    """
+    h, w = free.shape
+    padded = np.pad(np.asarray(free, dtype=bool), 1)
+    width = w + 2
+    steps = _NEIGHBORS[:, 0]*width + _NEIGHBORS[:, 1]
+
+    unreached = np.iinfo(np.int64).max
+    cost = np.full(padded.size, unreached, dtype=np.int64)
+    rows, cols = np.divmod(np.asarray(sources, dtype=np.int64), w)
+    frontier = np.unique((rows + 1)*width + cols + 1)
+    frontier = frontier[padded.reshape(-1)[frontier]]
+    cost[frontier] = 0
+
+    buckets = {0: [frontier]}
+    current = 0
+    while buckets:
+        pixels = np.unique(np.concatenate(buckets.pop(current)))
+        #Pixels that were reached at a lower cost since they were queued
+        pixels = pixels[cost[pixels] == current]
+        for step, step_cost in zip(steps, _COSTS):
+            neighbors = pixels + step
+            candidate = current + step_cost
+            better = neighbors[padded.reshape(-1)[neighbors] & (cost[neighbors] > candidate)]
+            if len(better):
+                cost[better] = candidate
+                buckets.setdefault(candidate, []).append(better)
+        if buckets:
+            current = min(buckets)
+
+    distance = np.where(cost == unreached, np.inf, cost / _COST_PER_PIXEL)
+    return distance.reshape(h + 2, width)[1:-1, 1:-1]
+
+
+class Navigation:
+    """Navigation layer of an environment for goal directed agents
+
+    Goals are snapped to square goal cells, and the geodesic distance
+    from every free pixel of the configuration space to each goal cell
+    is computed once and cached. Agents follow the steepest descent of
+    the distance field of their goal cell around the walls, then head
+    straight to their exact goal once they are inside the cell.
+
+    Distance fields are kept in a module-level LRU cache keyed by the
+    content of the configuration space and the goal cell, so they are
+    shared by all agents, episodes and environments with the same map.
+    Each field costs a search over the whole map and as much memory as a
+    float32 copy of it, so simulators draw their goals from a small pool
+    and compute its fields once with prepare.
+
+    Parameters
+    ----------
+    environment
+        Environment to navigate in
+    goal_cell_size
+        Side of the goal cells in meters
+
+    Attributes
+    ----------
+    environment
+        See above
+    goal_cell_size
+        See above
+    """
+
+    def __init__(self, environment: 'Environment', goal_cell_size: float = 1.0)-> None:
+        self.environment = environment
+        self.goal_cell_size = goal_cell_size
+        self._map_key = None
+
+    @property
+    def _cell_pixels(self)-> int:
+        return max(1, int(round(self.goal_cell_size * self.environment.pix_per_meter)))
+
+    def goal_cells(self, goals: np.ndarray)-> np.ndarray:
+        """Return the (row, col) index of the goal cell of each goal"""
+        pixels = self.environment._world_to_pixel(np.asarray(goals, dtype=float).reshape(-1, 2))
+        return pixels // self._cell_pixels
+
+    def distance_field(self, cell: Tuple[int, int])-> np.ndarray:
+        """Geodesic distance in meters from each pixel to a goal cell
+
+        Parameters
+        ----------
+        cell
+            (row, col) index of the goal cell, as returned by goal_cells
+
+        Returns
+        -------
+        np.ndarray
+            Array of distances with the shape of the map, inf where the
+            goal cell cannot be reached
+        """
+        if self._map_key is None:
+            self._map_key = content_hash(self.environment.configuration_space, self.environment.pix_per_meter)
+        key = (self._map_key, self._cell_pixels, int(cell[0]), int(cell[1]))
+        if key in _field_cache:
+            _field_cache.move_to_end(key)
+            return _field_cache[key]
+
+        free = ~self.environment.configuration_space
+        size = self._cell_pixels
+        row0, col0 = max(0, cell[0]*size), max(0, cell[1]*size)
+        block = free[row0:max(0, (cell[0] + 1)*size), col0:max(0, (cell[1] + 1)*size)]
+        rows, cols = np.nonzero(block)
+        sources = (rows + row0)*free.shape[1] + cols + col0
+        field = (geodesic_distance(free, sources) / self.environment.pix_per_meter).astype(np.float32)
+        logging.debug('Computed the distance field of goal cell %s of %s', tuple(cell), self.environment.env_name)
+
+        _field_cache[key] = field
+        while len(_field_cache) > _field_cache_size:
+            _field_cache.popitem(last=False)
+        return field
+
+    def prepare(self, goals: np.ndarray)-> None:
+        """Compute the distance fields of the goal cells of goals, and make
+        the cache large enough to keep all of them
+
+        Parameters
+        ----------
+        goals
+            Array of (x, y) goals in world coordinates
+        """
+        cells = np.unique(self.goal_cells(goals), axis=0)
+        reserve_fields(len(cells))
+        for cell in cells:
+            self.distance_field(cell)
+
+    def preferred_directions(self, positions: np.ndarray, goals: np.ndarray)-> np.ndarray:
+        """Direction in which each agent should walk to reach its goal
+
+        Agents outside their goal cell step towards the neighboring pixel
+        that decreases the distance to the cell the most. Agents inside
+        their goal cell, or that cannot reach it, head straight to their
+        goal.
+
+        Parameters
+        ----------
+        positions
+            Array of (x, y) positions of the agents in world coordinates
+        goals
+            Array of (x, y) goals of the agents in world coordinates
+
+        Returns
+        -------
+        np.ndarray
+            Array of (x, y) unit vectors, zero for agents at their goal
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        goals = np.asarray(goals, dtype=float).reshape(-1, 2)
+        offsets = goals - positions
+        lengths = np.hypot(offsets[:, 0], offsets[:, 1])
+        directions = offsets / np.maximum(lengths, 1e-9)[:, np.newaxis]
+
+        h, w = self.environment.map.shape
+        pixels = self.environment._world_to_pixel(positions)
+        inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < h) & (pixels[:, 1] >= 0) & (pixels[:, 1] < w)
+        agents = np.flatnonzero(inside)
+        rows, cols = pixels[agents, 0], pixels[agents, 1]
+
+        #Flat indices of each agent's pixel followed by its neighbors
+        neighbor_rows = np.clip(rows[:, np.newaxis] + _NEIGHBORS[:, 0], 0, h - 1)
+        neighbor_cols = np.clip(cols[:, np.newaxis] + _NEIGHBORS[:, 1], 0, w - 1)
+        indices = np.concatenate(((rows*w + cols)[:, np.newaxis], neighbor_rows*w + neighbor_cols), axis=1)
+
+        #Gather the distances from the field of each goal cell in turn
+        cells = self.goal_cells(goals[agents])
+        unique_cells, agent_cells = np.unique(cells, axis=0, return_inverse=True)
+        order = np.argsort(agent_cells.reshape(-1), kind='stable')
+        bounds = np.searchsorted(agent_cells.reshape(-1)[order], np.arange(len(unique_cells) + 1))
+        values = np.empty(indices.shape, dtype=np.float32)
+        for index, cell in enumerate(unique_cells):
+            group = order[bounds[index]:bounds[index + 1]]
+            values[group] = self.distance_field(cell).reshape(-1)[indices[group]]
+
+        #Slope towards each neighbor, where unreachable neighbors never win
+        here = values[:, 0]
+        step_lengths = np.hypot(_NEIGHBORS[:, 0], _NEIGHBORS[:, 1]) / self.environment.pix_per_meter
+        with np.errstate(invalid='ignore'):
+            slopes = (values[:, 1:] - here[:, np.newaxis]) / step_lengths
+        slopes[~np.isfinite(slopes)] = np.inf
+        best = np.argmin(slopes, axis=1)
+        descend = (here > 0) & np.isfinite(here) & (slopes[np.arange(len(agents)), best] < 0)
+
+        steps = _NEIGHBORS[best[descend]][:, ::-1].astype(float)
+        directions[agents[descend]] = steps / np.hypot(steps[:, 0], steps[:, 1])[:, np.newaxis]
+
+        directions[lengths == 0] = 0
+        return directions
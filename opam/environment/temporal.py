@@ -0,0 +1,274 @@
+import numpy as np
+from typing import Any, Optional, Tuple
+
+from opam.utils.annotation import sparse_counts
+
+
+class TemporalCounts:
+    """Visitation counts resolved in time, as a sparse tensor of shape
+    (bins x rows x cols)
+
+    The nonzero counts are stored in compressed sparse row form over the
+    time bins: the counts of bin b are at the sorted flat indices into the
+    map indices[bin_offsets[b]:bin_offsets[b+1]], so the memory grows with
+    the number of visited (bin, pixel) pairs rather than with the number
+    of bins times the size of the map.
+
+    Bin b covers the times [b*bin_size, (b+1)*bin_size) from the start of
+    each episode, where step t of a path is at time t*time_step.
+
+    Parameters
+    ----------
+    shape
+        Shape of the map
+    bin_offsets
+        Offsets of the counts of each bin, of length bins + 1
+    indices
+        Flat indices into the map of the counts, sorted within each bin
+    counts
+        Nonzero counts
+    bin_size
+        Duration of a bin
+    time_step
+        Duration of a step of the episodes
+
+    Attributes
+    ----------
+    shape
+        See above
+    bin_offsets
+        See above
+    indices
+        See above
+    counts
+        See above
+    bin_size
+        See above
+    time_step
+        See above
+    """
+
+    def __init__(self,
+        shape: Tuple[int, int],
+        bin_offsets: np.ndarray,
+        indices: np.ndarray,
+        counts: np.ndarray,
+        bin_size: float = 1.0,
+        time_step: float = 1.0
+        )-> None:
+        self.shape = tuple(shape)
+        self.bin_offsets = np.asarray(bin_offsets, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.counts = np.asarray(counts)
+        self.bin_size = bin_size
+        self.time_step = time_step
+
+    @classmethod
+    def from_keys(cls,
+        keys: np.ndarray,
+        counts: np.ndarray,
+        shape: Tuple[int, int],
+        bin_size: float = 1.0,
+        time_step: float = 1.0,
+        num_bins: Optional[int] = None
+        )-> 'TemporalCounts':
+        """Create the tensor from sorted unique keys bin*map size + flat
+        index and their counts, as returned by sparse_counts
+
+        Parameters
+        ----------
+        keys
+            Sorted unique keys of the nonzero counts
+        counts
+            Count of each key
+        shape
+            Shape of the map
+        bin_size
+            Duration of a bin
+        time_step
+            Duration of a step of the episodes
+        num_bins
+            Number of bins, defaults to one past the last nonempty bin
+
+        Returns
+        -------
+        TemporalCounts
+            Tensor of the counts
+        """
+        size = shape[0] * shape[1]
+        bins = keys // size
+        if num_bins is None:
+            num_bins = int(bins[-1]) + 1 if len(bins) else 0
+        bin_offsets = np.searchsorted(bins, np.arange(num_bins + 1))
+        return cls(shape, bin_offsets, keys % size, counts, bin_size, time_step)
+
+    @property
+    def num_bins(self)-> int:
+        return len(self.bin_offsets) - 1
+
+    @property
+    def nnz(self)-> int:
+        """Number of nonzero counts"""
+        return len(self.counts)
+
+    @property
+    def nbytes(self)-> int:
+        return self.bin_offsets.nbytes + self.indices.nbytes + self.counts.nbytes
+
+    def bin_times(self)-> np.ndarray:
+        """Start time of each bin"""
+        return np.arange(self.num_bins) * self.bin_size
+
+    def _bin_ids(self)-> np.ndarray:
+        """Bin of each nonzero count"""
+        return np.repeat(np.arange(self.num_bins), np.diff(self.bin_offsets))
+
+    def sparse_bin(self, index: int)-> Tuple[np.ndarray, np.ndarray]:
+        """Get the counts of a bin
+
+        Parameters
+        ----------
+        index
+            Index of the bin
+
+        Returns
+        -------
+        np.ndarray
+            Sorted flat indices into the map of the visited pixels
+        np.ndarray
+            Count of each of those pixels
+        """
+        if not -self.num_bins <= index < self.num_bins:
+            raise IndexError('Bin ' + str(index) + ' out of range for ' + str(self.num_bins) + ' bins')
+        index %= self.num_bins
+        start, stop = self.bin_offsets[index], self.bin_offsets[index + 1]
+        return self.indices[start:stop], self.counts[start:stop]
+
+    def dense_bin(self, index: int, dtype: Any = None, out: Optional[np.ndarray] = None)-> np.ndarray:
+        """Materialize the counts of a bin as an array of the shape of the map
+
+        Parameters
+        ----------
+        index
+            Index of the bin
+        dtype
+            Data type of the array, defaults to the type of the counts
+        out
+            Array to write the counts to instead of allocating one, for
+            example to scan the bins with a single buffer
+
+        Returns
+        -------
+        np.ndarray
+            Counts of the bin
+        """
+        indices, counts = self.sparse_bin(index)
+        if out is None:
+            out = np.zeros(self.shape, dtype=dtype or self.counts.dtype)
+        else:
+            out[...] = 0
+        out.flat[indices] = counts
+        return out
+
+    def __getitem__(self, index: int)-> np.ndarray:
+        return self.dense_bin(index)
+
+    def __len__(self)-> int:
+        return self.num_bins
+
+    def total(self, start: int = 0, stop: Optional[int] = None, dtype: Any = None)-> np.ndarray:
+        """Sum the counts over a range of bins
+
+        Parameters
+        ----------
+        start
+            First bin of the range
+        stop
+            End of the range, defaults to the number of bins
+        dtype
+            Data type of the array, defaults to the type of the counts
+
+        Returns
+        -------
+        np.ndarray
+            Array of the shape of the map with the summed counts
+        """
+        start, stop, _ = slice(start, stop).indices(self.num_bins)
+        first, last = self.bin_offsets[start], self.bin_offsets[max(start, stop)]
+        indices, counts = sparse_counts([self.indices[first:last]], [self.counts[first:last]])
+        out = np.zeros(self.shape, dtype=dtype or self.counts.dtype)
+        out.flat[indices] = counts
+        return out
+
+    def bin_totals(self)-> np.ndarray:
+        """Sum of the counts of each bin"""
+        return np.bincount(self._bin_ids(), weights=self.counts, minlength=self.num_bins)
+
+    def series(self, pixels: np.ndarray)-> np.ndarray:
+        """Get the counts of pixels over time
+
+        Parameters
+        ----------
+        pixels
+            Array of (row, col) pixels
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (pixels x bins) with the count of each pixel in
+            each bin
+        """
+        pixels = np.asarray(pixels, dtype=np.int64).reshape(-1, 2)
+        flat = np.ravel_multi_index((pixels[:, 0], pixels[:, 1]), self.shape)
+        #Keys are sorted since bins are contiguous and indices sorted within them
+        size = self.shape[0] * self.shape[1]
+        keys = self._bin_ids() * size + self.indices
+        queries = np.arange(self.num_bins) * size + flat[:, np.newaxis]
+        if not len(keys):
+            return np.zeros(queries.shape, dtype=self.counts.dtype)
+        position = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+        return np.where(keys[position] == queries, self.counts[position], 0)
+
+    def sum_bins(self, factor: int)-> 'TemporalCounts':
+        """Sum the counts of every factor consecutive bins
+
+        The counts of the merged bins are added, so a path that sweeps a
+        pixel in k of them counts k times in the result. This is not the
+        same as Environment.compute_temporal_counts with a bin size factor
+        times larger, where a path counts at most once per pixel and bin:
+        the sums are never smaller, and equal only where no path sweeps a
+        pixel in more than one of the merged bins.
+
+        Parameters
+        ----------
+        factor
+            Number of bins summed into one
+
+        Returns
+        -------
+        TemporalCounts
+            Tensor with bins of factor times the size
+        """
+        if factor < 1:
+            raise ValueError('The number of summed bins must be positive, got ' + str(factor))
+        size = self.shape[0] * self.shape[1]
+        keys, counts = sparse_counts([self._bin_ids() // factor * size + self.indices], [self.counts])
+        return TemporalCounts.from_keys(keys, counts.astype(self.counts.dtype), self.shape,
+            self.bin_size * factor, self.time_step, -(-self.num_bins // factor))
+
+    def to_coo(self)-> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Get the counts in coordinate form
+
+        Returns
+        -------
+        np.ndarray
+            Bin of each count
+        np.ndarray
+            Row of each count
+        np.ndarray
+            Column of each count
+        np.ndarray
+            Counts
+        """
+        rows, cols = np.unravel_index(self.indices, self.shape)
+        return self._bin_ids(), rows, cols, self.counts
@@ -0,0 +1,124 @@
+import numpy as np
+from typing import Dict, List, Optional
+
+from opam.utils.annotation import class_thresholds, segmentation_mask
+
+
+def _distribution(values: np.ndarray, eps: float)-> np.ndarray:
+    """Normalize non-negative values into a distribution, mixing in eps of
+    the uniform distribution so no probability is zero
+    """
+    values = np.maximum(np.asarray(values, dtype=np.float64), 0)
+    total = values.sum()
+    uniform = np.full(len(values), 1 / max(len(values), 1))
+    if total <= 0:
+        return uniform
+    return (1 - eps)*values/total + eps*uniform
+
+
+def kl_divergence(p: np.ndarray, q: np.ndarray)-> float:
+    """Kullback-Leibler divergence KL(p || q) of two distributions in nats"""
+    support = p > 0
+    return float(np.sum(p[support] * np.log(p[support] / q[support])))
+
+
+def js_divergence(p: np.ndarray, q: np.ndarray)-> float:
+    """Jensen-Shannon divergence of two distributions in nats"""
+    mixture = (p + q) / 2
+    return (kl_divergence(p, mixture) + kl_divergence(q, mixture)) / 2
+
+
+def histogram_emd(a: np.ndarray, b: np.ndarray, bins: int = 100)-> float:
+    """Earth mover's distance between the histograms of two arrays of
+    values in [0, 1], the area between their cumulative histograms
+    """
+    edges = np.linspace(0, 1, bins + 1)
+    hist_a = np.histogram(a, edges)[0] / max(len(a), 1)
+    hist_b = np.histogram(b, edges)[0] / max(len(b), 1)
+    return float(np.sum(np.abs(np.cumsum(hist_a) - np.cumsum(hist_b))) / bins)
+
+
+def pearson(a: np.ndarray, b: np.ndarray)-> float:
+    """Pearson correlation of two arrays, nan if either is constant"""
+    a = np.asarray(a, dtype=np.float64) - np.mean(a)
+    b = np.asarray(b, dtype=np.float64) - np.mean(b)
+    denominator = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    return float(np.dot(a, b) / denominator) if denominator > 0 else float('nan')
+
+
+def class_iou(true_classes: np.ndarray, predicted_classes: np.ndarray, num_classes: int)-> np.ndarray:
+    """Intersection over union of each class of two label arrays, computed
+    from a single confusion matrix. Classes absent from both are nan.
+    """
+    confusion = np.bincount(true_classes.astype(np.int64)*num_classes + predicted_classes,
+        minlength=num_classes**2).reshape(num_classes, num_classes)
+    intersection = np.diag(confusion)
+    union = confusion.sum(axis=0) + confusion.sum(axis=1) - intersection
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(union > 0, intersection / union, np.nan)
+
+
+def evaluate_occupancy(
+    predicted: np.ndarray,
+    counts: np.ndarray,
+    free: np.ndarray,
+    num_classes: Optional[int] = None,
+    class_distribution: Optional[List[float]] = None,
+    bins: int = 100,
+    eps: float = 1e-9
+    )-> Dict[str, float]:
+    """Score a predicted occupancy map against visitation counts over the
+    free pixels of a map.
+
+    The prediction and the counts are normalized into distributions over
+    the free pixels for the divergences, and scaled by their largest
+    value for the earth mover's distance between their histograms. With
+    num_classes, both are also segmented with the same class distribution
+    (see Environment.get_segmentation_mask) and compared class by class.
+
+    Parameters
+    ----------
+    predicted
+        Predicted occupancy of the map
+    counts
+        Visitation counts of the map
+    free
+        Boolean array that is True for the pixels to evaluate
+    num_classes
+        Number of classes of the segmentation masks, or None to skip the
+        per-class scores
+    class_distribution
+        Distribution of the classes of the segmentation masks
+    bins
+        Number of bins of the histograms
+    eps
+        Weight of the uniform distribution mixed into both distributions,
+        which keeps the divergences finite
+
+    Returns
+    -------
+    Dict[str, float]
+        Dictionary with the 'kl', 'js', 'emd' and 'pearson' scores, and
+        'iou_<class>' and 'mean_iou' if num_classes is given
+    """
+    predicted = np.asarray(predicted)[free].astype(np.float64)
+    counts = np.asarray(counts)[free].astype(np.float64)
+    p = _distribution(counts, eps)
+    q = _distribution(predicted, eps)
+
+    scores = {
+        'kl': kl_divergence(p, q),
+        'js': js_divergence(p, q),
+        'emd': histogram_emd(counts / max(counts.max(initial=0), eps),
+            np.maximum(predicted, 0) / max(predicted.max(initial=0), eps), bins),
+        'pearson': pearson(predicted, counts)}
+
+    if num_classes is not None:
+        true_classes = segmentation_mask(counts,
+            class_thresholds(counts[counts > 0], class_distribution), np.int64)
+        predicted_classes = segmentation_mask(predicted,
+            class_thresholds(predicted[predicted > 0], class_distribution), np.int64)
+        iou = class_iou(true_classes, predicted_classes, num_classes)
+        scores.update(('iou_' + str(k), float(value)) for k, value in enumerate(iou))
+        scores['mean_iou'] = float(np.nanmean(iou)) if np.isfinite(iou).any() else float('nan')
+    return scores
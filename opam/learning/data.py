@@ -0,0 +1,193 @@
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count, islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from opam.augmentation.core import orient, random_orientation
+from opam.environment import Environment
+from opam.utils.annotation import segmentation_mask
+
+
+class PatchDataset:
+    """Training samples cropped from the maps and visitation counts of
+    several environments
+
+    Sample i is a random square patch of a random map, with its label
+    cropped from the same place, drawn from a random number generator
+    seeded with (seed, i). Samples are only cropped when they are drawn,
+    so no full map is copied, and a sample does not depend on which
+    consumer or thread draws it, which makes sharding deterministic.
+
+    Features are 1 where the map is free and 0 elsewhere. Labels are
+    either the visitation counts scaled by the largest count of their
+    map ('occupancy') or the classes of the segmentation mask of their
+    map ('segmentation', see Environment.get_segmentation_mask). Parts of
+    a patch outside of its map are obstacles with no visits.
+
+    Parameters
+    ----------
+    environments
+        Dictionary of environments, where the key is the map name
+    patch_size
+        Number of rows and columns of the patches
+    label
+        Kind of label, 'occupancy' or 'segmentation'
+    num_classes
+        Number of classes of segmentation labels
+    class_distribution
+        Distribution of the classes of segmentation labels
+    augment
+        If True, patches are randomly rotated and flipped
+    seed
+        Seed of the samples
+
+    Attributes
+    ----------
+    environments
+        See above
+    patch_size
+        See above
+    label
+        See above
+    augment
+        See above
+    seed
+        See above
+    """
+
+    def __init__(self,
+        environments: Dict[str, Environment],
+        patch_size: int = 256,
+        label: str = 'occupancy',
+        num_classes: Optional[int] = None,
+        class_distribution: Optional[List[float]] = None,
+        augment: bool = True,
+        seed: int = 0
+        )-> None:
+
+        if label not in ('occupancy', 'segmentation'):
+            raise ValueError('Unknown label: ' + str(label))
+        if not environments:
+            raise ValueError('No environments to sample from')
+
+        self.environments = environments
+        self.patch_size = patch_size
+        self.label = label
+        self.augment = augment
+        self.seed = seed
+        self._names = list(environments)
+
+        #Maps are drawn in proportion to their area, and the per-map label
+        #parameters are computed once rather than per sample
+        areas = np.array([env.map.size for env in environments.values()], dtype=float)
+        self._map_weights = areas / areas.sum()
+        if label == 'segmentation':
+            self._thresholds = [env.get_segmentation_thresholds(num_classes, class_distribution)
+                for env in environments.values()]
+            self._label_dtype = np.uint8 if num_classes <= 256 else np.uint16
+        else:
+            self._scales = [float(env.visitation_counts.max()) or 1.0 for env in environments.values()]
+            self._label_dtype = np.float32
+
+    def _crop(self, array: np.ndarray, row: int, col: int, fill: float)-> np.ndarray:
+        """Crop a patch of an array, filling the part outside of it"""
+        size = self.patch_size
+        h, w = array.shape
+        patch = array[max(row, 0):max(row + size, 0), max(col, 0):max(col + size, 0)]
+        if patch.shape == (size, size):
+            return np.asarray(patch)
+        padded = np.full((size, size), fill, dtype=np.asarray(patch).dtype)
+        padded[max(-row, 0):max(-row, 0) + patch.shape[0], max(-col, 0):max(-col, 0) + patch.shape[1]] = patch
+        return padded
+
+    def sample(self, index: int)-> Tuple[np.ndarray, np.ndarray]:
+        """Draw sample index
+
+        Returns
+        -------
+        np.ndarray
+            Features of the patch with shape (patch_size x patch_size)
+        np.ndarray
+            Label of the patch with shape (patch_size x patch_size)
+        """
+        rng = np.random.default_rng(np.random.SeedSequence([self.seed, index]))
+        map_index = int(rng.choice(len(self._names), p=self._map_weights))
+        env = self.environments[self._names[map_index]]
+        h, w = env.map.shape
+        row = int(rng.integers(min(0, h - self.patch_size), max(0, h - self.patch_size) + 1))
+        col = int(rng.integers(min(0, w - self.patch_size), max(0, w - self.patch_size) + 1))
+
+        features = self._crop(env.map, row, col, env.obstacle) == env.free
+        counts = self._crop(env.visitation_counts, row, col, 0)
+        if self.label == 'segmentation':
+            label = segmentation_mask(counts, self._thresholds[map_index], self._label_dtype)
+        else:
+            label = counts / self._scales[map_index]
+
+        if self.augment:
+            quarter_turns, flip = random_orientation(rng)
+            features, label = orient(features, quarter_turns, flip), orient(label, quarter_turns, flip)
+        return features.astype(np.float32), label.astype(self._label_dtype)
+
+    def _batch(self, indices: List[int])-> Tuple[np.ndarray, np.ndarray]:
+        """Stack the samples of a batch into preallocated arrays"""
+        size = self.patch_size
+        features = np.empty((len(indices), size, size), dtype=np.float32)
+        labels = np.empty((len(indices), size, size), dtype=self._label_dtype)
+        for i, index in enumerate(indices):
+            features[i], labels[i] = self.sample(index)
+        return features, labels
+
+    def batches(self,
+        batch_size: int = 16,
+        num_samples: Optional[int] = None,
+        shard: int = 0,
+        num_shards: int = 1,
+        prefetch: int = 4,
+        workers: int = 2
+        )-> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Generate batches of samples, prepared ahead on a thread pool.
+
+        Shard s of num_shards draws the samples s, s + num_shards,
+        s + 2*num_shards... so consumers reading different shards of the
+        same dataset see disjoint samples, and the batches of a shard do
+        not depend on the number of threads.
+
+        Parameters
+        ----------
+        batch_size
+            Number of samples in each batch, the last batch may be smaller
+        num_samples
+            Total number of samples over all the shards, or None for an
+            endless stream
+        shard
+            Index of the shard to draw from
+        num_shards
+            Number of shards the samples are split into
+        prefetch
+            Maximum number of batches prepared ahead
+        workers
+            Number of threads preparing batches
+
+        Yields
+        ------
+        Tuple[np.ndarray, np.ndarray]
+            Features and labels of a batch, with shape
+            (batch_size x patch_size x patch_size)
+        """
+        if not 0 <= shard < num_shards:
+            raise ValueError('Shard ' + str(shard) + ' out of range for ' + str(num_shards) + ' shards')
+        indices = count(shard, num_shards) if num_samples is None else iter(range(shard, num_samples, num_shards))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            while True:
+                while len(pending) < max(prefetch, 1):
+                    batch = list(islice(indices, batch_size))
+                    if not batch:
+                        break
+                    pending.append(executor.submit(self._batch, batch))
+                if not pending:
+                    return
+                yield pending.popleft().result()
@@ -0,0 +1,157 @@
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, List, Optional, Tuple
+
+from opam.environment import Environment
+
+
+def tile_origins(size: int, tile_size: int, overlap: int)-> List[int]:
+    """Starts of overlapping tiles covering [0, size), the last tile ending
+    at size so every tile is full when the map is larger than a tile
+    """
+    if size <= tile_size:
+        return [0]
+    stride = max(tile_size - overlap, 1)
+    origins = list(range(0, size - tile_size, stride))
+    origins.append(size - tile_size)
+    return origins
+
+
+def blend_ramp(tile_size: int, overlap: int)-> np.ndarray:
+    """Weight of each row or column of a tile when blending overlapping
+    tiles, see blend_window
+    """
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        edge = (np.arange(min(overlap, tile_size // 2)) + 1) / (overlap + 1)
+        ramp[:len(edge)] = edge
+        ramp[tile_size - len(edge):] = edge[::-1]
+    return ramp
+
+
+def blend_window(tile_size: int, overlap: int)-> np.ndarray:
+    """Weight of each pixel of a tile when blending overlapping tiles
+
+    Weights ramp up linearly over the overlap at each side of the tile and
+    are 1 in its middle, so the blended result changes smoothly from one
+    tile to the next. They never reach 0, so pixels covered by a single
+    tile, like those on the border of the map, keep their prediction.
+    """
+    ramp = blend_ramp(tile_size, overlap)
+    return np.outer(ramp, ramp)
+
+
+def blend_totals(size: int, origins: List[int], ramp: np.ndarray)-> np.ndarray:
+    """Sum of the ramps of the tiles starting at origins along a side of
+    size pixels
+    """
+    totals = np.zeros(size, dtype=np.float32)
+    for origin in origins:
+        end = min(origin + len(ramp), size)
+        totals[origin:end] += ramp[:end - origin]
+    return totals
+
+
+def _predict_batch(model: Any, tiles: List[np.ndarray], pix_per_meter: float)-> List[np.ndarray]:
+    """Predict a batch of free space tiles with a model's predict_batch if
+    it has one, otherwise one tile at a time with predict_map
+    """
+    if hasattr(model, 'predict_batch'):
+        return list(model.predict_batch(np.stack(tiles), pix_per_meter))
+    return [model.predict_map(tile, pix_per_meter) for tile in tiles]
+
+
+def predict_tiled(
+    model: Any,
+    env: Environment,
+    tile_size: int = 1024,
+    overlap: int = 128,
+    batch_size: int = 4,
+    workers: int = 1,
+    name: Optional[str] = None
+    )-> np.ndarray:
+    """Predict the occupancy of a large map with a model, tile by tile.
+
+    The map is split into overlapping tiles that are predicted in batches
+    on a thread pool and blended into a preallocated output with
+    blend_window weights. Tiles without free pixels are skipped and
+    predicted as zero. The windows are separable and the tiles form a
+    grid, so the total weight of a pixel is the product of the summed
+    ramps of its row and column, and each tile is normalized as it is
+    added instead of accumulating a second map of weights. At most two
+    batches per worker are in flight, so besides the output, memory use
+    depends on the batch and tile sizes rather than the size of the map.
+
+    Parameters
+    ----------
+    model
+        Model with a predict_map(free, pix_per_meter) method, and
+        optionally a predict_batch(tiles, pix_per_meter) method that takes
+        a (tiles x rows x cols) array, like the models of
+        opam.learning.models
+    env
+        Environment to predict the occupancy of
+    tile_size
+        Number of rows and columns of the tiles
+    overlap
+        Number of rows and columns shared by neighboring tiles, which give
+        the model context at the tile borders
+    batch_size
+        Number of tiles predicted at a time
+    workers
+        Number of threads predicting batches
+    name
+        Key of the prediction in env.predicted_occupancy, defaults to the
+        name of the model
+
+    Returns
+    -------
+    np.ndarray
+        Predicted occupancy of the map
+    """
+    h, w = env.map.shape
+    rows = tile_origins(h, tile_size, overlap)
+    cols = tile_origins(w, tile_size, overlap)
+    ramp = blend_ramp(tile_size, overlap)
+    window = np.outer(ramp, ramp)
+    row_totals = blend_totals(h, rows, ramp)
+    col_totals = blend_totals(w, cols, ramp)
+
+    prediction = np.zeros((h, w), dtype=np.float32)
+
+    def batches()-> Iterator[List[Tuple[int, int, np.ndarray]]]:
+        batch = []
+        for row in rows:
+            for col in cols:
+                free = env.map[row:row + tile_size, col:col + tile_size] == env.free
+                if not free.any():
+                    continue
+                batch.append((row, col, free))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def accumulate(batch: List[Tuple[int, int, np.ndarray]], results: List[np.ndarray])-> None:
+        for (row, col, free), result in zip(batch, results):
+            tile_rows, tile_cols = free.shape
+            tile_weights = window[:tile_rows, :tile_cols] \
+                / np.outer(row_totals[row:row + tile_rows], col_totals[col:col + tile_cols])
+            prediction[row:row + tile_rows, col:col + tile_cols] += tile_weights * result
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches():
+            tiles = [free for _, _, free in batch]
+            pending.append((batch, executor.submit(_predict_batch, model, tiles, env.pix_per_meter)))
+            if len(pending) >= 2*workers:
+                batch, future = pending.popleft()
+                accumulate(batch, future.result())
+        while pending:
+            batch, future = pending.popleft()
+            accumulate(batch, future.result())
+
+    env.predicted_occupancy[name or model.name] = prediction
+    return prediction
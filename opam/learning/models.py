@@ -1 +1,282 @@
-import tensorflow as tf
\ No newline at end of file
+import numpy as np
+import logging
+from typing import Dict, Iterable, Sequence, Union
+
+from opam.environment import Environment
+from opam.utils.annotation import distance_transform
+
+
+def _block_mean(array: np.ndarray, scale: int, fill: float = 0)-> np.ndarray:
+    """Average an array over scale x scale blocks, padding its edges with fill"""
+    h, w = array.shape
+    rows, cols = -(-h // scale), -(-w // scale)
+    padded = np.full((rows*scale, cols*scale), fill, dtype=np.float32)
+    padded[:h, :w] = array
+    return padded.reshape(rows, scale, cols, scale).mean(axis=(1, 3))
+
+
+def _box_mean(array: np.ndarray, radius: int)-> np.ndarray:
+    """Average an array over (2*radius + 1) square windows with an integral
+    image, only counting the part of each window inside the array
+    """
+    h, w = array.shape
+    integral = np.zeros((h + 1, w + 1))
+    np.cumsum(np.cumsum(array, axis=0), axis=1, out=integral[1:, 1:])
+    rows = np.arange(h)
+    cols = np.arange(w)
+    top, bottom = np.maximum(rows - radius, 0), np.minimum(rows + radius + 1, h)
+    left, right = np.maximum(cols - radius, 0), np.minimum(cols + radius + 1, w)
+    total = (integral[bottom][:, right] - integral[top][:, right]
+        - integral[bottom][:, left] + integral[top][:, left])
+    area = np.outer(bottom - top, right - left)
+    return (total / area).astype(np.float32)
+
+
+def _max_filter(array: np.ndarray, radius: int)-> np.ndarray:
+    """Maximum of an array over (2*radius + 1) square windows, with windows
+    of doubling width so the cost grows with the log of the radius
+    """
+    width = 2*radius + 1
+    result = array
+    for axis in (0, 1):
+        #Window [i - radius, i + radius] of the array is window
+        #[i, i + width) of the padded array
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (radius, radius)
+        current = np.pad(result, pad, constant_values=-np.inf)
+        span = 1
+        while span < width:
+            step = min(span, width - span)
+            head = np.take(current, np.arange(current.shape[axis] - step), axis=axis)
+            tail = np.take(current, np.arange(step, current.shape[axis]), axis=axis)
+            current = np.maximum(head, tail)
+            span += step
+        result = current
+    return result
+
+
+def occupancy_features(
+    free: np.ndarray,
+    pix_per_meter: float,
+    feature_scale: int = 4,
+    blur_radii: Sequence[float] = (0.5, 1.0, 2.0, 4.0),
+    max_wall_distance: float = 5.0
+    )-> np.ndarray:
+    """Compute the features of the baseline occupancy model on a coarse grid
+
+    The map is averaged over feature_scale x feature_scale blocks, and
+    each block gets the distance to the nearest wall, the width of the
+    corridor it lies in, estimated as twice the largest wall distance
+    nearby, and the fraction of free space around it at several scales.
+
+    Parameters
+    ----------
+    free
+        Boolean array that is True where the map is free
+    pix_per_meter
+        Number of pixels per meter of the map
+    feature_scale
+        Side of the blocks in pixels
+    blur_radii
+        Radii in meters over which the free space is averaged
+    max_wall_distance
+        Distances to walls and corridor widths are capped at this many
+        meters
+
+    Returns
+    -------
+    np.ndarray
+        Array of features with shape (blocks rows x block cols x features)
+    """
+    cell = feature_scale / pix_per_meter
+    free_fraction = _block_mean(free, feature_scale)
+    walls = free_fraction < 0.5
+    if walls.any():
+        wall_distance = np.minimum(distance_transform(walls) * cell, max_wall_distance).astype(np.float32)
+    else:
+        wall_distance = np.full(free_fraction.shape, max_wall_distance, dtype=np.float32)
+    corridor_width = 2*_max_filter(wall_distance, int(np.ceil(max_wall_distance / cell)))
+
+    features = [free_fraction, wall_distance, corridor_width, wall_distance**2, corridor_width**2,
+        wall_distance*corridor_width]
+    features.extend(_box_mean(free_fraction, max(1, int(round(radius / cell)))) for radius in blur_radii)
+    return np.stack(features, axis=-1)
+
+
+class RidgeOccupancyModel:
+    """Baseline occupancy predictor with ridge regression on map features
+
+    Predicts the visitation counts of a map, scaled by their largest
+    value, as a linear function of the features of occupancy_features.
+    Features are computed on a coarse grid with vectorized array
+    operations, so a 5000 x 5000 map is predicted in seconds on a CPU,
+    and predictions are upsampled back to the map.
+
+    Parameters
+    ----------
+    name
+        Name of the model, used as the key of its predictions in
+        Environment.predicted_occupancy
+    feature_scale
+        Side in pixels of the blocks the features are computed on
+    blur_radii
+        Radii in meters over which the free space is averaged
+    max_wall_distance
+        Cap in meters of the wall distance and corridor width features
+    regularization
+        Weight of the ridge penalty on the standardized coefficients
+    max_samples_per_map
+        Largest number of blocks of each map used for fitting
+    seed
+        Seed of the random subsampling of the blocks
+
+    Attributes
+    ----------
+    name
+        See above
+    feature_scale
+        See above
+    blur_radii
+        See above
+    max_wall_distance
+        See above
+    regularization
+        See above
+    max_samples_per_map
+        See above
+    seed
+        See above
+    coefficients
+        Coefficients of the standardized features followed by the
+        intercept, None until the model is fitted
+    feature_mean
+        Mean of each feature over the fitting samples
+    feature_std
+        Standard deviation of each feature over the fitting samples
+    """
+
+    def __init__(self,
+        name: str = 'ridge',
+        feature_scale: int = 4,
+        blur_radii: Sequence[float] = (0.5, 1.0, 2.0, 4.0),
+        max_wall_distance: float = 5.0,
+        regularization: float = 1e-3,
+        max_samples_per_map: int = 200000,
+        seed: int = 0
+        )-> None:
+        self.name = name
+        self.feature_scale = feature_scale
+        self.blur_radii = tuple(blur_radii)
+        self.max_wall_distance = max_wall_distance
+        self.regularization = regularization
+        self.max_samples_per_map = max_samples_per_map
+        self.seed = seed
+        self.coefficients = None
+        self.feature_mean = None
+        self.feature_std = None
+
+    def features(self, free: np.ndarray, pix_per_meter: float)-> np.ndarray:
+        """Compute the features of a map, see occupancy_features"""
+        return occupancy_features(free, pix_per_meter, self.feature_scale, self.blur_radii,
+            self.max_wall_distance)
+
+    def fit(self, environments: Union[Dict[str, Environment], Iterable[Environment]])-> 'RidgeOccupancyModel':
+        """Fit the model to the visitation counts of environments
+
+        Parameters
+        ----------
+        environments
+            Environments with visitation counts, or a dictionary of them
+
+        Returns
+        -------
+        RidgeOccupancyModel
+            The fitted model
+
+        Raises
+        ------
+        ValueError
+            If no environment has visitation counts
+        """
+        if isinstance(environments, dict):
+            environments = environments.values()
+        rng = np.random.default_rng(self.seed)
+        samples, targets = [], []
+        for env in environments:
+            largest = env.visitation_counts.max() if env.visitation_counts is not None else 0
+            if not largest > 0:
+                continue
+            free = env.map == env.free
+            features = self.features(free, env.pix_per_meter).reshape(-1, self._num_features)
+            counts = _block_mean(np.asarray(env.visitation_counts, dtype=np.float32) / largest,
+                self.feature_scale).reshape(-1)
+            #Only blocks with free space are predicted, so only they are fitted
+            blocks = np.flatnonzero(features[:, 0] > 0)
+            if len(blocks) > self.max_samples_per_map:
+                blocks = rng.choice(blocks, self.max_samples_per_map, replace=False)
+            samples.append(features[blocks])
+            targets.append(counts[blocks] / features[blocks, 0])
+        if not samples:
+            raise ValueError('No visitation counts to fit the model to')
+
+        samples = np.concatenate(samples).astype(np.float64)
+        targets = np.concatenate(targets).astype(np.float64)
+        self.feature_mean = samples.mean(axis=0)
+        self.feature_std = np.maximum(samples.std(axis=0), 1e-9)
+        design = np.column_stack(((samples - self.feature_mean) / self.feature_std, np.ones(len(samples))))
+
+        penalty = self.regularization * len(samples) * np.eye(design.shape[1])
+        penalty[-1, -1] = 0
+        self.coefficients = np.linalg.solve(design.T @ design + penalty, design.T @ targets)
+        logging.info('Fitted %s on %d samples', self.name, len(samples))
+        return self
+
+    @property
+    def _num_features(self)-> int:
+        return 6 + len(self.blur_radii)
+
+    def predict_map(self, free: np.ndarray, pix_per_meter: float)-> np.ndarray:
+        """Predict the scaled occupancy of a map
+
+        Parameters
+        ----------
+        free
+            Boolean array that is True where the map is free
+        pix_per_meter
+            Number of pixels per meter of the map
+
+        Returns
+        -------
+        np.ndarray
+            Array of the shape of the map with the predicted occupancy,
+            zero where the map is not free
+        """
+        if self.coefficients is None:
+            raise ValueError('The model ' + self.name + ' has not been fitted')
+        features = self.features(free, pix_per_meter)
+        weights = (self.coefficients[:-1] / self.feature_std).astype(np.float32)
+        intercept = np.float32(self.coefficients[-1] - np.dot(self.feature_mean, self.coefficients[:-1] / self.feature_std))
+        coarse = np.maximum(features @ weights + intercept, 0)
+
+        h, w = free.shape
+        prediction = np.repeat(np.repeat(coarse, self.feature_scale, axis=0), self.feature_scale, axis=1)[:h, :w]
+        prediction[~free] = 0
+        return prediction
+
+    def predict(self, env: Environment)-> np.ndarray:
+        """Predict the occupancy of an environment and store it in
+        env.predicted_occupancy under the name of the model
+
+        Parameters
+        ----------
+        env
+            Environment to predict the occupancy of
+
+        Returns
+        -------
+        np.ndarray
+            Predicted occupancy of the map
+        """
+        prediction = self.predict_map(env.map == env.free, env.pix_per_meter)
+        env.predicted_occupancy[self.name] = prediction
+        return prediction
@@ -1,27 +1,144 @@
 import numpy as np
+from typing import Optional, Tuple, Union
 
 from opam.environment.core import Environment
 
 class Simulator:
     """Parent class for simulators
 
+    Subclasses implement reset, step and positions. Agents start at random
+    free positions and walk towards random free goals, and
+    get_episode_data records their positions into a preallocated array.
+
     Parameters
     ----------
     environment
         Environment object to simulate in
+    navigate
+        If True, agents are routed around the walls with the navigation
+        layer of the environment, otherwise they head straight to their
+        goals. Each distinct goal cell needs a geodesic distance field of
+        the whole map, so this is off by default
+    num_goals
+        Number of distinct goals of the agents of an episode when they
+        navigate, whose distance fields are computed when the episode is
+        reset and reused by every step
 
     Attributes
     ----------
     environment
         See above
+    navigate
+        See above
+    num_goals
+        See above
+    goals
+        Array of the (x, y) goal of each agent in world coordinates
+    rng
+        Random number generator of the current episode
     """
-    def __init__(self, environment: type[Environment]) -> None:
+    def __init__(self, environment: type[Environment], navigate: bool = False, num_goals: int = 16) -> None:
         self.environment = environment
+        self.navigate = navigate
+        self.num_goals = num_goals
+        self.goals = None
+        self.rng = np.random.default_rng()
 
     def step(self) -> None:
         """Simulate one step"""
         raise NotImplementedError
 
-    def reset(self) -> None:
-        """Reset the simulation"""
+    def reset(self, seed: Optional[Union[int, np.random.SeedSequence]] = None) -> None:
+        """Reset the simulation
+
+        Parameters
+        ----------
+        seed
+            Seed of the random number generator used to place the agents,
+            so that an episode can be reproduced
+        """
+        raise NotImplementedError
+
+    @property
+    def positions(self) -> np.ndarray:
+        """Array of the current (x, y) position of each agent in world coordinates"""
         raise NotImplementedError
+
+    def get_episode_data(self, num_steps: int) -> np.ndarray:
+        """Run the simulation and record the position of each agent at
+        each timestep.
+
+        Parameters
+        ----------
+        num_steps
+            Number of timesteps to record
+
+        Returns
+        -------
+        np.ndarray
+            Array of agent positions with shape (agents x timesteps x 2)
+        """
+        positions = self.positions
+        episode_data = np.empty((len(positions), num_steps, 2), dtype=np.float32)
+        for step in range(num_steps):
+            episode_data[:, step] = positions
+            if step < num_steps - 1:
+                self.step()
+                positions = self.positions
+        return episode_data
+
+    def _sample_starts_and_goals(self, num_agents: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Sample random start and goal positions where an agent does not
+        overlap obstacles, with each goal reachable from its start. Agents
+        that navigate share num_goals goals, whose distance fields are
+        computed here
+
+        Parameters
+        ----------
+        num_agents
+            Number of start and goal pairs to sample
+
+        Returns
+        -------
+        np.ndarray
+            Array of (x, y) start positions in world coordinates
+        np.ndarray
+            Array of (x, y) goal positions in world coordinates
+        """
+        num_goals = self.num_goals if self.navigate else None
+        starts, goals = self.environment.free_space.sample_pairs(self.rng, num_agents, num_goals)
+        starts, goals = self.environment._pixel_to_world(starts), self.environment._pixel_to_world(goals)
+        if self.navigate:
+            self.environment.navigation.prepare(goals)
+        return starts, goals
+
+    def _preferred_velocities(self, positions: np.ndarray, max_speed: float, time_step: float) -> np.ndarray:
+        """Velocities that take each agent to its goal
+
+        Agents follow the navigation layer of the environment if navigate
+        is True and walk straight to their goal otherwise. They move at
+        max_speed and slow down to reach their goal exactly at the end of
+        a timestep.
+
+        Parameters
+        ----------
+        positions
+            Array of (x, y) positions of the agents
+        max_speed
+            Maximum speed of the agents
+        time_step
+            Duration of a timestep
+
+        Returns
+        -------
+        np.ndarray
+            Array of (x, y) preferred velocities
+        """
+        offsets = self.goals - positions
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        speeds = np.minimum(max_speed, distances / time_step)
+        if self.navigate:
+            directions = self.environment.navigation.preferred_directions(positions, self.goals)
+        else:
+            directions = offsets / np.maximum(distances, 1e-9)[:, np.newaxis]
+        return directions * speeds[:, np.newaxis]
@@ -0,0 +1,216 @@
+import numpy as np
+import logging
+from collections import OrderedDict
+from typing import List, NamedTuple
+
+from opam.environment import Environment
+from opam.utils.cache import content_hash
+
+
+class ObstacleSet(NamedTuple):
+    """Obstacle polygons extracted from the map of an environment
+
+    Attributes
+    ----------
+    polygons
+        List of polygons in world coordinates, each an array of (x, y)
+        vertices. Polygons around obstacles are counterclockwise and
+        polygons bounding free space are clockwise, as expected by RVO2.
+    tolerance
+        Simplification tolerance in meters used to extract the polygons
+    num_vertices
+        Total number of vertices of the simplified polygons
+    num_raw_vertices
+        Total number of vertices of the polygons before simplification
+    """
+    polygons: List[np.ndarray]
+    tolerance: float
+    num_vertices: int
+    num_raw_vertices: int
+
+
+#Edge directions in (x, y) pixel corner coordinates, indexed by direction id
+_DIRECTIONS = np.array([[1, 0], [0, 1], [-1, 0], [0, -1]])
+
+
+def trace_obstacle_contours(obstacles: np.ndarray)-> List[np.ndarray]:
+    """Trace the boundaries between obstacle and free pixels.
+
+    Boundaries follow the pixel edges and are oriented with the obstacle
+    on their left, in coordinates where x is the column and y the row of
+    the map. Pixels outside the map are treated as obstacles, so free
+    pixels on the border of the map are enclosed. Obstacle pixels that
+    only touch diagonally get separate boundaries.
+
+    Parameters
+    ----------
+    obstacles
+        Boolean array that is True for obstacle pixels
+
+    Returns
+    -------
+    List[np.ndarray]
+        Closed boundaries as arrays of (x, y) pixel corner coordinates,
+        where pixel (row, col) spans [col, col + 1] x [row, row + 1].
+        Only the corners of the boundaries are kept.
+    """
+    padded = np.pad(np.asarray(obstacles, dtype=bool), 1, constant_values=True)
+    h, w = padded.shape
+
+    #Horizontal edges at y = i between pixel rows i-1 and i
+    above, below = padded[1:, :], padded[:-1, :]
+    i, j = np.nonzero(above & ~below)
+    starts = [np.stack((j, i + 1), axis=1)]
+    directions = [np.zeros(len(i), dtype=np.int64)]
+    i, j = np.nonzero(below & ~above)
+    starts.append(np.stack((j + 1, i + 1), axis=1))
+    directions.append(np.full(len(i), 2))
+
+    #Vertical edges at x = j between pixel columns j-1 and j
+    left, right = padded[:, :-1], padded[:, 1:]
+    i, j = np.nonzero(left & ~right)
+    starts.append(np.stack((j + 1, i), axis=1))
+    directions.append(np.full(len(i), 1))
+    i, j = np.nonzero(right & ~left)
+    starts.append(np.stack((j + 1, i + 1), axis=1))
+    directions.append(np.full(len(i), 3))
+
+    starts = np.concatenate(starts)
+    directions = np.concatenate(directions)
+    ends = starts + _DIRECTIONS[directions]
+    if len(starts) == 0:
+        return []
+
+    #Find the edges leaving the end of each edge. Saddle vertices have two
+    #outgoing edges, where turning left keeps the obstacle on the left.
+    num_cols = w + 1
+    start_ids = starts[:, 1] * num_cols + starts[:, 0]
+    end_ids = ends[:, 1] * num_cols + ends[:, 0]
+    order = np.argsort(start_ids, kind='stable')
+    first = np.searchsorted(start_ids[order], end_ids, side='left')
+    count = np.searchsorted(start_ids[order], end_ids, side='right') - first
+
+    successor = order[first]
+    saddle = np.flatnonzero(count == 2)
+    left_turn = (directions[saddle] + 1) % 4
+    second = order[first[saddle] + 1]
+    successor[saddle] = np.where(directions[second] == left_turn, second, successor[saddle])
+
+    contours = []
+    visited = np.zeros(len(starts), dtype=bool)
+    corner = directions[successor] != directions
+    for edge in range(len(starts)):
+        if visited[edge]:
+            continue
+        vertices = []
+        current = edge
+        while not visited[current]:
+            visited[current] = True
+            if corner[current]:
+                vertices.append(ends[current])
+            current = successor[current]
+        contours.append(np.array(vertices) - 1)
+
+    return contours
+
+
+def simplify_polygon(vertices: np.ndarray, tolerance: float)-> np.ndarray:
+    """Simplify a closed polygon with the Douglas-Peucker algorithm.
+
+    Parameters
+    ----------
+    vertices
+        Array of (x, y) vertices of the polygon, without repeating the
+        first vertex at the end
+    tolerance
+        Maximum distance between the simplified polygon and the removed
+        vertices
+
+    Returns
+    -------
+    np.ndarray
+        Vertices of the simplified polygon, or the original vertices if
+        simplifying would leave fewer than three
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    n = len(vertices)
+    if n <= 3 or tolerance <= 0:
+        return vertices
+
+    #Split the loop at the vertex farthest from the first one
+    far = int(np.argmax(np.sum((vertices - vertices[0])**2, axis=1)))
+    keep = np.zeros(n + 1, dtype=bool)
+    keep[[0, far, n]] = True
+    closed = np.concatenate((vertices, vertices[:1]))
+
+    stack = [(0, far), (far, n)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        segment = closed[last] - closed[first]
+        points = closed[first + 1:last] - closed[first]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(points[:, 0], points[:, 1])
+        else:
+            distances = np.abs(segment[0]*points[:, 1] - segment[1]*points[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.extend([(first, split), (split, last)])
+
+    simplified = closed[keep[:-1].nonzero()[0]]
+    return simplified if len(simplified) >= 3 else vertices
+
+
+_obstacle_cache = OrderedDict()
+_OBSTACLE_CACHE_SIZE = 32
+
+
+def extract_obstacles(env: Environment, tolerance: float = 0.1)-> ObstacleSet:
+    """Extract the obstacles of an environment's map as polygons.
+
+    Boundaries are traced with trace_obstacle_contours, simplified with
+    simplify_polygon and converted to world coordinates consistently with
+    Environment._path_world_to_pixel, where the center of pixel
+    (row, col) is at world position
+    ((col - width//2) / pix_per_meter, (row - height//2) / pix_per_meter).
+
+    Results are cached by the content of the map, so environments sharing
+    a map only extract its obstacles once.
+
+    Parameters
+    ----------
+    env
+        Environment to extract the obstacles from
+    tolerance
+        Simplification tolerance in meters. Larger values give fewer
+        vertices, which makes RVO2's obstacle queries cheaper.
+
+    Returns
+    -------
+    ObstacleSet
+        Extracted obstacle polygons
+    """
+    key = content_hash(env.map, env.obstacle, env.pix_per_meter, tolerance)
+    if key in _obstacle_cache:
+        _obstacle_cache.move_to_end(key)
+        return _obstacle_cache[key]
+
+    contours = trace_obstacle_contours(env.map == env.obstacle)
+    origin = np.array([env.map.shape[1]//2, env.map.shape[0]//2]) + 0.5
+    polygons = [(simplify_polygon(contour, tolerance*env.pix_per_meter) - origin) / env.pix_per_meter
+        for contour in contours]
+
+    obstacles = ObstacleSet(polygons, tolerance,
+        sum(len(polygon) for polygon in polygons),
+        sum(len(contour) for contour in contours))
+    logging.info('Extracted %d obstacles with %d vertices (%d before simplification) from %s',
+        len(polygons), obstacles.num_vertices, obstacles.num_raw_vertices, env.env_name)
+
+    _obstacle_cache[key] = obstacles
+    if len(_obstacle_cache) > _OBSTACLE_CACHE_SIZE:
+        _obstacle_cache.popitem(last=False)
+    return obstacles
@@ -1,7 +1,8 @@
-import rvo2
 import numpy as np 
+from typing import Optional, Union
 
 from opam.simulation.core import Simulator
+from opam.simulation.obstacles import ObstacleSet, extract_obstacles
 from opam.environment import Environment
 
 class Orca(Simulator):
@@ -41,6 +42,13 @@ class Orca(Simulator):
             The maximum speed of each agent. Must be positive.
       num_agents
             The Number of agents to simulate
+      navigate
+            If True, agents are routed around the walls with the
+            navigation layer of the environment, otherwise they head
+            straight to their goals, see Simulator
+      num_goals
+            Number of distinct goals of navigating agents, see
+            Simulator
 
       Attributes
       ----------
@@ -62,10 +70,14 @@ class Orca(Simulator):
             See above
       num_agents
             See above
+      navigate
+            See above
+      num_goals
+            See above
       agents
             List of agents in the simulation
       obstacles
-            List of obstacles in the simulation
+            List of the RVO2 ids of the obstacles in the simulation
       sim   
             RVO2 simulator object
 
@@ -80,9 +92,11 @@ class Orca(Simulator):
             time_horizon_obst: float = 2.0,
             radius: float = 0.4,
             max_speed: float = 2.0,
-            num_agents: int = 5
+            num_agents: int = 5,
+            navigate: bool = False,
+            num_goals: int = 16
             ) -> None:
-            super().__init__(environment)
+            super().__init__(environment, navigate, num_goals)
             self.time_step = time_step
             self.neighbor_dist = neighbor_dist
             self.max_neighbors = max_neighbors
@@ -93,9 +107,19 @@ class Orca(Simulator):
             self.num_agents = num_agents
             self.agents = []
             self.obstacles = []
-
-
-            self.sim = rvo2.PyRVOSimulator(
+            self._obstacle_set = None
+
+            self.sim = self._create_simulator()
+
+      def _create_simulator(self) -> 'rvo2.PyRVOSimulator':
+            """Create an empty RVO2 simulator with the parameters of this object"""
+            #Imported here so modules that only annotate do not need RVO2
+            try:
+                  import rvo2
+            except ImportError as error:
+                  raise ImportError('Orca requires the RVO2 Python bindings (pyrvo2), '
+                        'see https://github.com/felipefelixarias/Python-RVO2') from error
+            return rvo2.PyRVOSimulator(
                   self.time_step,
                   self.neighbor_dist,
                   self.max_neighbors,
@@ -104,39 +128,74 @@ class Orca(Simulator):
                   self.radius,
                   self.max_speed)
 
-      def process_map(self):
-      
+      def reset(self, seed: Optional[Union[int, np.random.SeedSequence]] = None) -> None:
+            """Reset the simulation with num_agents agents placed at random
+            free positions, each walking to a random free goal that it
+            can reach.
+
+            Parameters
+            ----------
+            seed
+                  Seed of the random number generator used to place the agents
+            """
+            self.rng = np.random.default_rng(seed)
+            self.sim = self._create_simulator()
+            self.process_map()
+            starts, self.goals = self._sample_starts_and_goals(self.num_agents)
+            self.add_agents(starts)
+
+      def step(self) -> None:
+            """Simulate one step with each agent heading to its goal"""
+            velocities = self._preferred_velocities(self.positions, self.max_speed, self.time_step)
+            for agent, velocity in zip(self.agents, velocities):
+                  self.sim.setAgentPrefVelocity(agent, tuple(velocity))
+            self.sim.doStep()
+
+      @property
+      def positions(self) -> np.ndarray:
+            """Array of the current (x, y) position of each agent in world coordinates"""
+            return np.array([self.sim.getAgentPosition(agent) for agent in self.agents]).reshape(-1, 2)
+
+      def process_map(self, tolerance: float = 0.1) -> ObstacleSet:
             """Process the map into a format that RVO2 can use.
             Finds objects in the map and adds them to the RVO2
             simulator object.
-            """
-
-            # Obstacles are also supported.
-            o1 = self.sim.addObstacle([(0.1, 0.1), (-0.1, 0.1), (-0.1, -0.1), (-0.1, -0.1)])
-            self.sim.processObstacles()
 
-      def get_episode_data(self):
-            """Get positions of agents across episode and return
-            a list of the positions for each agent at each timestep.
+            Parameters
+            ----------
+            tolerance
+                  Simplification tolerance of the obstacle polygons in
+                  meters. The number of obstacle vertices drives the cost
+                  of RVO2's obstacle queries, so larger tolerances give
+                  faster simulations with coarser walls.
 
             Returns
             -------
-            episode_data
-                  List of lists of agent positions at each timestep
+            ObstacleSet
+                  Obstacle polygons added to the simulator, with the
+                  vertex counts before and after simplification
             """
+            if self._obstacle_set is None or self._obstacle_set.tolerance != tolerance:
+                  self._obstacle_set = extract_obstacles(self.environment, tolerance)
+            obstacle_set = self._obstacle_set
+            self.obstacles = [self.sim.addObstacle([tuple(vertex) for vertex in polygon])
+                  for polygon in obstacle_set.polygons]
+            self.sim.processObstacles()
 
-            #Assume agents have already been added to the simulator
-            pass
+            return obstacle_set
 
-      def add_agents(self):
+      def add_agents(self, positions: Optional[np.ndarray] = None) -> None:
             """Add agents to the simulation
-            """
-            a0 = self.sim.addAgent((0, 0))
-            a1 = self.sim.addAgent((1, 0))
-            a2 = self.sim.addAgent((1, 1))
-            a3 = self.sim.addAgent((0, 1))
 
-            self.agents = [a0, a1, a2, a3]
+            Parameters
+            ----------
+            positions
+                  Array of (x, y) start positions of the agents, defaults
+                  to the four agents of the RVO2 example
+            """
+            if positions is None:
+                  positions = [(0, 0), (1, 0), (1, 1), (0, 1)]
+            self.agents = [self.sim.addAgent(tuple(position)) for position in positions]
       
 
       def recreate_example(self):
@@ -0,0 +1,68 @@
+from importlib import import_module
+from typing import Dict, List, Union
+
+
+#Simulator backends by name, either as 'module:class' paths that are
+#imported on first use or as the resolved classes
+_simulators: Dict[str, Union[str, type]] = {
+    'orca': 'opam.simulation.orca:Orca',
+    'social_force': 'opam.simulation.social_force:SocialForce',
+}
+
+
+def register_simulator(name: str, simulator: Union[str, type])-> None:
+    """Register a simulator backend under a name, replacing any backend
+    with the same name.
+
+    Parameters
+    ----------
+    name
+        Name of the backend, e.g. to pass to Aggregator.simulate_episodes
+    simulator
+        Simulator subclass, or its 'module:class' path to import it only
+        when it is first used
+    """
+    if isinstance(simulator, str) and ':' not in simulator:
+        raise ValueError('Simulator paths must be of the form module:class, got ' + simulator)
+    _simulators[name] = simulator
+
+
+def available_simulators()-> List[str]:
+    """Names of the registered simulator backends"""
+    return sorted(_simulators)
+
+
+def get_simulator(simulator: Union[str, type])-> type:
+    """Resolve a simulator backend, importing its module on first use.
+
+    Parameters
+    ----------
+    simulator
+        Name of a registered backend, or a simulator class which is
+        returned as is
+
+    Returns
+    -------
+    type
+        Simulator subclass
+
+    Raises
+    ------
+    ValueError
+        If no backend is registered under the name
+    ImportError
+        If the module of the backend or one of its dependencies, like the
+        RVO2 bindings of 'orca', cannot be imported
+    """
+    if not isinstance(simulator, str):
+        return simulator
+    if simulator not in _simulators:
+        raise ValueError('Unknown simulator: ' + simulator + ', available simulators are '
+            + ', '.join(available_simulators()))
+
+    backend = _simulators[simulator]
+    if isinstance(backend, str):
+        module_name, class_name = backend.split(':')
+        backend = getattr(import_module(module_name), class_name)
+        _simulators[simulator] = backend
+    return backend
@@ -0,0 +1,296 @@
+import numpy as np
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+from opam.simulation.core import Simulator
+from opam.environment import Environment
+from opam.utils.annotation import distance_transform
+from opam.utils.cache import content_hash
+
+
+_wall_distance_cache = OrderedDict()
+_WALL_DISTANCE_CACHE_SIZE = 8
+
+
+def wall_distance(env: Environment)-> np.ndarray:
+    """Distance in meters from each pixel of an environment's map to the
+    nearest obstacle.
+
+    Results are cached by the content of the map, so environments sharing
+    a map only compute the distances once.
+
+    Parameters
+    ----------
+    env
+        Environment to compute the distances for
+
+    Returns
+    -------
+    np.ndarray
+        Array of distances with the shape of the map, inf everywhere if
+        the map has no obstacles
+    """
+    key = content_hash(env.map, env.obstacle, env.pix_per_meter)
+    if key in _wall_distance_cache:
+        _wall_distance_cache.move_to_end(key)
+        return _wall_distance_cache[key]
+
+    distance = (distance_transform(env.map == env.obstacle) / env.pix_per_meter).astype(np.float32)
+    logging.info('Computed the wall distances of %s', env.env_name)
+
+    _wall_distance_cache[key] = distance
+    if len(_wall_distance_cache) > _WALL_DISTANCE_CACHE_SIZE:
+        _wall_distance_cache.popitem(last=False)
+    return distance
+
+
+def neighbor_pairs(positions: np.ndarray, radius: float)-> Tuple[np.ndarray, np.ndarray]:
+    """Find the pairs of points closer than radius with a uniform grid.
+
+    Points are hashed into square cells of side radius and sorted by cell,
+    so the candidates of each point are the points in the 3 x 3 block of
+    cells around it, found with binary searches instead of comparing all
+    pairs of points.
+
+    Parameters
+    ----------
+    positions
+        Array of (x, y) positions
+    radius
+        Distance under which two points are neighbors
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Indices i and j of the neighbors, with each pair listed in both
+        orders and no point paired with itself
+    """
+    positions = np.asarray(positions, dtype=float)
+    if len(positions) < 2:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    cells = np.floor(positions / radius).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    num_rows = cells[:, 1].max() + 2
+    keys = cells[:, 0]*num_rows + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    neighbor_keys = (keys[:, np.newaxis]
+        + (np.arange(-1, 2)[:, np.newaxis]*num_rows + np.arange(-1, 2)).reshape(1, -1))
+    first = np.searchsorted(sorted_keys, neighbor_keys, side='left').reshape(-1)
+    counts = np.searchsorted(sorted_keys, neighbor_keys, side='right').reshape(-1) - first
+
+    total = counts.sum()
+    i = np.repeat(np.arange(len(positions)).repeat(neighbor_keys.shape[1]), counts)
+    within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = order[np.repeat(first, counts) + within]
+
+    offsets = positions[i] - positions[j]
+    close = (i != j) & (np.einsum('ij,ij->i', offsets, offsets) < radius**2)
+    return i[close], j[close]
+
+
+class SocialForce(Simulator):
+    """Vectorized social force simulator for pedestrians
+
+    Agents are pulled towards their preferred velocity and pushed away
+    from each other and from the walls by forces that decay exponentially
+    with distance. The state of all agents is held in arrays and every
+    step is a handful of array operations, so it needs no compiled
+    library and scales to thousands of agents. Neighbors are found with
+    a uniform grid and wall forces come from a distance transform of the
+    map, computed once per map.
+
+    Parameters
+    ----------
+    environment
+        Environment object to simulate in
+    time_step
+        Time step for simulation
+    neighbor_dist
+        The maximum distance at which agents push each other
+    radius
+        The radius of each agent. Must be positive.
+    max_speed
+        The maximum speed of each agent. Must be positive.
+    num_agents
+        The Number of agents to simulate
+    relaxation_time
+        Time for an agent to reach its preferred velocity
+    agent_strength
+        Force between two agents that are just touching
+    agent_range
+        Distance over which the force between agents decays by a factor e
+    wall_strength
+        Force between an agent and a wall it is just touching
+    wall_range
+        Distance over which the force of a wall decays by a factor e
+    navigate
+        If True, agents are routed around the walls with the navigation
+        layer of the environment, otherwise they head straight to their
+        goals, see Simulator
+    num_goals
+        Number of distinct goals of navigating agents, see Simulator
+
+    Attributes
+    ----------
+    environment
+        See above
+    time_step
+        See above
+    neighbor_dist
+        See above
+    radius
+        See above
+    max_speed
+        See above
+    num_agents
+        See above
+    relaxation_time
+        See above
+    agent_strength
+        See above
+    agent_range
+        See above
+    wall_strength
+        See above
+    wall_range
+        See above
+    navigate
+        See above
+    num_goals
+        See above
+    velocities
+        Array of the current (x, y) velocity of each agent
+    """
+    def __init__(
+        self,
+        environment: type[Environment],
+        time_step: float = 1/60,
+        neighbor_dist: float = 1.5,
+        radius: float = 0.4,
+        max_speed: float = 2.0,
+        num_agents: int = 5,
+        relaxation_time: float = 0.5,
+        agent_strength: float = 2.0,
+        agent_range: float = 0.3,
+        wall_strength: float = 10.0,
+        wall_range: float = 0.2,
+        navigate: bool = False,
+        num_goals: int = 16
+        ) -> None:
+        super().__init__(environment, navigate, num_goals)
+        self.time_step = time_step
+        self.neighbor_dist = neighbor_dist
+        self.radius = radius
+        self.max_speed = max_speed
+        self.num_agents = num_agents
+        self.relaxation_time = relaxation_time
+        self.agent_strength = agent_strength
+        self.agent_range = agent_range
+        self.wall_strength = wall_strength
+        self.wall_range = wall_range
+        self.velocities = np.zeros((0, 2))
+        self._positions = np.zeros((0, 2))
+        self._wall_distance = None
+
+    def reset(self, seed: Optional[Union[int, np.random.SeedSequence]] = None) -> None:
+        """Reset the simulation with num_agents agents placed at random
+        free positions, each walking to a random free goal that it can
+        reach.
+
+        Parameters
+        ----------
+        seed
+            Seed of the random number generator used to place the agents
+        """
+        self.rng = np.random.default_rng(seed)
+        self._wall_distance = wall_distance(self.environment)
+        self._positions, self.goals = self._sample_starts_and_goals(self.num_agents)
+        self.velocities = np.zeros_like(self._positions)
+
+    def step(self) -> None:
+        """Simulate one step with each agent heading to its goal"""
+        positions = self._positions
+        forces = (self._preferred_velocities(positions, self.max_speed, self.time_step)
+            - self.velocities) / self.relaxation_time
+        forces += self._agent_forces(positions)
+        distances, gradients = self._sample_wall_distance(positions)
+        forces += (self.wall_strength * np.exp((self.radius - distances) / self.wall_range))[:, np.newaxis] * gradients
+
+        velocities = self.velocities + forces * self.time_step
+        speeds = np.hypot(velocities[:, 0], velocities[:, 1])
+        velocities *= (np.minimum(speeds, self.max_speed) / np.maximum(speeds, 1e-9))[:, np.newaxis]
+
+        #Agents stay put rather than step closer to a wall they overlap
+        new_positions = positions + velocities * self.time_step
+        new_distances, _ = self._sample_wall_distance(new_positions)
+        blocked = (new_distances < self.radius) & (new_distances < distances)
+        new_positions[blocked] = positions[blocked]
+        velocities[blocked] = 0
+
+        self._positions = new_positions
+        self.velocities = velocities
+
+    @property
+    def positions(self) -> np.ndarray:
+        """Array of the current (x, y) position of each agent in world coordinates"""
+        return self._positions
+
+    def _agent_forces(self, positions: np.ndarray) -> np.ndarray:
+        """Repulsive forces between the agents closer than neighbor_dist
+
+        Parameters
+        ----------
+        positions
+            Array of (x, y) positions of the agents
+
+        Returns
+        -------
+        np.ndarray
+            Array of (x, y) forces on each agent
+        """
+        i, j = neighbor_pairs(positions, self.neighbor_dist)
+        offsets = positions[i] - positions[j]
+        distances = np.maximum(np.hypot(offsets[:, 0], offsets[:, 1]), 1e-9)
+        magnitudes = self.agent_strength * np.exp((2*self.radius - distances) / self.agent_range) / distances
+        forces = np.empty_like(positions)
+        forces[:, 0] = np.bincount(i, weights=offsets[:, 0]*magnitudes, minlength=len(positions))
+        forces[:, 1] = np.bincount(i, weights=offsets[:, 1]*magnitudes, minlength=len(positions))
+        return forces
+
+    def _sample_wall_distance(self, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Distance to the nearest wall and the direction away from it
+
+        Positions outside the map are treated as touching a wall.
+
+        Parameters
+        ----------
+        positions
+            Array of (x, y) positions of the agents
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Array of distances in meters and array of (x, y) unit vectors
+            pointing away from the nearest wall, zero where the distance
+            is flat
+        """
+        field = self._wall_distance
+        h, w = field.shape
+        pixels = self.environment._world_to_pixel(positions)
+        rows, cols = pixels[:, 0], pixels[:, 1]
+        inside = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+        rows, cols = np.clip(rows, 0, h - 1), np.clip(cols, 0, w - 1)
+
+        distances = np.where(inside, field[rows, cols], 0)
+        gradients = np.stack((
+            field[rows, np.minimum(cols + 1, w - 1)] - field[rows, np.maximum(cols - 1, 0)],
+            field[np.minimum(rows + 1, h - 1), cols] - field[np.maximum(rows - 1, 0), cols]), axis=-1)
+        gradients[~np.isfinite(gradients)] = 0
+        norms = np.hypot(gradients[:, 0], gradients[:, 1])
+        gradients /= np.maximum(norms, 1e-9)[:, np.newaxis]
+        return distances, gradients
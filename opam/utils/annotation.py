@@ -1,5 +1,4 @@
 import numpy as np
-from PIL import Image
 
 def _bresenhamline_nslope(slope):
     """
@@ -105,6 +104,47 @@ def bresenham_line(start, end, max_iter=5):
     # Return the points as a single array
     return _bresenhamlines(start, end, max_iter).reshape(-1, start.shape[-1])
 
+def bresenham_segments(start, end):
+    """
+    Ray trace many segments at once, each over exactly the points in
+    (start, end].
+
+    This is the ragged counterpart of _bresenhamlines: instead of tracing
+    every line for a shared max_iter, each segment i yields
+    max(abs(end[i] - start[i])) points, so short and long segments can be
+    traced together without padding. The points of each segment are
+    identical to bresenham_line(start[i:i+1], end[i:i+1], -1).
+
+    Parameters:
+        start: An array of start points (number of segments x dimension)
+        end:   An array of end points (number of segments x dimension)
+
+    Returns:
+        points (n x dimension) The points traversed by all segments, in
+        segment order.
+        segment (n) Index of the segment each point belongs to.
+
+    >>> s = np.array([[0, 0], [5, 5]])
+    >>> e = np.array([[2, 1], [5, 4]])
+    >>> points, segment = bresenham_segments(s, e)
+    >>> points
+    array([[1, 0],
+           [2, 1],
+           [5, 4]])
+    >>> segment
+    array([0, 0, 1])
+    """
+    start = np.asarray(start)
+    end = np.asarray(end)
+    lengths = np.amax(np.abs(end - start), axis=1, initial=0)
+    segment = np.repeat(np.arange(len(start)), lengths)
+    first = np.cumsum(lengths) - lengths
+    step = np.arange(len(segment)) - first[segment] + 1
+
+    nslope = _bresenhamline_nslope(end - start) if len(start) else np.zeros(start.shape)
+    points = start[segment] + nslope[segment] * step[:, np.newaxis]
+    return np.array(np.rint(points), dtype=start.dtype), segment
+
 def make_gaussian(size, fwhm = 3, center=None):
     """ Make a square gaussian kernel.
 
@@ -124,11 +164,344 @@ def make_gaussian(size, fwhm = 3, center=None):
 
     return np.exp(-4*np.log(2) * ((x-x0)**2 + (y-y0)**2) / fwhm**2)
 
+def footprint_offsets(mask, anchor):
+    """ Return the row and column offsets of the non-zero pixels of a
+    footprint mask relative to its anchor pixel.
+
+    The anchor is the pixel of the mask that is placed on the agent
+    position, so a mask stamped at pos covers pos + (rows, cols).
+    """
+    rows, cols = np.nonzero(mask)
+    return rows - anchor, cols - anchor
+
+def _footprint_runs(mask, anchor):
+    """ Decompose a footprint mask into horizontal runs.
+
+    Returns a list of (row_offset, col_offset_start, col_offset_end)
+    tuples with inclusive column offsets, one per contiguous run of
+    non-zero pixels in each row of the mask.
+    """
+    runs = []
+    mask = np.asarray(mask) > 0
+    for i, row in enumerate(mask):
+        padded = np.concatenate(([False], row, [False]))
+        edges = np.flatnonzero(padded[1:] != padded[:-1])
+        for start, end in zip(edges[::2], edges[1::2]):
+            runs.append((i - anchor, start - anchor, end - 1 - anchor))
+    return runs
+
+def binary_dilate(image, mask, anchor):
+    """ Dilate a boolean image with a footprint mask.
+
+    Every non-zero pixel p of image sets p + offset for each offset of
+    the footprint (see footprint_offsets), clipped to the image. The
+    footprint is decomposed into horizontal runs and each distinct run is
+    applied once with a cumulative sum along the rows, so the cost is
+    proportional to the image area times the number of runs rather than
+    the number of footprint pixels.
+    """
+    image = np.asarray(image, dtype=bool)
+    h, w = image.shape
+    out = np.zeros((h, w), dtype=bool)
+    runs = _footprint_runs(mask, anchor)
+    if not runs:
+        return out
+
+    # Pad the columns so every run reads a plain slice of the cumulative sum
+    pad_left = max(max(hi for _, _, hi in runs), 0)
+    pad_right = max(-min(lo for _, lo, _ in runs), 0)
+    cumsum = np.zeros((h, pad_left + w + pad_right + 1), dtype=np.int32)
+    np.cumsum(image, axis=1, out=cumsum[:, pad_left + 1:pad_left + w + 1])
+    cumsum[:, pad_left + w + 1:] = cumsum[:, pad_left + w:pad_left + w + 1]
+
+    # Group the row offsets of each distinct column span, so the dilated
+    # rows of a span are computed once, applied and dropped right away
+    spans = {}
+    for dr, lo, hi in runs:
+        if abs(dr) < h:
+            spans.setdefault((lo, hi), []).append(dr)
+
+    for (lo, hi), row_offsets in spans.items():
+        # dilated[r, c] = any(image[r, c - hi : c - lo + 1])
+        end = pad_left - lo + 1
+        start = pad_left - hi
+        dilated = cumsum[:, end:end + w] > cumsum[:, start:start + w]
+        for dr in row_offsets:
+            if dr >= 0:
+                out[dr:] |= dilated[:h - dr]
+            else:
+                out[:h + dr] |= dilated[-dr:]
+        del dilated
+
+    return out
+
+def swept_area_dense(pixel_path, shape, mask, anchor):
+    """ Swept area of an agent computed by stamping the footprint mask
+    onto a full size array once per path position.
+
+    This is the reference implementation the other engines are checked
+    against. Returns the sorted flat indices of the swept pixels.
+    """
+    swept_area = np.zeros(shape)
+    size = mask.shape[0]
+    for pos in pixel_path:
+        min_row = pos[0] - anchor
+        min_col = pos[1] - anchor
+        row0, col0 = max(min_row, 0), max(min_col, 0)
+        row1 = min(min_row + size, shape[0])
+        col1 = min(min_col + size, shape[1])
+        swept_area[row0:row1, col0:col1] += mask[row0 - min_row:row1 - min_row,
+                                                 col0 - min_col:col1 - min_col]
+    return np.flatnonzero(swept_area > 0)
+
+def _path_window(pixel_path, shape, mask, anchor):
+    """ Bounding box of a path and the pixels covered by its footprint,
+    clipped to the map.
+
+    Returns (row0, col0, row1, col1) with exclusive upper bounds.
+    """
+    d_rows, d_cols = footprint_offsets(mask, anchor)
+    low = pixel_path.min(axis=0) + [min(d_rows.min(initial=0), 0), min(d_cols.min(initial=0), 0)]
+    high = pixel_path.max(axis=0) + [max(d_rows.max(initial=0), 0), max(d_cols.max(initial=0), 0)] + 1
+    row0, col0 = max(int(low[0]), 0), max(int(low[1]), 0)
+    row1, col1 = min(int(high[0]), shape[0]), min(int(high[1]), shape[1])
+    return row0, col0, row1, col1
+
+def _window_to_flat(window_mask, row0, col0, shape):
+    """ Convert the non-zero pixels of a window to flat map indices """
+    rows, cols = np.nonzero(window_mask)
+    return (rows + row0) * shape[1] + (cols + col0)
+
+def swept_area_sparse(pixel_path, shape, mask, anchor):
+    """ Swept area of an agent computed by stamping the footprint offsets
+    of the unique path pixels into a boolean window covering the path's
+    bounding box.
+
+    Returns the sorted flat indices of the swept pixels.
+    """
+    pixel_path = np.asarray(pixel_path, dtype=np.int64).reshape(-1, 2)
+    if len(pixel_path) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    row0, col0, row1, col1 = _path_window(pixel_path, shape, mask, anchor)
+    window = np.zeros((row1 - row0, col1 - col0), dtype=bool)
+
+    local = pixel_path - [row0, col0]
+    local = np.unique(local[:, 0] * window.shape[1] + local[:, 1])
+    local_rows, local_cols = np.divmod(local, window.shape[1])
+    d_rows, d_cols = footprint_offsets(mask, anchor)
+
+    rows = (local_rows[:, np.newaxis] + d_rows).ravel()
+    cols = (local_cols[:, np.newaxis] + d_cols).ravel()
+    inside = (rows >= 0) & (rows < window.shape[0]) & (cols >= 0) & (cols < window.shape[1])
+    window[rows[inside], cols[inside]] = True
+
+    return _window_to_flat(window, row0, col0, shape)
+
+def swept_area_dilate(pixel_path, shape, mask, anchor):
+    """ Swept area of an agent computed by rasterizing the path into a
+    boolean window covering its bounding box and dilating it with the
+    footprint mask.
+
+    Returns the sorted flat indices of the swept pixels.
+    """
+    pixel_path = np.asarray(pixel_path, dtype=np.int64).reshape(-1, 2)
+    if len(pixel_path) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    row0, col0, row1, col1 = _path_window(pixel_path, shape, mask, anchor)
+    window = np.zeros((row1 - row0, col1 - col0), dtype=bool)
+    window[pixel_path[:, 0] - row0, pixel_path[:, 1] - col0] = True
+
+    return _window_to_flat(binary_dilate(window, mask, anchor), row0, col0, shape)
+
+def select_swept_area_engine(pixel_path, shape, mask, anchor):
+    """ Pick the cheapest swept area engine for a path.
+
+    Sparse stamping costs roughly one write per path pixel and footprint
+    pixel, while dilation costs a few passes over the path's bounding box
+    per footprint run. Short paths favour the former, long paths that
+    fill their bounding box favour the latter.
+    """
+    pixel_path = np.asarray(pixel_path).reshape(-1, 2)
+    if len(pixel_path) == 0:
+        return 'sparse'
+    row0, col0, row1, col1 = _path_window(pixel_path, shape, mask, anchor)
+    sparse_cost = len(pixel_path) * np.count_nonzero(mask)
+    dilate_cost = 4 * (row1 - row0) * (col1 - col0) * len(_footprint_runs(mask, anchor))
+    return 'sparse' if sparse_cost <= dilate_cost else 'dilate'
+
+SWEPT_AREA_ENGINES = {
+    'dense': swept_area_dense,
+    'sparse': swept_area_sparse,
+    'dilate': swept_area_dilate,
+}
+
+def swept_area(pixel_path, shape, mask, anchor, engine='auto'):
+    """ Flat indices of the pixels swept by an agent along a pixel path.
+
+    Parameters:
+        pixel_path: Array of pixel positions (number of points x 2)
+        shape: Shape of the map
+        mask: Square footprint mask of the agent
+        anchor: Index of the mask pixel placed on each path position
+        engine: Name of an engine in SWEPT_AREA_ENGINES, or 'auto' to
+                select one with select_swept_area_engine
+
+    Returns:
+        Sorted array of unique flat indices into a map of the given shape.
+    """
+    if engine == 'auto':
+        engine = select_swept_area_engine(pixel_path, shape, mask, anchor)
+    if engine not in SWEPT_AREA_ENGINES:
+        raise ValueError('Unknown swept area engine: ' + str(engine))
+    return SWEPT_AREA_ENGINES[engine](pixel_path, shape, mask, anchor)
+
+def sparse_counts(indices, counts=None):
+    """ Sum sparse counts given as flat indices.
+
+    Parameters:
+        indices: List of arrays of flat indices
+        counts: List of arrays with the count of each index, or None to
+                count each index once. Entries may also be None.
+
+    Returns:
+        Sorted unique flat indices and the total count of each of them.
+    """
+    if counts is None:
+        counts = [None] * len(indices)
+    indices = [np.asarray(i, dtype=np.int64) for i in indices]
+    counts = [np.ones(len(i), dtype=np.int64) if c is None else np.asarray(c, dtype=np.int64)
+              for i, c in zip(indices, counts)]
+    if not indices:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    unique, inverse = np.unique(np.concatenate(indices), return_inverse=True)
+    return unique, np.bincount(inverse, weights=np.concatenate(counts),
+                               minlength=len(unique)).astype(np.int64)
+
+def class_thresholds(values, class_distribution, max_histogram_bins=1 << 20):
+    """ Find the thresholds that split values into classes of given sizes.
+
+    Integer values are counted in a histogram in a single pass, other
+    values are split with a single np.partition call, so the values are
+    never fully sorted.
+
+    Parameters:
+        values: Array of positive values, e.g. the non-zero visitation
+                counts of a map
+        class_distribution: Fraction of the values in each class, from
+                the lowest to the highest values
+        max_histogram_bins: Largest value for which integer values are
+                counted in a histogram
+
+    Returns:
+        Array of len(class_distribution) - 1 increasing thresholds, where
+        class k holds the values in (thresholds[k-1], thresholds[k]].
+    """
+    values = np.asarray(values).reshape(-1)
+    cumulative = np.cumsum(class_distribution)[:-1]
+    ranks = np.clip(np.rint(cumulative * len(values)).astype(np.int64), 0, len(values))
+    if len(values) == 0:
+        return np.zeros(len(ranks))
+
+    integral = np.issubdtype(values.dtype, np.integer) or np.array_equal(values, np.floor(values))
+    if integral and values.max() <= max_histogram_bins:
+        cumulative_counts = np.cumsum(np.bincount(values.astype(np.int64)))
+        return np.searchsorted(cumulative_counts, ranks, side='left').astype(float)
+
+    kth = np.unique(np.maximum(ranks - 1, 0))
+    partitioned = np.partition(values, kth)
+    return np.where(ranks > 0, partitioned[np.maximum(ranks - 1, 0)], 0).astype(float)
+
+def segmentation_mask(counts, thresholds, dtype=np.uint8):
+    """ Label each pixel with the class of its count.
+
+    Parameters:
+        counts: Array of visitation counts
+        thresholds: Class thresholds from class_thresholds
+        dtype: Data type of the mask
+
+    Returns:
+        Array of the shape of counts, with class 0 for pixels that were
+        never visited and the class of the count for the others.
+    """
+    counts = np.asarray(counts)
+    return np.where(counts > 0, np.searchsorted(thresholds, counts, side='left'), 0).astype(dtype)
+
+def distance_transform(obstacles, return_offsets=False):
+    """ Approximate Euclidean distance from each pixel to the nearest
+    obstacle pixel.
+
+    Every pixel keeps the offset to its nearest known obstacle and four
+    sweeps (top to bottom, bottom to top, left to right and right to left)
+    propagate offsets from the three neighbours in the previous row or
+    column, one whole row or column at a time. This is a vectorized form
+    of vector propagation, which is exact except for rare pixels that are
+    off by a fraction of a pixel.
+
+    Parameters:
+        obstacles: Boolean array that is True for obstacle pixels
+        return_offsets: If True, also return the offsets
+
+    Returns:
+        distance (rows x cols) Distance in pixels to the nearest obstacle,
+        inf everywhere if there are no obstacles.
+        offsets (rows x cols x 2) Row and column offset from each pixel to
+        its nearest obstacle, only if return_offsets is True.
+    """
+    obstacles = np.asarray(obstacles, dtype=bool)
+    if not obstacles.any():
+        distance = np.full(obstacles.shape, np.inf)
+        if return_offsets:
+            return distance, np.zeros(obstacles.shape + (2,), dtype=np.int64)
+        return distance
+
+    #Offsets along and across the sweep direction, and squared distances.
+    #Unreached pixels are far enough away to lose against any obstacle.
+    far = 1 << 20
+    along = np.where(obstacles, 0, far).astype(np.int64)
+    across = np.zeros(obstacles.shape, dtype=np.int64)
+    dist2 = np.where(obstacles, 0, 2 * far**2).astype(np.int64)
+
+    def sweep(along, across, dist2, step):
+        #Propagate from each row to the next one in the sweep direction
+        rows = range(1, len(dist2)) if step > 0 else range(len(dist2) - 2, -1, -1)
+        for row in rows:
+            prev_along = along[row - step] - step
+            prev_across = across[row - step]
+            best_along, best_across, best_dist2 = along[row], across[row], dist2[row]
+            for shift in (0, 1, -1):
+                target = slice(max(0, -shift), len(best_dist2) - max(0, shift))
+                source = slice(max(0, shift), len(best_dist2) - max(0, -shift))
+                candidate_along = prev_along[source]
+                candidate_across = prev_across[source] + shift
+                candidate_dist2 = candidate_along**2 + candidate_across**2
+                better = np.flatnonzero(candidate_dist2 < best_dist2[target]) + target.start
+                if len(better):
+                    source_better = better - target.start
+                    best_along[better] = candidate_along[source_better]
+                    best_across[better] = candidate_across[source_better]
+                    best_dist2[better] = candidate_dist2[source_better]
+
+    sweep(along, across, dist2, 1)
+    sweep(along, across, dist2, -1)
+    #Sweep along the columns on contiguous transposed copies
+    along, across, dist2 = (np.ascontiguousarray(array.T) for array in (across, along, dist2))
+    sweep(along, across, dist2, 1)
+    sweep(along, across, dist2, -1)
+
+    distance = np.sqrt(dist2.T)
+    if return_offsets:
+        return distance, np.stack((across.T, along.T), axis=-1)
+    return distance
+
 def make_image(array, filename='', save=False):
     array = np.asarray(array)
     array /= array.max()
     array *= 255
     
+    from PIL import Image
     image = Image.fromarray(array.astype(np.uint8))
     image.show()
     if save:
@@ -0,0 +1,249 @@
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+from os import makedirs
+from os.path import join
+from subprocess import DEVNULL, CalledProcessError, check_output
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from opam.environment import Environment
+from opam.utils.io import EpisodeWriter
+from opam.utils.synthetic import make_corridors_map, make_episodes, make_rooms_map
+
+
+#Sizes of the synthetic benchmark problems, where num_navigated_agents
+#exceeds the number of distance fields of the map that the navigation
+#cache can hold, so scaling with the number of distinct goals shows up
+SIZES = {
+    'small': dict(width=40.0, height=40.0, pix_per_meter=10, num_episodes=10, num_paths=10, num_steps=200,
+        num_agents=50, num_simulation_steps=100, num_navigated_agents=500),
+    'medium': dict(width=100.0, height=100.0, pix_per_meter=10, num_episodes=20, num_paths=20, num_steps=400,
+        num_agents=200, num_simulation_steps=200, num_navigated_agents=200),
+    'large': dict(width=250.0, height=250.0, pix_per_meter=20, num_episodes=40, num_paths=25, num_steps=600,
+        num_agents=1000, num_simulation_steps=200, num_navigated_agents=1000),
+}
+
+
+def _timed(function: Callable[[], Any], repeats: int)-> Dict[str, Any]:
+    """Run a function repeats times and summarize the durations"""
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {'min': min(durations), 'median': float(np.median(durations)), 'repeats': repeats}
+
+
+def make_environment(layout: str, size: Dict[str, Any], seed: int = 0)-> Environment:
+    """Create an environment with a synthetic 'rooms' or 'corridors' map"""
+    generators = {'rooms': make_rooms_map, 'corridors': make_corridors_map}
+    if layout not in generators:
+        raise ValueError('Unknown layout: ' + str(layout))
+    map = generators[layout](size['width'], size['height'], size['pix_per_meter'], seed=seed)
+    return Environment(layout, map, size['pix_per_meter'])
+
+
+def _scenarios(env: Environment, size: Dict[str, Any], seed: int, directory: str)-> Dict[str, Callable[[], Any]]:
+    """Set up the benchmark scenarios of an environment, returning the
+    functions to time by name
+    """
+    episodes = make_episodes(env, size['num_episodes'], size['num_paths'], size['num_steps'], seed=seed)
+    paths = [path for episode in episodes for path in episode]
+    pixel_paths = [env._raytrace_path(path) for path in paths]
+    env.episodes = episodes
+
+    with EpisodeWriter(join(directory, env.env_name + '_benchmark.json')) as writer:
+        for episode in episodes:
+            writer.write(episode)
+
+    def load_episodes()-> None:
+        from opam.aggregation.core import Aggregator
+        aggregator = Aggregator()
+        aggregator.maps[env.env_name] = env
+        aggregator.load_episodes(directory + '/', num_episodes=0, use_cache=False)
+        env.episodes = episodes
+
+    def raytrace_path()-> None:
+        for path in paths:
+            env._raytrace_path(path)
+
+    def swept_area()-> None:
+        for pixel_path in pixel_paths:
+            env._swept_area(pixel_path)
+
+    def compute_visitation_counts()-> None:
+        env.compute_visitation_counts()
+
+    from opam.simulation.social_force import SocialForce
+    simulator = SocialForce(env, num_agents=size['num_agents'])
+
+    def simulation_steps()-> None:
+        simulator.reset(seed)
+        for _ in range(size['num_simulation_steps']):
+            simulator.step()
+
+    navigated_simulator = SocialForce(env, num_agents=size['num_navigated_agents'], navigate=True)
+
+    def navigated_simulation_steps()-> None:
+        navigated_simulator.reset(seed)
+        for _ in range(size['num_simulation_steps']):
+            navigated_simulator.step()
+
+    return {
+        'load_episodes': load_episodes,
+        'raytrace_path': raytrace_path,
+        'swept_area': swept_area,
+        'compute_visitation_counts': compute_visitation_counts,
+        'simulation_steps': simulation_steps,
+        'navigated_simulation_steps': navigated_simulation_steps,
+    }
+
+
+def _git_commit()-> Optional[str]:
+    try:
+        return check_output(['git', 'rev-parse', 'HEAD'], stderr=DEVNULL).decode().strip()
+    except (OSError, CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    size: str = 'small',
+    layouts: Tuple[str, ...] = ('rooms', 'corridors'),
+    scenarios: Optional[List[str]] = None,
+    repeats: int = 3,
+    seed: int = 0
+    )-> Dict[str, Any]:
+    """Time the benchmark scenarios on synthetic maps and episodes
+
+    Every scenario is run once to warm up caches such as the configuration
+    space, then repeats times.
+
+    Parameters
+    ----------
+    size
+        Name of the problem size in SIZES
+    layouts
+        Layouts of the synthetic maps, 'rooms' or 'corridors'
+    scenarios
+        Names of the scenarios to run, defaults to all of them
+    repeats
+        Number of timed runs of each scenario
+    seed
+        Seed of the maps and episodes
+
+    Returns
+    -------
+    Dict[str, Any]
+        Results with a 'meta' description of the run and the 'results'
+        of each '<layout>/<scenario>', with the 'min' and 'median'
+        durations in seconds
+    """
+    if size not in SIZES:
+        raise ValueError('Unknown size: ' + str(size))
+    problem = SIZES[size]
+
+    results = {}
+    with TemporaryDirectory() as directory:
+        for layout in layouts:
+            env = make_environment(layout, problem, seed)
+            layout_directory = join(directory, layout)
+            makedirs(layout_directory)
+            functions = _scenarios(env, problem, seed, layout_directory)
+            for name, function in functions.items():
+                if scenarios is not None and name not in scenarios:
+                    continue
+                function()
+                results[layout + '/' + name] = _timed(function, repeats)
+                logging.info('%s/%s: %.4f s', layout, name, results[layout + '/' + name]['min'])
+
+    meta = {
+        'size': size,
+        'problem': problem,
+        'repeats': repeats,
+        'seed': seed,
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    return {'meta': meta, 'results': results}
+
+
+def compare_benchmarks(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = 0.1
+    )-> List[Dict[str, Any]]:
+    """Compare two benchmark results scenario by scenario
+
+    Parameters
+    ----------
+    baseline
+        Results of run_benchmarks to compare against
+    current
+        Results of run_benchmarks to compare
+    threshold
+        Relative slowdown of the minimum duration above which a scenario
+        is a regression
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One row per scenario in both results, with the 'scenario' name,
+        the 'baseline' and 'current' minimum durations, their 'ratio' and
+        whether it is a 'regression'
+    """
+    rows = []
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        before, after = baseline['results'][name]['min'], current['results'][name]['min']
+        ratio = after / before if before > 0 else float('inf')
+        rows.append({'scenario': name, 'baseline': before, 'current': after, 'ratio': ratio,
+            'regression': ratio > 1 + threshold})
+    return rows
+
+
+if __name__ == '__main__':
+    #Run the benchmarks and write the results to a JSON file, or compare
+    #two result files and fail if any scenario got slower
+
+    parser = argparse.ArgumentParser(description='Benchmark OPAM on synthetic maps and episodes.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--output', default='benchmark.json', help='Path of the JSON results')
+    run_parser.add_argument('--size', default='small', choices=sorted(SIZES), help='Problem size')
+    run_parser.add_argument('--layouts', nargs='+', default=['rooms', 'corridors'],
+        help='Layouts of the synthetic maps')
+    run_parser.add_argument('--scenarios', nargs='+', default=None, help='Scenarios to run')
+    run_parser.add_argument('--repeats', type=int, default=3, help='Number of timed runs')
+    run_parser.add_argument('--seed', type=int, default=0, help='Seed of the maps and episodes')
+    compare_parser = subparsers.add_parser('compare', help='Compare two benchmark results')
+    compare_parser.add_argument('baseline', help='JSON results to compare against')
+    compare_parser.add_argument('current', help='JSON results to compare')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+        help='Relative slowdown above which a scenario is a regression')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'run':
+        results = run_benchmarks(args.size, tuple(args.layouts), args.scenarios, args.repeats, args.seed)
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        logging.info('Wrote the results to %s', args.output)
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+        rows = compare_benchmarks(baseline, current, args.threshold)
+        for row in rows:
+            print('%-40s %10.4f %10.4f %7.2fx%s' % (row['scenario'], row['baseline'], row['current'],
+                row['ratio'], '  REGRESSION' if row['regression'] else ''))
+        sys.exit(1 if any(row['regression'] for row in rows) else 0)
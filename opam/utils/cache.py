@@ -0,0 +1,171 @@
+import numpy as np
+from hashlib import blake2b
+from os import getpid, listdir, makedirs, remove, replace, stat, utime
+from os.path import isdir, join
+from typing import Any, List, Optional, Tuple
+
+
+def content_hash(*parts: Any)-> str:
+    """Hash arrays, bytes and other values into a hex digest.
+
+    Arrays are hashed by dtype, shape and content, so equal arrays give
+    the same digest regardless of their memory layout. Other values are
+    hashed through their repr.
+    """
+    digest = blake2b(digest_size=20)
+    for part in parts:
+        if isinstance(part, np.ndarray) or hasattr(part, '__array__'):
+            array = np.ascontiguousarray(part)
+            digest.update(array.dtype.str.encode())
+            digest.update(repr(array.shape).encode())
+            digest.update(array.data if array.size else b'')
+        elif isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ContributionCache:
+    """Content-addressed on-disk cache of sparse visitation counts
+
+    Each entry holds the sorted flat indices of the pixels visited in one
+    episode and the number of times each of them was visited, stored as
+    an .npz file named after its key. Entries are written atomically, so
+    several processes can share a cache directory. When the cache grows
+    past max_bytes, the least recently used entries are removed until it
+    is back under low_water times max_bytes, so the directory is only
+    scanned once every few puts rather than on every put of a full cache.
+
+    Parameters
+    ----------
+    cache_dir
+        Directory where the entries are stored
+    max_bytes
+        Maximum total size of the entries, or None for no limit
+    low_water
+        Fraction of max_bytes the cache is reduced to when it is full
+
+    Attributes
+    ----------
+    cache_dir
+        See above
+    max_bytes
+        See above
+    low_water
+        See above
+    hits
+        Number of entries found by get
+    misses
+        Number of entries not found by get
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = 1 << 30, low_water: float = 0.9)-> None:
+        if not 0 <= low_water <= 1:
+            raise ValueError('The low water mark must be between 0 and 1, got ' + str(low_water))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def __getstate__(self)-> dict:
+        state = self.__dict__.copy()
+        state['hits'] = state['misses'] = 0
+        return state
+
+    def _path(self, key: str)-> str:
+        return join(self.cache_dir, key[:2], key + '.npz')
+
+    def _entries(self)-> List[Tuple[float, str, int]]:
+        """List the entries as (last use time, path, size) tuples"""
+        entries = []
+        for prefix in listdir(self.cache_dir):
+            directory = join(self.cache_dir, prefix)
+            if not isdir(directory):
+                continue
+            for name in listdir(directory):
+                if not name.endswith('.npz'):
+                    continue
+                path = join(directory, name)
+                try:
+                    info = stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((info.st_mtime, path, info.st_size))
+        return entries
+
+    def get(self, key: str)-> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Return the flat indices and counts stored under key, or None
+
+        Reading an entry marks it as recently used.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                indices, counts = entry['indices'], entry['counts']
+            utime(path)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return indices.astype(np.int64), counts.astype(np.int64)
+
+    def put(self, key: str, indices: np.ndarray, counts: np.ndarray)-> None:
+        """Store flat indices and counts under key and evict old entries
+        if the cache is over its size limit.
+
+        The size of the cache is tracked from the entries this process
+        writes, replacing the size of an entry it overwrites, and is
+        recomputed from the directory whenever entries are evicted.
+        """
+        path = self._path(key)
+        makedirs(join(self.cache_dir, key[:2]), exist_ok=True)
+        counts_dtype = np.uint16 if len(counts) == 0 or counts.max() <= np.iinfo(np.uint16).max else np.int64
+        temp_path = path[:-len('.npz')] + '.' + str(getpid()) + '.tmp'
+        with open(temp_path, 'wb') as file:
+            np.savez(file, indices=np.asarray(indices, dtype=np.int64),
+                counts=np.asarray(counts).astype(counts_dtype))
+        size = stat(temp_path).st_size
+        try:
+            size -= stat(path).st_size
+        except FileNotFoundError:
+            pass
+        replace(temp_path, path)
+
+        self._size += size
+        if self.max_bytes is not None and self._size > self.max_bytes:
+            self.evict(int(self.max_bytes * self.low_water))
+
+    def evict(self, max_bytes: Optional[int] = None)-> int:
+        """Remove the least recently used entries until the cache fits in
+        max_bytes (defaults to the size limit of the cache).
+
+        Returns
+        -------
+        int
+            Number of entries removed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        removed = 0
+
+        for _, path, size in entries:
+            if max_bytes is None or self._size <= max_bytes:
+                break
+            try:
+                remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            removed += 1
+
+        return removed
+
+    def clear(self)-> None:
+        """Remove all the entries"""
+        self.evict(0)
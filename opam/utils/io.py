@@ -0,0 +1,395 @@
+import numpy as np
+import struct
+from json import JSONDecoder, JSONDecodeError, dump, dumps, load
+from os import makedirs, remove
+from os.path import basename, getmtime, isfile, join, splitext
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from opam.environment.episodes import EpisodeStore, _offsets
+
+
+#Characters that can continue a JSON number
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+class _JSONStream:
+    """Incremental reader of a JSON document from a text file
+
+    Values are decoded one at a time with JSONDecoder.raw_decode, reading
+    more of the file whenever a value runs past the end of the buffer, so
+    only the value being decoded has to fit in memory.
+
+    Parameters
+    ----------
+    file
+        Text file object to read the JSON document from
+    chunk_size
+        Number of characters to read from the file at a time
+    """
+
+    def __init__(self, file: TextIO, chunk_size: int = 1 << 16)-> None:
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.chars_read = 0
+
+    def _read(self, size: int)-> bool:
+        """Append up to size characters to the buffer, return False at EOF"""
+        if self.eof:
+            return False
+        if self.pos > len(self.buffer) // 2:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.file.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.chars_read += len(chunk)
+        self.buffer += chunk
+        return True
+
+    def peek(self)-> str:
+        """Skip whitespace and return the next character, '' at EOF"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._read(self.chunk_size):
+                return self.buffer[self.pos:self.pos+1]
+
+    def expect(self, chars: str)-> str:
+        """Consume the next character, which must be one of chars"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError('Expected one of ' + repr(chars) + ' at character '
+                + str(self.chars_read - len(self.buffer) + self.pos) + ', found ' + repr(char))
+        self.pos += 1
+        return char
+
+    def value(self)-> Any:
+        """Decode the next JSON value"""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except JSONDecodeError:
+                if not self._read(size):
+                    raise
+                size *= 2
+                continue
+            #A number cut at the end of the buffer, e.g. 1. or 1e of 1.25 or
+            #1e-5, may decode as a shorter number that continues in the
+            #next chunk
+            if isinstance(value, (int, float)) and not isinstance(value, bool) \
+                and (end == len(self.buffer) or self.buffer[end] in _NUMBER_CHARS) \
+                and self._read(size):
+                size *= 2
+                continue
+            self.pos = end
+            return value
+
+    def items(self)-> Iterator[Tuple[str, '_JSONStream']]:
+        """Iterate over the keys of the next JSON object.
+
+        After each key the stream is positioned on its value, which the
+        caller must consume (e.g. with value() or elements()) before
+        advancing the iterator.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key, self
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self)-> Iterator['_JSONStream']:
+        """Iterate over the elements of the next JSON array.
+
+        Each element must be consumed by the caller before advancing the
+        iterator.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_episodes(
+    file: TextIO,
+    num_episodes: int = 0,
+    chunk_size: int = 1 << 16
+    )-> Iterator[List[List[List[float]]]]:
+    """Incrementally read the episodes of an episode file.
+
+    The file is expected to hold an object with an 'episodes' array, where
+    each episode has a 'pedestrians' array and each pedestrian a 'path'
+    of [x, y] positions. Episodes are decoded and yielded one at a time
+    and reading stops as soon as num_episodes have been yielded, so the
+    rest of the file is never read.
+
+    Parameters
+    ----------
+    file
+        Text file object to read the episode data from
+    num_episodes
+        Number of episodes to read, or 0 to read all of them
+    chunk_size
+        Number of characters to read from the file at a time
+
+    Yields
+    ------
+    List[List[List[float]]]
+        List of the paths of the pedestrians of each episode
+    """
+    stream = _JSONStream(file, chunk_size)
+    count = 0
+
+    for key, value in stream.items():
+        if key != 'episodes':
+            value.value()
+            continue
+        for element in value.elements():
+            episode = element.value()
+            yield [ped['path'] for ped in episode['pedestrians']]
+            count += 1
+            if num_episodes and count >= num_episodes:
+                return
+
+
+EPISODE_CACHE_SUFFIX = '.episodes'
+EPISODE_CACHE_VERSION = 1
+
+
+def episode_cache_path(episode_file_path: str)-> str:
+    """Path of the binary episode cache for an episode file.
+
+    The cache is a directory next to the episode file with the same name
+    and the extension replaced by EPISODE_CACHE_SUFFIX.
+    """
+    return splitext(episode_file_path)[0] + EPISODE_CACHE_SUFFIX
+
+
+def is_episode_cache_fresh(episode_file_path: str, cache_path: Optional[str] = None)-> bool:
+    """Check if the binary cache of an episode file exists and is at
+    least as recent as the episode file.
+    """
+    cache_path = cache_path or episode_cache_path(episode_file_path)
+    header_path = join(cache_path, 'header.json')
+    return isfile(header_path) and getmtime(header_path) >= getmtime(episode_file_path)
+
+
+def _npy_header(dtype: Any, shape: Tuple[int, ...], length: Optional[int] = None)-> bytes:
+    """Header of a version 1.0 .npy file of a C-ordered array, padded with
+    spaces to length bytes or to the 64 byte alignment of the format
+    """
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False,
+        'shape': tuple(shape)})
+    length = length or -(-(len(header) + 11) // 64) * 64
+    header = header.ljust(length - 11) + '\n'
+    return np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def write_episode_cache(
+    episodes: Iterable[List[List[List[float]]]],
+    cache_path: str,
+    map_name: Optional[str] = None,
+    pix_per_meter: Optional[int] = None,
+    dtype: Any = np.float32
+    )-> Dict[str, Any]:
+    """Write episodes to a binary episode cache.
+
+    The cache is a directory holding the coordinates of all the paths in
+    coords.npy (points x 2), the offsets of the paths into the coordinates
+    in path_offsets.npy, the offsets of the episodes into the paths in
+    episode_offsets.npy and a small header.json. Episodes are consumed one
+    at a time, so an iter_episodes generator can be converted without
+    holding the whole file in memory.
+
+    Parameters
+    ----------
+    episodes
+        Iterable of episodes, where each episode is a list of paths
+    cache_path
+        Path of the cache directory to write
+    map_name
+        Name of the map the episodes belong to
+    pix_per_meter
+        Number of pixels per meter of the map
+    dtype
+        Data type of the stored coordinates
+
+    Returns
+    -------
+    Dict[str, Any]
+        Header of the cache
+    """
+    #Remove the header first so a cache being rewritten is not fresh until
+    #all of it has been written
+    makedirs(cache_path, exist_ok=True)
+    header_path = join(cache_path, 'header.json')
+    if isfile(header_path):
+        remove(header_path)
+    path_lengths = []
+    episode_lengths = []
+
+    #The coordinates are appended after a header with room for any number
+    #of points, which is filled in once the number is known
+    coords_path = join(cache_path, 'coords.npy')
+    placeholder = _npy_header(dtype, (np.iinfo(np.int64).max, 2))
+    with open(coords_path, 'wb') as coords:
+        coords.write(placeholder)
+        for paths in episodes:
+            episode_lengths.append(len(paths))
+            for path in paths:
+                block = np.asarray(path, dtype=dtype).reshape(-1, 2)
+                coords.write(block.tobytes())
+                path_lengths.append(len(block))
+
+        num_points = int(np.sum(path_lengths, dtype=np.int64))
+        coords.seek(0)
+        coords.write(_npy_header(dtype, (num_points, 2), len(placeholder)))
+
+    np.save(join(cache_path, 'path_offsets.npy'), _offsets(path_lengths))
+    np.save(join(cache_path, 'episode_offsets.npy'), _offsets(episode_lengths))
+
+    header = {
+        'version': EPISODE_CACHE_VERSION,
+        'map_name': map_name,
+        'pix_per_meter': pix_per_meter,
+        'num_episodes': len(episode_lengths),
+        'num_paths': len(path_lengths),
+        'num_points': num_points,
+        'dtype': np.dtype(dtype).str
+    }
+    #The header is written last so an interrupted conversion is never fresh
+    with open(header_path, 'w') as file:
+        dump(header, file)
+
+    return header
+
+
+def read_episode_cache(cache_path: str, mmap: bool = True)-> Tuple[EpisodeStore, Dict[str, Any]]:
+    """Open a binary episode cache written by write_episode_cache.
+
+    Parameters
+    ----------
+    cache_path
+        Path of the cache directory
+    mmap
+        If True, memory-map the coordinates so only the episodes that are
+        accessed are read from disk, otherwise load them into memory
+
+    Returns
+    -------
+    EpisodeStore
+        Store backed by the cached coordinates
+    Dict[str, Any]
+        Header of the cache
+
+    Raises
+    ------
+    ValueError
+        If the cache was written by an unsupported version
+    """
+    with open(join(cache_path, 'header.json'), 'r') as file:
+        header = load(file)
+    if header.get('version') != EPISODE_CACHE_VERSION:
+        raise ValueError('Unsupported episode cache version: ' + str(header.get('version')))
+
+    coords = np.load(join(cache_path, 'coords.npy'), mmap_mode='r' if mmap else None)
+    path_offsets = np.load(join(cache_path, 'path_offsets.npy'))
+    episode_offsets = np.load(join(cache_path, 'episode_offsets.npy'))
+    return EpisodeStore(coords, path_offsets, episode_offsets), header
+
+
+def convert_episode_file(
+    episode_file_path: str,
+    cache_path: Optional[str] = None,
+    map_name: Optional[str] = None,
+    pix_per_meter: Optional[int] = None
+    )-> Dict[str, Any]:
+    """Convert a JSON episode file into a binary episode cache.
+
+    Parameters
+    ----------
+    episode_file_path
+        Path of the JSON episode file
+    cache_path
+        Path of the cache directory, defaults to episode_cache_path
+    map_name
+        Name of the map the episodes belong to, defaults to the name of
+        the episode file without its extension
+    pix_per_meter
+        Number of pixels per meter of the map
+
+    Returns
+    -------
+    Dict[str, Any]
+        Header of the cache
+    """
+    cache_path = cache_path or episode_cache_path(episode_file_path)
+    map_name = map_name or splitext(basename(episode_file_path))[0]
+    with open(episode_file_path, 'r') as file:
+        return write_episode_cache(iter_episodes(file), cache_path, map_name, pix_per_meter)
+
+
+
+class EpisodeWriter:
+    """Stream episodes to a JSON episode file that iter_episodes and
+    Aggregator.load_episodes can read
+
+    Episodes are written as soon as they are given, so files with many
+    episodes never have to be held in memory. Use as a context manager
+    to close the episode list and the file.
+
+    Parameters
+    ----------
+    episode_file_path
+        Path of the JSON episode file to write
+
+    Attributes
+    ----------
+    num_episodes
+        Number of episodes written so far
+    """
+
+    def __init__(self, episode_file_path: str)-> None:
+        self.file = open(episode_file_path, 'w')
+        self.file.write('{"episodes": [')
+        self.num_episodes = 0
+
+    def __enter__(self)-> 'EpisodeWriter':
+        return self
+
+    def __exit__(self, *exc_info: Any)-> None:
+        self.close()
+
+    def write(self, paths: Iterable[Iterable[Iterable[float]]])-> None:
+        """Write an episode
+
+        Parameters
+        ----------
+        paths
+            Paths of the pedestrians of the episode, e.g. an array with
+            shape (pedestrians x timesteps x 2)
+        """
+        episode = {'pedestrians': [{'path': np.asarray(path, dtype=float).tolist()} for path in paths]}
+        self.file.write((',\n' if self.num_episodes else '\n') + dumps(episode))
+        self.num_episodes += 1
+
+    def close(self)-> None:
+        """Close the episode list and the file"""
+        if not self.file.closed:
+            self.file.write('\n]}\n')
+            self.file.close()
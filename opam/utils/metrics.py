@@ -0,0 +1,166 @@
+import io
+from collections import defaultdict
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, Dict, Iterator, Optional
+
+
+class _Timer:
+    """Context manager adding the time spent in its block to a timer"""
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str)-> None:
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self)-> '_Timer':
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any)-> None:
+        timer = self.metrics.timers[self.name]
+        timer[0] += perf_counter() - self.start
+        timer[1] += 1
+
+
+class _NullTimer:
+    """Context manager that does nothing, used when metrics are disabled"""
+    __slots__ = ()
+
+    def __enter__(self)-> '_NullTimer':
+        return self
+
+    def __exit__(self, *exc_info: Any)-> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Timers and counters of the stages of loading and annotation
+
+    Metrics are disabled by default, in which case timer returns a shared
+    context manager that does nothing and count returns immediately, so
+    instrumented code only pays for a method call.
+
+    Attributes
+    ----------
+    enabled
+        Whether timers and counters are recorded
+    profiling
+        Whether the blocks wrapped with profile are run under cProfile
+    timers
+        Dictionary where the key is the stage name and the value is a list
+        of the total time in seconds and the number of calls
+    counters
+        Dictionary where the key is the counter name and the value is its
+        total
+    profiles
+        Dictionary where the key is the name of a profiled block and the
+        value is its pstats.Stats
+    """
+
+    def __init__(self)-> None:
+        self.enabled = False
+        self.profiling = False
+        self.timers = defaultdict(lambda: [0.0, 0])
+        self.counters = defaultdict(int)
+        self.profiles = {}
+
+    def enable(self, profiling: bool = False)-> None:
+        """Start recording, and profiling if profiling is True"""
+        self.enabled = True
+        self.profiling = profiling
+
+    def disable(self)-> None:
+        """Stop recording and profiling, keeping what was recorded"""
+        self.enabled = False
+        self.profiling = False
+
+    def reset(self)-> None:
+        """Clear the recorded timers, counters and profiles"""
+        self.timers.clear()
+        self.counters.clear()
+        self.profiles.clear()
+
+    def timer(self, name: str)-> Any:
+        """Context manager timing its block under name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def count(self, name: str, value: int = 1)-> None:
+        """Add value to the counter name"""
+        if self.enabled:
+            self.counters[name] += int(value)
+
+    @contextmanager
+    def profile(self, name: str)-> Iterator[None]:
+        """Run a block under cProfile if profiling is enabled, merging the
+        statistics of the runs of blocks with the same name
+        """
+        if not self.profiling:
+            yield
+            return
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if name in self.profiles:
+                self.profiles[name].add(profiler)
+            else:
+                self.profiles[name] = pstats.Stats(profiler)
+
+    def snapshot(self)-> Dict[str, Dict[str, Any]]:
+        """Return the timers and counters as plain dictionaries, e.g. to
+        send them from a worker process to merge
+        """
+        return {'timers': {name: list(timer) for name, timer in self.timers.items()},
+            'counters': dict(self.counters)}
+
+    def merge(self, snapshot: Optional[Dict[str, Dict[str, Any]]])-> None:
+        """Add the timers and counters of a snapshot"""
+        if not snapshot:
+            return
+        for name, (seconds, calls) in snapshot['timers'].items():
+            timer = self.timers[name]
+            timer[0] += seconds
+            timer[1] += calls
+        for name, value in snapshot['counters'].items():
+            self.counters[name] += value
+
+    def report(self, profile_limit: int = 20)-> str:
+        """Format the timers, counters and profiles as a text report
+
+        Parameters
+        ----------
+        profile_limit
+            Number of functions listed for each profile
+
+        Returns
+        -------
+        str
+            Report with one line per timer and counter
+        """
+        lines = ['%-24s %12s %10s %12s' % ('stage', 'seconds', 'calls', 'ms/call')]
+        for name, (seconds, calls) in sorted(self.timers.items(), key=lambda item: -item[1][0]):
+            lines.append('%-24s %12.4f %10d %12.4f' % (name, seconds, calls, 1000*seconds/max(calls, 1)))
+        lines.append('')
+        lines.append('%-24s %12s' % ('counter', 'total'))
+        for name, value in sorted(self.counters.items()):
+            lines.append('%-24s %12d' % (name, value))
+        for name, stats in self.profiles.items():
+            stream = io.StringIO()
+            stats.stream = stream
+            stats.sort_stats('cumulative').print_stats(profile_limit)
+            lines.extend(['', 'profile of ' + name, stream.getvalue()])
+        return '\n'.join(lines)
+
+
+#Metrics of the current process
+metrics = Metrics()
@@ -0,0 +1,197 @@
+import numpy as np
+from typing import List
+
+
+def make_rooms_map(
+    width: float = 50.0,
+    height: float = 50.0,
+    pix_per_meter: int = 10,
+    room_size: float = 8.0,
+    wall_thickness: float = 0.3,
+    door_width: float = 1.5,
+    seed: int = 0,
+    obstacle: int = 0,
+    free: int = 1
+    )-> np.ndarray:
+    """Generate a map of a grid of rooms connected by doors
+
+    Walls run along a grid of rooms of about room_size meters, with one
+    door at a random place of each wall between two rooms, so every room
+    can be reached. The map is enclosed by an outer wall.
+
+    Parameters
+    ----------
+    width
+        Width of the map in meters
+    height
+        Height of the map in meters
+    pix_per_meter
+        Number of pixels per meter
+    room_size
+        Side of the rooms in meters
+    wall_thickness
+        Thickness of the walls in meters
+    door_width
+        Width of the doors in meters
+    seed
+        Seed of the door positions
+    obstacle
+        Value of obstacle pixels
+    free
+        Value of free pixels
+
+    Returns
+    -------
+    np.ndarray
+        Map of shape (height x width) in pixels
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = int(round(height*pix_per_meter)), int(round(width*pix_per_meter))
+    wall = max(1, int(round(wall_thickness*pix_per_meter)))
+    door = max(1, int(round(door_width*pix_per_meter)))
+    room = max(int(round(room_size*pix_per_meter)), door + 2*wall + 1)
+
+    walls = np.zeros((rows, cols), dtype=bool)
+    walls[:wall], walls[-wall:], walls[:, :wall], walls[:, -wall:] = True, True, True, True
+    row_lines = list(range(room, rows - wall, room))
+    col_lines = list(range(room, cols - wall, room))
+    for line in row_lines:
+        walls[line:line + wall] = True
+    for line in col_lines:
+        walls[:, line:line + wall] = True
+
+    #Open a door in each wall segment between two neighboring rooms
+    row_bounds = [wall] + [line + wall for line in row_lines] + [rows - wall]
+    col_bounds = [wall] + [line + wall for line in col_lines] + [cols - wall]
+    for line in row_lines:
+        for start, stop in zip(col_bounds[:-1], col_bounds[1:]):
+            stop = min(stop, cols - wall) - (wall if stop < cols - wall else 0)
+            position = rng.integers(start, max(start + 1, stop - door + 1))
+            walls[line:line + wall, position:position + door] = False
+    for line in col_lines:
+        for start, stop in zip(row_bounds[:-1], row_bounds[1:]):
+            stop = min(stop, rows - wall) - (wall if stop < rows - wall else 0)
+            position = rng.integers(start, max(start + 1, stop - door + 1))
+            walls[position:position + door, line:line + wall] = False
+
+    return np.where(walls, obstacle, free).astype(np.uint8)
+
+
+def make_corridors_map(
+    width: float = 50.0,
+    height: float = 50.0,
+    pix_per_meter: int = 10,
+    num_corridors: int = 6,
+    corridor_width: float = 2.5,
+    seed: int = 0,
+    obstacle: int = 0,
+    free: int = 1
+    )-> np.ndarray:
+    """Generate a map of straight horizontal and vertical corridors
+
+    Corridors are placed at random rows and columns and cross each other,
+    so they form a connected network as long as there is at least one
+    corridor in each direction.
+
+    Parameters
+    ----------
+    width
+        Width of the map in meters
+    height
+        Height of the map in meters
+    pix_per_meter
+        Number of pixels per meter
+    num_corridors
+        Number of corridors, half of them horizontal
+    corridor_width
+        Width of the corridors in meters
+    seed
+        Seed of the corridor positions
+    obstacle
+        Value of obstacle pixels
+    free
+        Value of free pixels
+
+    Returns
+    -------
+    np.ndarray
+        Map of shape (height x width) in pixels
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = int(round(height*pix_per_meter)), int(round(width*pix_per_meter))
+    corridor = max(1, int(round(corridor_width*pix_per_meter)))
+    margin = max(1, pix_per_meter // 2)
+
+    open_space = np.zeros((rows, cols), dtype=bool)
+    num_horizontal = max(1, num_corridors // 2)
+    for row in rng.integers(margin, max(margin + 1, rows - margin - corridor), size=num_horizontal):
+        open_space[row:row + corridor, margin:cols - margin] = True
+    for col in rng.integers(margin, max(margin + 1, cols - margin - corridor), size=max(1, num_corridors - num_horizontal)):
+        open_space[margin:rows - margin, col:col + corridor] = True
+
+    return np.where(open_space, free, obstacle).astype(np.uint8)
+
+
+def make_episodes(
+    env: 'Environment',
+    num_episodes: int = 10,
+    num_paths: int = 10,
+    num_steps: int = 200,
+    speed: float = 1.3,
+    time_step: float = 0.1,
+    turn_rate: float = 0.5,
+    seed: int = 0
+    )-> List[np.ndarray]:
+    """Generate random walk episodes that stay in the free space of an
+    environment
+
+    Walkers start at random free positions and move at a constant speed
+    with a heading that drifts randomly. A walker whose next position
+    would overlap an obstacle stays in place and turns to a new random
+    heading. All the walkers of all the episodes move at once.
+
+    Parameters
+    ----------
+    env
+        Environment to walk in
+    num_episodes
+        Number of episodes
+    num_paths
+        Number of paths in each episode
+    num_steps
+        Number of positions of each path
+    speed
+        Walking speed in meters per second
+    time_step
+        Time between positions in seconds
+    turn_rate
+        Standard deviation of the heading change per step in radians
+    seed
+        Seed of the walks
+
+    Returns
+    -------
+    List[np.ndarray]
+        Episodes as arrays of (x, y) positions with shape
+        (paths x steps x 2) in world coordinates
+    """
+    rng = np.random.default_rng(seed)
+    num_walkers = num_episodes * num_paths
+    blocked_space = env.configuration_space
+    h, w = blocked_space.shape
+
+    positions = env._pixel_to_world(env.free_space.sample(rng, num_walkers)).astype(float)
+    headings = rng.uniform(0, 2*np.pi, num_walkers)
+    paths = np.empty((num_walkers, num_steps, 2), dtype=np.float32)
+    for step in range(num_steps):
+        paths[:, step] = positions
+        headings += rng.normal(0, turn_rate, num_walkers)
+        moved = positions + speed*time_step*np.stack((np.cos(headings), np.sin(headings)), axis=-1)
+        pixels = env._world_to_pixel(moved)
+        inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < h) & (pixels[:, 1] >= 0) & (pixels[:, 1] < w)
+        blocked = ~inside
+        blocked[inside] = blocked_space[pixels[inside, 0], pixels[inside, 1]]
+        positions = np.where(blocked[:, np.newaxis], positions, moved)
+        headings[blocked] = rng.uniform(0, 2*np.pi, blocked.sum())
+
+    return list(paths.reshape(num_episodes, num_paths, num_steps, 2))
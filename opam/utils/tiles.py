@@ -0,0 +1,238 @@
+import numpy as np
+from math import ceil
+from os import makedirs
+from os.path import join
+from typing import Any, Iterator, Optional, Tuple, Union
+
+
+class TiledArray:
+    """Two dimensional array stored as lazily allocated fixed-size tiles
+
+    Tiles are only allocated when a value is written to them, so arrays
+    that are mostly zero, like the visitation counts of a large map, only
+    use memory where data lands. Reads of unallocated tiles return zeros.
+    Tiles can optionally be memory-mapped files in spill_dir, so the
+    operating system can page them out to disk.
+
+    Integer arrays narrower than 64 bits saturate at the largest value of
+    their dtype instead of wrapping around when accumulating with add_at,
+    and 64 bit integers are added exactly, like dense visitation counts.
+
+    Parameters
+    ----------
+    shape
+        Shape of the array
+    dtype
+        Data type of the array, e.g. np.uint16 or np.uint32 for counts
+    tile_size
+        Number of rows and columns of each tile
+    spill_dir
+        Directory where the tiles are stored as memory-mapped files, or
+        None to keep them in memory
+
+    Attributes
+    ----------
+    shape
+        See above
+    dtype
+        See above
+    tile_size
+        See above
+    spill_dir
+        See above
+    tiles
+        Dictionary of allocated tiles, where the key is the (row, column)
+        index of the tile and the value is the tile array
+    """
+
+    def __init__(self,
+        shape: Tuple[int, int],
+        dtype: Any = np.uint32,
+        tile_size: int = 256,
+        spill_dir: Optional[str] = None
+        )-> None:
+
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.tile_size = tile_size
+        self.spill_dir = spill_dir
+        self.tiles = {}
+        self._grid = (ceil(self.shape[0] / tile_size), ceil(self.shape[1] / tile_size))
+
+        if len(self.shape) != 2:
+            raise ValueError('Tiled arrays must be two dimensional')
+        if spill_dir is not None:
+            makedirs(spill_dir, exist_ok=True)
+
+    @property
+    def ndim(self)-> int:
+        return 2
+
+    @property
+    def size(self)-> int:
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def nbytes(self)-> int:
+        """Number of bytes used by the allocated tiles"""
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def __len__(self)-> int:
+        return self.shape[0]
+
+    def _tile_shape(self, key: Tuple[int, int])-> Tuple[int, int]:
+        return (min(self.tile_size, self.shape[0] - key[0]*self.tile_size),
+            min(self.tile_size, self.shape[1] - key[1]*self.tile_size))
+
+    def _allocate(self, key: Tuple[int, int])-> np.ndarray:
+        """Return the tile at key, allocating it if needed"""
+        tile = self.tiles.get(key)
+        if tile is None:
+            if self.spill_dir is None:
+                tile = np.zeros(self._tile_shape(key), dtype=self.dtype)
+            else:
+                path = join(self.spill_dir, 'tile_' + str(key[0]) + '_' + str(key[1]) + '.npy')
+                tile = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype,
+                    shape=self._tile_shape(key))
+            self.tiles[key] = tile
+        return tile
+
+    def _region(self, index: Any)-> Tuple[slice, slice, Tuple[Any, ...]]:
+        """Convert an index into the bounding rows and columns to read and
+        the index to apply to the dense region read from them.
+        """
+        if not isinstance(index, tuple):
+            index = (index,)
+        if any(i is Ellipsis for i in index):
+            position = index.index(Ellipsis)
+            fill = (slice(None),) * (2 - len(index) + 1)
+            index = index[:position] + fill + index[position+1:]
+        index = index + (slice(None),) * (2 - len(index))
+        if len(index) != 2:
+            raise IndexError('Too many indices for a two dimensional array')
+
+        bounds = []
+        local = []
+        for i, n in zip(index, self.shape):
+            if isinstance(i, slice):
+                start, stop, step = i.indices(n)
+                if step > 0:
+                    stop = max(start, stop)
+                    bounds.append(slice(start, stop))
+                    local.append(slice(0, stop - start, step))
+                else:
+                    bounds.append(slice(0, n))
+                    local.append(i)
+            elif isinstance(i, (int, np.integer)):
+                i = int(i) + n if i < 0 else int(i)
+                if not 0 <= i < n:
+                    raise IndexError('Index out of range')
+                bounds.append(slice(i, i + 1))
+                local.append(0)
+            else:
+                raise IndexError('Tiled arrays only support integer and slice indices')
+        return bounds[0], bounds[1], tuple(local)
+
+    def _tiles_in(self, rows: slice, cols: slice)-> Iterator[Tuple[Tuple[int, int], slice, slice, slice, slice]]:
+        """Iterate over the tiles overlapping a region, yielding the tile key,
+        the part of the region and the part of the tile that overlap.
+        """
+        size = self.tile_size
+        for tile_row in range(rows.start // size, ceil(rows.stop / size)):
+            row0 = max(rows.start, tile_row*size)
+            row1 = min(rows.stop, (tile_row + 1)*size)
+            for tile_col in range(cols.start // size, ceil(cols.stop / size)):
+                col0 = max(cols.start, tile_col*size)
+                col1 = min(cols.stop, (tile_col + 1)*size)
+                yield ((tile_row, tile_col),
+                    slice(row0 - rows.start, row1 - rows.start), slice(col0 - cols.start, col1 - cols.start),
+                    slice(row0 - tile_row*size, row1 - tile_row*size), slice(col0 - tile_col*size, col1 - tile_col*size))
+
+    def __getitem__(self, index: Any)-> Union[np.ndarray, Any]:
+        rows, cols, local = self._region(index)
+        region = np.zeros((rows.stop - rows.start, cols.stop - cols.start), dtype=self.dtype)
+        for key, region_rows, region_cols, tile_rows, tile_cols in self._tiles_in(rows, cols):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                region[region_rows, region_cols] = tile[tile_rows, tile_cols]
+        return region[local]
+
+    def __setitem__(self, index: Any, value: Any)-> None:
+        rows, cols, local = self._region(index)
+        if np.isscalar(value) and value == 0 and all(isinstance(i, slice) and i.step in (None, 1) for i in local):
+            #Clearing a region only touches allocated tiles
+            for key, _, _, tile_rows, tile_cols in self._tiles_in(rows, cols):
+                tile = self.tiles.get(key)
+                if tile is not None:
+                    tile[tile_rows, tile_cols] = 0
+            self._drop_empty_tiles()
+            return
+
+        region = self[rows, cols]
+        region[local] = value
+        for key, region_rows, region_cols, tile_rows, tile_cols in self._tiles_in(rows, cols):
+            values = region[region_rows, region_cols]
+            if key in self.tiles or values.any():
+                self._allocate(key)[tile_rows, tile_cols] = values
+
+    def __array__(self, dtype: Any = None, copy: Optional[bool] = None)-> np.ndarray:
+        array = self[:, :]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def _drop_empty_tiles(self)-> None:
+        """Release the tiles that only hold zeros"""
+        for key in [key for key, tile in self.tiles.items() if not tile.any()]:
+            del self.tiles[key]
+
+    def add_at(self, indices: np.ndarray, values: Union[np.ndarray, int] = 1)-> None:
+        """Add values at flat indices, like np.add.at on a dense array.
+
+        Parameters
+        ----------
+        indices
+            Flat indices into the array, which may repeat
+        values
+            Value to add at each index, or a single value for all of them
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        values = np.broadcast_to(np.asarray(values), indices.shape)
+        if len(indices) == 0:
+            return
+
+        rows, cols = np.divmod(indices, self.shape[1])
+        tile_ids = (rows // self.tile_size) * self._grid[1] + cols // self.tile_size
+        order = np.argsort(tile_ids, kind='stable')
+        tile_ids, rows, cols, values = tile_ids[order], rows[order], cols[order], values[order]
+        bounds = np.flatnonzero(np.diff(tile_ids)) + 1
+
+        for start, stop in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(tile_ids)]))):
+            key = divmod(int(tile_ids[start]), self._grid[1])
+            tile = self._allocate(key)
+            local = (rows[start:stop] - key[0]*self.tile_size) * tile.shape[1] \
+                + cols[start:stop] - key[1]*self.tile_size
+            if np.issubdtype(self.dtype, np.integer) and self.dtype.itemsize < 8:
+                #Accumulate in 64 bit integers and saturate at the largest value of the dtype
+                total = tile.astype(np.int64).reshape(-1)
+                np.add.at(total, local, values[start:stop].astype(np.int64))
+                np.minimum(total, np.iinfo(self.dtype).max, out=total)
+                tile[...] = total.reshape(tile.shape)
+            else:
+                np.add.at(tile.reshape(-1), local, values[start:stop])
+
+    def max(self)-> Any:
+        """Largest value of the array"""
+        largest = np.zeros((), dtype=self.dtype)[()]
+        for tile in self.tiles.values():
+            largest = max(largest, tile.max())
+        return largest
+
+    def sum(self)-> Any:
+        """Sum of the values of the array"""
+        return sum((tile.sum(dtype=np.float64 if self.dtype.kind == 'f' else np.int64)
+            for tile in self.tiles.values()), 0)
+
+    def flush(self)-> None:
+        """Write memory-mapped tiles to disk"""
+        for tile in self.tiles.values():
+            if isinstance(tile, np.memmap):
+                tile.flush()
@@ -0,0 +1,288 @@
+import numpy as np
+import json
+import logging
+from os import makedirs, remove, replace
+from os.path import exists, join
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from opam.utils.cache import content_hash
+
+
+#Colors of evenly spaced points of the colormaps, interpolated linearly
+COLORMAPS = {
+    'inferno': [(0, 0, 4), (31, 12, 72), (85, 15, 109), (136, 34, 106), (186, 54, 85),
+        (227, 89, 51), (249, 140, 10), (249, 201, 50), (252, 255, 164)],
+    'viridis': [(68, 1, 84), (71, 44, 122), (59, 82, 139), (44, 114, 142), (33, 145, 140),
+        (40, 174, 128), (94, 201, 98), (170, 220, 50), (253, 231, 37)],
+    'gray': [(0, 0, 0), (255, 255, 255)],
+}
+
+#Version of the tile rendering, changing it regenerates all the tiles
+TILE_FORMAT_VERSION = 1
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def colormap_lut(name: str = 'inferno')-> np.ndarray:
+    """Look-up table of a colormap
+
+    Parameters
+    ----------
+    name
+        Name of a colormap of COLORMAPS
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (256 x 3) with the RGB color of each intensity
+    """
+    if name not in COLORMAPS:
+        raise ValueError('Unknown colormap: ' + str(name) + ', available colormaps are '
+            + ', '.join(sorted(COLORMAPS)))
+    anchors = np.asarray(COLORMAPS[name], dtype=float)
+    positions = np.linspace(0, 255, len(anchors))
+    intensities = np.arange(256)
+    lut = [np.interp(intensities, positions, anchors[:, channel]) for channel in range(3)]
+    return np.rint(np.stack(lut, axis=-1)).astype(np.uint8)
+
+
+def reduce_2x(array: np.ndarray, dtype: Any = np.float64)-> np.ndarray:
+    """Sum an array over 2 x 2 blocks, padding odd sides with zeros
+
+    Parameters
+    ----------
+    array
+        2D array to reduce
+    dtype
+        Data type of the sums
+
+    Returns
+    -------
+    np.ndarray
+        Array with half the rows and columns of array, rounded up
+    """
+    h, w = array.shape
+    if h % 2 or w % 2:
+        padded = np.zeros((h + h % 2, w + w % 2), dtype=array.dtype)
+        padded[:h, :w] = array
+        array = padded
+    return array.reshape(array.shape[0] // 2, 2, array.shape[1] // 2, 2).sum(axis=(1, 3), dtype=dtype)
+
+
+def max_zoom(shape: Tuple[int, int], tile_size: int)-> int:
+    """Zoom level of the full resolution map, where zoom 0 fits the whole
+    map in a single tile
+    """
+    zoom, side = 0, max(shape)
+    while side > tile_size:
+        side = -(-side // 2)
+        zoom += 1
+    return zoom
+
+
+def _block_extents(size: int, blocks: int, block_size: int)-> np.ndarray:
+    """Number of pixels of a map side of size pixels in each of its blocks"""
+    return np.clip(size - np.arange(blocks) * block_size, 0, block_size)
+
+
+def _pyramid(
+    values: np.ndarray,
+    free: np.ndarray,
+    tile_size: int
+    )-> Iterator[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield the levels of the pyramid of a map from full resolution down,
+    each computed by reducing the previous one
+
+    Yields
+    ------
+    int
+        Zoom level
+    np.ndarray
+        Sum of the values in each block of the level
+    np.ndarray
+        Number of free pixels in each block
+    np.ndarray
+        Number of map pixels in each block, which is smaller than the
+        block at the bottom and right of the map
+    """
+    h, w = values.shape
+    total, free_count = values, free
+    block_size = 1
+    for zoom in range(max_zoom((h, w), tile_size), -1, -1):
+        area = np.outer(_block_extents(h, total.shape[0], block_size),
+            _block_extents(w, total.shape[1], block_size))
+        yield zoom, total, free_count, area
+        if zoom > 0:
+            total = reduce_2x(total)
+            free_count = reduce_2x(free_count, np.int64)
+            block_size *= 2
+
+
+def render_tile(
+    total: np.ndarray,
+    free_count: np.ndarray,
+    area: np.ndarray,
+    lut: np.ndarray,
+    vmax: float,
+    scale: str = 'log',
+    tile_size: int = 256,
+    obstacle_color: Tuple[int, int, int] = (64, 64, 64)
+    )-> np.ndarray:
+    """Color a block of a pyramid level
+
+    The intensity of a pixel is the mean value over the free pixels of its
+    block. Pixels whose block is mostly obstacles get obstacle_color, and
+    the part of the tile outside the map is transparent.
+
+    Parameters
+    ----------
+    total
+        Sum of the values in each block
+    free_count
+        Number of free pixels in each block
+    area
+        Number of map pixels in each block
+    lut
+        Colormap look-up table of colormap_lut
+    vmax
+        Value mapped to the last color of the colormap
+    scale
+        'linear', or 'log' to color by log(1 + value)
+    tile_size
+        Side of the tile in pixels, the block is placed at its top left
+    obstacle_color
+        RGB color of obstacles
+
+    Returns
+    -------
+    np.ndarray
+        RGBA tile of shape (tile_size x tile_size x 4)
+    """
+    density = total / np.maximum(free_count, 1)
+    if scale == 'log':
+        density, vmax = np.log1p(density), np.log1p(vmax)
+    elif scale != 'linear':
+        raise ValueError('Unknown scale: ' + str(scale))
+    index = np.clip(np.rint(density * (255 / vmax)), 0, 255).astype(np.uint8)
+
+    h, w = total.shape
+    tile = np.zeros((tile_size, tile_size, 4), dtype=np.uint8)
+    tile[:h, :w, :3] = lut[index]
+    tile[:h, :w, :3][2*free_count < area] = obstacle_color
+    tile[:h, :w, 3] = np.where(area > 0, 255, 0)
+    return tile
+
+
+def _write_png(tile: np.ndarray, path: str, compress_level: int)-> None:
+    from PIL import Image
+    Image.fromarray(tile, 'RGBA').save(path, 'PNG', compress_level=compress_level)
+
+
+def _load_manifest(directory: str)-> Dict[str, Any]:
+    path = join(directory, MANIFEST_NAME)
+    if not exists(path):
+        return {'tiles': {}}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def export_tile_pyramid(
+    values: np.ndarray,
+    free: np.ndarray,
+    directory: str,
+    tile_size: int = 256,
+    colormap: str = 'inferno',
+    scale: str = 'log',
+    vmax: Optional[float] = None,
+    obstacle_color: Tuple[int, int, int] = (64, 64, 64),
+    compress_level: int = 6
+    )-> Dict[str, int]:
+    """Write a heatmap of a map as a pyramid of PNG tiles
+
+    Tiles are written to directory/z/x/y.png, where zoom z goes from 0,
+    a single tile covering the whole map, to the full resolution of the
+    map, and x and y are the column and row of the tile. Each level is
+    computed by summing 2 x 2 blocks of the next finer level, so the map
+    is only read once at full resolution.
+
+    A manifest in the directory records a hash of the source region and
+    rendering options of every tile, and tiles whose hash did not change
+    since the last export are not rendered again. Tiles of a previous
+    export that no longer exist are removed. With the default vmax, a new
+    largest value changes every tile, so pass a fixed vmax to update the
+    tiles of a growing map incrementally.
+
+    Parameters
+    ----------
+    values
+        Array of the values of the map, like visitation counts or
+        predicted occupancy
+    free
+        Boolean array that is True where the map is free
+    directory
+        Directory of the tiles
+    tile_size
+        Side of the tiles in pixels
+    colormap
+        Name of a colormap of COLORMAPS
+    scale
+        'linear', or 'log' to color by log(1 + value)
+    vmax
+        Value mapped to the last color, defaults to the largest value on
+        a free pixel
+    obstacle_color
+        RGB color of obstacles
+    compress_level
+        zlib compression level of the PNG files, from 0 to 9
+
+    Returns
+    -------
+    Dict[str, int]
+        Number of tiles 'written', 'skipped' because they did not change
+        and 'removed', and the 'max_zoom' of the pyramid
+    """
+    values = np.asarray(values)
+    free = np.asarray(free, dtype=bool)
+    if values.shape != free.shape:
+        raise ValueError('The values and free space must have the same shape')
+    lut = colormap_lut(colormap)
+    if vmax is None:
+        vmax = float(values[free].max()) if free.any() else 0.0
+    vmax = vmax if vmax > 0 else 1.0
+    options = content_hash(TILE_FORMAT_VERSION, tile_size, colormap, scale, vmax, tuple(obstacle_color))
+
+    makedirs(directory, exist_ok=True)
+    previous = _load_manifest(directory)['tiles']
+    tiles = {}
+    written = 0
+    for zoom, total, free_count, area in _pyramid(values, free, tile_size):
+        for row in range(0, total.shape[0], tile_size):
+            for col in range(0, total.shape[1], tile_size):
+                region = (slice(row, row + tile_size), slice(col, col + tile_size))
+                key = '%d/%d/%d' % (zoom, col // tile_size, row // tile_size)
+                path = join(directory, key + '.png')
+                tiles[key] = content_hash(options, total[region], free_count[region], area[region])
+                if previous.get(key) == tiles[key] and exists(path):
+                    continue
+                tile = render_tile(total[region], free_count[region], area[region], lut, vmax, scale,
+                    tile_size, obstacle_color)
+                makedirs(join(directory, '%d/%d' % (zoom, col // tile_size)), exist_ok=True)
+                _write_png(tile, path, compress_level)
+                written += 1
+
+    removed = 0
+    for key in previous.keys() - tiles.keys():
+        path = join(directory, key + '.png')
+        if exists(path):
+            remove(path)
+            removed += 1
+
+    manifest = {'shape': list(values.shape), 'tile_size': tile_size, 'max_zoom': max_zoom(values.shape, tile_size),
+        'vmax': vmax, 'tiles': tiles}
+    with open(join(directory, MANIFEST_NAME + '.tmp'), 'w') as file:
+        json.dump(manifest, file)
+    replace(join(directory, MANIFEST_NAME + '.tmp'), join(directory, MANIFEST_NAME))
+
+    logging.debug('Wrote %d of %d tiles to %s', written, len(tiles), directory)
+    return {'written': written, 'skipped': len(tiles) - written, 'removed': removed,
+        'max_zoom': manifest['max_zoom']}
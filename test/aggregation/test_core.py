@@ -0,0 +1,37 @@
+import numpy as np
+
+from opam.aggregation.core import Aggregator
+from opam.environment import Environment
+from opam.utils.io import iter_episodes
+from opam.utils.synthetic import make_rooms_map
+
+
+def rooms_aggregator():
+    aggregator = Aggregator()
+    aggregator.maps['rooms'] = Environment('rooms', make_rooms_map(16, 16, seed=0))
+    return aggregator
+
+
+def simulate(workers, seed=3):
+    aggregator = rooms_aggregator()
+    aggregator.simulate_episodes(5, 'rooms', num_steps=20, workers=workers, seed=seed,
+        simulator='social_force', num_agents=4, batch_size=2)
+    return aggregator.episodes['rooms']
+
+
+def test_simulated_episodes_do_not_depend_on_the_workers():
+    serial = simulate(1)
+    parallel = simulate(2)
+    assert len(serial) == 5
+    assert np.asarray(serial[0]).shape == (4, 20, 2)
+    assert np.array_equal(serial.coords, parallel.coords)
+    assert not np.array_equal(serial.coords, simulate(1, seed=4).coords)
+
+
+def test_simulated_episodes_are_streamed_to_a_file(tmp_path):
+    aggregator = rooms_aggregator()
+    aggregator.simulate_episodes(3, 'rooms', num_steps=10, seed=3, simulator='social_force',
+        episodes_path=str(tmp_path) + '/', num_agents=2)
+    with open(tmp_path / 'rooms_simulated.json') as file:
+        episodes = list(iter_episodes(file))
+    assert len(episodes) == 3 and np.asarray(episodes[0]).shape == (2, 10, 2)
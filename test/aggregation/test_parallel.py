@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from opam.aggregation.core import Aggregator
+from opam.environment import Environment, EpisodeStore
+from opam.utils.cache import ContributionCache
+from opam.utils.synthetic import make_episodes, make_rooms_map
+
+
+def make_aggregator(**kwargs):
+    aggregator = Aggregator()
+    for index, (width, height) in enumerate([(20, 16), (12, 30), (8, 8)]):
+        env = Environment('map%d' % index, make_rooms_map(width, height, seed=index), **kwargs)
+        episodes = make_episodes(env, num_episodes=6 + 4*index, num_paths=3, num_steps=50, seed=index)
+        #Mix list and EpisodeStore episodes
+        env.episodes = EpisodeStore.from_lists(episodes) if index != 1 else [e.tolist() for e in episodes]
+        aggregator.maps[env.env_name] = env
+    return aggregator
+
+
+def serial_counts(aggregator):
+    aggregator.compute_all_visitation_counts()
+    return {name: np.asarray(env.visitation_counts).copy() for name, env in aggregator.maps.items()}
+
+
+@pytest.mark.parametrize('options', [{}, {'path_validation': 'center'}, {'counts_storage': 'tiled', 'tile_size': 64},
+    {'map_storage': 'memmap'}])
+def test_parallel_counts_match_serial(options):
+    aggregator = make_aggregator(**options)
+    expected = serial_counts(aggregator)
+    aggregator.compute_all_visitation_counts(workers=2)
+    for name, env in aggregator.maps.items():
+        assert np.array_equal(np.asarray(env.visitation_counts), expected[name]), name
+
+
+def test_parallel_counts_with_cache_match_serial(tmp_path):
+    aggregator = make_aggregator()
+    expected = serial_counts(aggregator)
+    cache = ContributionCache(str(tmp_path))
+    for _ in range(2):
+        aggregator.compute_all_visitation_counts(workers=2, cache=cache)
+        for name, env in aggregator.maps.items():
+            assert np.array_equal(env.visitation_counts, expected[name]), name
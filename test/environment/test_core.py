@@ -0,0 +1,165 @@
+import gc
+import numpy as np
+import os
+import pytest
+from math import isnan
+
+from opam.environment import Environment, EpisodeStore
+from opam.utils.annotation import bresenham_line, footprint_offsets
+from opam.utils.synthetic import make_episodes, make_rooms_map
+
+
+def legacy_raytrace(env, path):
+    """Pixels of a path converted and raytraced point by point like the
+    original Environment
+    """
+    coarse = []
+    for pos in path:
+        if isnan(pos[0]) or isnan(pos[1]):
+            continue
+        coarse.append([env.map.shape[0]//2 + round(pos[1]*env.pix_per_meter),
+            env.map.shape[1]//2 + round(pos[0]*env.pix_per_meter)])
+    pixel_path = []
+    for i in range(1, len(coarse)):
+        pixel_path.extend(bresenham_line(np.asarray([coarse[i-1]]), np.asarray([coarse[i]]), -1))
+    return np.asarray(pixel_path, dtype=np.int64).reshape(-1, 2)
+
+
+def legacy_visitation_counts(env, episodes):
+    """Visitation counts computed like the original Environment: each path
+    is raytraced on its own, checked at the agent center and stamped onto
+    a full size array.
+    """
+    counts = np.zeros(env.map.shape)
+    for paths in episodes:
+        for path in paths:
+            pixel_path = legacy_raytrace(env, path)
+            swept_area = np.zeros(env.map.shape)
+            if all(env.map[pos[0], pos[1]] != env.obstacle for pos in pixel_path):
+                for pos in pixel_path:
+                    swept_area[pos[0] - env._max_agent_radius:pos[0] + env._min_agent_radius,
+                        pos[1] - env._max_agent_radius:pos[1] + env._min_agent_radius] += env._agent_mask
+            counts += swept_area > 0
+    return counts
+
+
+def rooms_environment(agent_radius=1.5, **kwargs):
+    return Environment('rooms', make_rooms_map(20, 16, seed=1), agent_radius=agent_radius, **kwargs)
+
+
+def rooms_episodes(env, seed=0):
+    """Random walks in the free space of env, with a path through a wall
+    and missing positions in each episode
+    """
+    episodes = []
+    for episode in make_episodes(env, num_episodes=4, num_paths=3, num_steps=60, seed=seed):
+        episode = episode.astype(float)
+        episode[0, 10:13] = np.nan
+        episode[1, -1] = (0.0, -8.0 + 0.15)
+        episodes.append(episode)
+    return episodes
+
+
+def test_raytrace_paths_matches_legacy_raytrace():
+    rng = np.random.default_rng(1)
+    env = Environment('open', np.ones((101, 120)))
+    for _ in range(50):
+        paths = rng.uniform(-4, 4, (rng.integers(1, 6), rng.integers(1, 12), 2))
+        paths[rng.random(paths.shape[:2]) < 0.2] = np.nan
+        pixels, offsets = env._raytrace_paths(paths)
+        for i, path in enumerate(paths):
+            assert np.array_equal(pixels[offsets[i]:offsets[i+1]], legacy_raytrace(env, path))
+
+
+@pytest.mark.parametrize('engine', ['dense', 'sparse', 'dilate', 'auto'])
+@pytest.mark.parametrize('agent_radius', [0.5, 1.5, 2.7])
+def test_swept_area_engines_match_legacy_stamping(engine, agent_radius):
+    env = rooms_environment(agent_radius, swept_area_engine=engine, path_validation='center')
+    env.episodes = rooms_episodes(env)
+    env.compute_visitation_counts()
+    assert np.array_equal(env.visitation_counts, legacy_visitation_counts(env, env.episodes))
+
+
+def test_episode_store_matches_lists():
+    env = rooms_environment(path_validation='center')
+    episodes = rooms_episodes(env)
+    env.episodes = [episode.tolist() for episode in episodes]
+    env.compute_visitation_counts()
+    expected = env.visitation_counts.copy()
+
+    env.episodes = EpisodeStore.from_lists(episodes, dtype=np.float64)
+    env.compute_visitation_counts()
+    assert np.array_equal(env.visitation_counts, expected)
+
+
+def test_recomputing_discards_previous_counts():
+    env = rooms_environment()
+    env.episodes = rooms_episodes(env)
+    env.compute_visitation_counts()
+    expected = env.visitation_counts.copy()
+    env.compute_visitation_counts()
+    assert np.array_equal(env.visitation_counts, expected)
+
+
+def test_footprint_validation_rejects_paths_touching_obstacles():
+    env = rooms_environment()
+    env.episodes = rooms_episodes(env)
+    env.compute_visitation_counts()
+    footprint = env.visitation_counts.copy()
+    env.path_validation = 'center'
+    env.compute_visitation_counts()
+    assert np.all(footprint <= env.visitation_counts)
+    assert not np.any(footprint[env.map == env.obstacle])
+
+
+@pytest.mark.parametrize('agent_radius', [0.5, 1.5, 2.7])
+def test_configuration_space_marks_footprints_overlapping_obstacles(agent_radius):
+    env = rooms_environment(agent_radius)
+    rows, cols = footprint_offsets(env._agent_mask, env._max_agent_radius)
+    expected = np.zeros(env.map.shape, dtype=bool)
+    obstacles = np.pad(env.map == env.obstacle, 8)
+    h, w = env.map.shape
+    for row, col in zip(rows, cols):
+        expected |= obstacles[8 + row:8 + row + h, 8 + col:8 + col + w]
+    assert np.array_equal(env.configuration_space, expected)
+
+
+@pytest.mark.parametrize('options', [
+    {'counts_storage': 'tiled', 'tile_size': 32},
+    {'counts_storage': 'memmap', 'tile_size': 32, 'counts_dtype': np.uint16},
+    {'map_storage': 'memmap', 'map_dtype': np.uint8},
+])
+def test_storage_options_give_the_same_counts(options):
+    env = rooms_environment()
+    env.episodes = rooms_episodes(env)
+    env.compute_visitation_counts()
+
+    stored = rooms_environment(**options)
+    stored.episodes = env.episodes
+    stored.compute_visitation_counts()
+    assert np.array_equal(np.asarray(stored.visitation_counts), env.visitation_counts)
+    if options.get('map_storage') == 'memmap':
+        assert isinstance(stored.map, np.memmap) and np.array_equal(stored.map, env.map)
+
+
+@pytest.mark.parametrize('counts_storage', ['dense', 'tiled'])
+def test_integer_counts_saturate(counts_storage):
+    env = rooms_environment(counts_storage=counts_storage, counts_dtype=np.uint8)
+    for _ in range(3):
+        env._add_visitation_counts(np.array([0, 1]), np.array([100, 1]))
+    assert env.visitation_counts[0, 0] == 255 and env.visitation_counts[0, 1] == 3
+
+
+def test_temporary_spill_dir_is_removed(tmp_path):
+    env = rooms_environment(counts_storage='memmap', map_storage='memmap')
+    spill_dir = env.spill_dir
+    env.visitation_counts.add_at([0])
+    assert os.path.isdir(spill_dir)
+    del env
+    gc.collect()
+    assert not os.path.exists(spill_dir)
+
+    env = rooms_environment(counts_storage='memmap', spill_dir=str(tmp_path))
+    del env
+    gc.collect()
+    assert tmp_path.is_dir()
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from opam.environment import EpisodeStore
+
+
+EPISODES = [
+    [[[0.0, 1.0], [2.0, 3.0]], [[4.0, 5.0], [6.0, 7.0]]],
+    [[[8.0, 9.0]], [[10.0, 11.0], [12.0, 13.0], [14.0, 15.0]], [[16.0, 17.0]]],
+    [],
+]
+
+
+def test_from_lists_round_trip():
+    store = EpisodeStore.from_lists(EPISODES, dtype=np.float64)
+    assert len(store) == 3
+    assert store.num_paths == 5
+    assert store.num_points == 9
+    assert store.to_lists() == EPISODES
+    assert np.array_equal(store.path(3), [[10.0, 11.0], [12.0, 13.0], [14.0, 15.0]])
+
+
+def test_episode_views():
+    store = EpisodeStore.from_lists(EPISODES)
+    episode = store[0]
+    assert len(episode) == 2
+    assert np.shares_memory(episode[1], store.coords)
+    assert np.array_equal(np.asarray(episode), np.asarray(EPISODES[0], dtype=np.float32))
+    assert np.array_equal(store[-2].path_lengths, [1, 3, 1])
+    with pytest.raises(ValueError):
+        store[1].as_array()
+    with pytest.raises(IndexError):
+        store[3]
+
+
+def test_slices_and_concatenate():
+    store = EpisodeStore.from_lists(EPISODES)
+    assert store[1:].to_lists() == EPISODES[1:]
+    assert store[1:1].to_lists() == []
+    with pytest.raises(ValueError):
+        store[::2]
+
+    combined = EpisodeStore.concatenate([store[:1], store[1:]])
+    assert combined.to_lists() == EPISODES
+    assert EpisodeStore.concatenate([]).to_lists() == []
+
+
+def test_offsets_are_checked():
+    with pytest.raises(ValueError):
+        EpisodeStore(np.zeros((2, 2)), [0, 3], [0, 1])
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from opam.aggregation.core import Aggregator
+from opam.environment import Environment, EpisodeStore
+from opam.environment import core
+from opam.environment.footprints import FootprintCache, footprint_mask
+from opam.utils.synthetic import make_rooms_map
+from test.environment.test_core import legacy_visitation_counts, rooms_environment, rooms_episodes
+
+
+def test_centered_footprints_are_the_agent_mask():
+    for radius in (0.5, 1.5, 2.7):
+        env = rooms_environment(radius)
+        mask, anchor = footprint_mask(env.agent_radius)
+        assert np.array_equal(mask, env._agent_mask) and anchor == env._max_agent_radius
+
+
+def test_radius_buckets_round_to_the_resolution():
+    cache = FootprintCache(1.5, radius_resolution=0.5)
+    assert np.array_equal(cache.radius_buckets([0.7, 1.2, np.nan, 2.6]), [0.5, 1.0, 1.5, 2.5])
+    with pytest.raises(ValueError):
+        FootprintCache(1.5, radius_resolution=0)
+    #Buckets compare equal to the radii they stand for
+    cache = FootprintCache(1.55, radius_resolution=0.1)
+    assert cache.radius_buckets([0.3, 1.7, 1.55]).tolist() == [0.3, 1.7, 1.55]
+
+
+@pytest.mark.parametrize('subpixel_steps', [1, 2, 3, 4])
+def test_offsets_have_one_level_per_step(subpixel_steps):
+    cache = FootprintCache(1.5, subpixel_steps=subpixel_steps)
+    levels = cache.offset_levels(np.linspace(-0.5, 0.5, 101))
+    assert np.array_equal(np.unique(levels), np.arange(subpixel_steps) - subpixel_steps // 2)
+    assert np.all(np.diff(levels) >= 0)
+    #Each level is stamped at its center
+    offsets = [cache.level_offset(level) for level in np.unique(levels)]
+    assert np.allclose(offsets, (np.arange(subpixel_steps) + 0.5) / subpixel_steps - 0.5)
+
+
+@pytest.mark.parametrize('radii', [None, 'nan', 'default'])
+def test_default_radii_match_legacy_stamping(radii):
+    env = rooms_environment(path_validation='center')
+    env.episodes = rooms_episodes(env)
+    num_paths = sum(len(episode) for episode in env.episodes)
+    env.agent_radii = {None: None, 'nan': np.full(num_paths, np.nan), 'default': np.full(num_paths, 1.5)}[radii]
+    env.compute_visitation_counts()
+    assert np.array_equal(env.visitation_counts, legacy_visitation_counts(env, env.episodes))
+    assert len(env._configuration_spaces) == 0 and len(env._footprints) <= 1
+
+
+def test_explicit_default_radii_share_no_extra_configuration_space():
+    aggregator = Aggregator()
+    #0.7 is not 7 times 0.1 in floating point
+    env = rooms_environment(0.7)
+    env.episodes = EpisodeStore.from_lists(rooms_episodes(env))
+    env.agent_radii = np.full(env.episodes.num_paths, 0.7)
+    aggregator.maps[env.env_name] = env
+    aggregator.compute_all_visitation_counts(workers=2)
+    assert len(env._configuration_spaces) == 0
+    assert np.array_equal(env.visitation_counts, legacy_visitation_counts(env, env.episodes.to_lists()))
+
+
+def test_paths_are_stamped_with_their_radius():
+    episodes = rooms_episodes(rooms_environment())
+    mixed = rooms_environment(path_validation='center')
+    mixed.episodes = episodes
+    mixed.agent_radii = np.tile([1.5, 2.5, np.nan], len(episodes))
+    mixed.compute_visitation_counts()
+
+    #Paths of each radius stamped by an environment with that agent radius
+    expected = np.zeros(mixed.map.shape)
+    for index, radius in enumerate((1.5, 2.5, 1.5)):
+        env = rooms_environment(radius, path_validation='center')
+        expected += legacy_visitation_counts(env, [episode[index:index + 1] for episode in episodes])
+    assert np.array_equal(mixed.visitation_counts, expected)
+
+
+def test_bucket_configuration_spaces_match_environments_of_that_radius():
+    env = rooms_environment()
+    for radius in (0.5, 2.5, 3.0):
+        assert np.array_equal(env._configuration_space_for(radius), rooms_environment(radius).configuration_space)
+    assert env._configuration_space_for(None) is env.configuration_space
+    assert env._configuration_space_for(env.agent_radius) is env.configuration_space
+
+
+def test_configuration_space_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(core, '_CONFIGURATION_SPACE_CACHE_SIZE', 3)
+    env = rooms_environment()
+    radii = [0.5, 1.0, 2.0, 2.5, 3.0]
+    spaces = {radius: env._configuration_space_for(radius) for radius in radii}
+    assert list(env._configuration_spaces) == [2.0, 2.5, 3.0]
+    #Using a radius makes it the most recently used
+    assert env._configuration_space_for(2.0) is spaces[2.0]
+    env._configuration_space_for(0.5)
+    assert list(env._configuration_spaces) == [3.0, 2.0, 0.5]
+    assert np.array_equal(env._configuration_spaces[0.5], spaces[0.5])
+
+
+@pytest.mark.parametrize('options', [{}, {'subpixel_steps': 3}, {'path_validation': 'center'}])
+def test_parallel_mixed_radii_match_serial(options):
+    aggregator = Aggregator()
+    rng = np.random.default_rng(0)
+    for index in range(2):
+        env = Environment('map%d' % index, make_rooms_map(20, 16, seed=index), radius_resolution=0.2, **options)
+        env.episodes = EpisodeStore.from_lists(rooms_episodes(env, seed=index))
+        #More radius buckets than the configuration space cache holds
+        radii = rng.uniform(0.5, 3.0, env.episodes.num_paths)
+        radii[::5] = np.nan
+        env.agent_radii = radii
+        aggregator.maps[env.env_name] = env
+    aggregator.compute_all_visitation_counts()
+    expected = {name: np.asarray(env.visitation_counts).copy() for name, env in aggregator.maps.items()}
+    aggregator.compute_all_visitation_counts(workers=2)
+    for name, env in aggregator.maps.items():
+        assert np.array_equal(env.visitation_counts, expected[name]), name
@@ -0,0 +1,85 @@
+import numpy as np
+from collections import deque
+
+from opam.environment import Environment
+from opam.environment.free_space import FreeSpaceIndex, connected_components, free_space_index
+
+
+def reference_components(mask):
+    h, w = mask.shape
+    labels = np.full(mask.shape, -1)
+    count = 0
+    for start in zip(*np.nonzero(mask)):
+        if labels[start] >= 0:
+            continue
+        labels[start] = count
+        queue = deque([start])
+        while queue:
+            row, col = queue.popleft()
+            for r in range(max(row - 1, 0), min(row + 2, h)):
+                for c in range(max(col - 1, 0), min(col + 2, w)):
+                    if mask[r, c] and labels[r, c] < 0:
+                        labels[r, c] = count
+                        queue.append((r, c))
+        count += 1
+    return labels
+
+
+def test_connected_components_match_flood_fill():
+    rng = np.random.default_rng(0)
+    for density in (0.3, 0.5, 0.7):
+        mask = rng.random((25, 35)) < density
+        indices, labels = connected_components(mask)
+        reference = reference_components(mask)
+        assert np.array_equal(indices, np.flatnonzero(mask))
+        #Both number components in order of their first pixel
+        assert np.array_equal(labels, reference.flat[indices])
+
+
+def test_connected_components_of_empty_mask():
+    indices, labels = connected_components(np.zeros((4, 5), dtype=bool))
+    assert len(indices) == 0 and len(labels) == 0
+
+
+def test_samples_are_free_and_pairs_share_a_component():
+    rng = np.random.default_rng(1)
+    free = rng.random((30, 30)) < 0.55
+    index = FreeSpaceIndex(free)
+    reference = reference_components(free)
+    assert len(index) == free.sum()
+    assert np.array_equal(np.sort(index.component_sizes), np.sort(np.bincount(reference[free])))
+
+    positions = index.sample(np.random.default_rng(2), 500)
+    assert free[positions[:, 0], positions[:, 1]].all()
+    starts, goals = index.sample_pairs(np.random.default_rng(3), 500)
+    assert free[starts[:, 0], starts[:, 1]].all()
+    assert np.array_equal(reference[starts[:, 0], starts[:, 1]], reference[goals[:, 0], goals[:, 1]])
+
+
+def test_sampling_without_free_space_raises():
+    index = FreeSpaceIndex(np.zeros((3, 3), dtype=bool))
+    try:
+        index.sample(np.random.default_rng(), 1)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Expected a ValueError')
+
+
+def test_free_space_index_is_cached_by_content():
+    grid = np.ones((30, 40), dtype=np.uint8)
+    grid[:, 20] = 0
+    first = Environment('first', grid, pix_per_meter=10)
+    second = Environment('second', grid.copy(), pix_per_meter=10)
+    assert free_space_index(first) is free_space_index(second)
+    assert np.array_equal(np.sort(first.free_space.pixels), np.flatnonzero(~first.configuration_space))
+
+
+def test_pairs_can_share_a_pool_of_goals():
+    rng = np.random.default_rng(4)
+    free = rng.random((30, 30)) < 0.55
+    reference = reference_components(free)
+    starts, goals = FreeSpaceIndex(free).sample_pairs(np.random.default_rng(5), 300, num_goals=4)
+    assert len(np.unique(goals, axis=0)) <= 4
+    assert free[starts[:, 0], starts[:, 1]].all()
+    assert np.array_equal(reference[starts[:, 0], starts[:, 1]], reference[goals[:, 0], goals[:, 1]])
@@ -0,0 +1,94 @@
+import heapq
+import numpy as np
+from collections import OrderedDict
+
+from opam.environment import Environment, navigation
+from opam.environment.navigation import geodesic_distance
+from opam.simulation.social_force import SocialForce
+from opam.utils.synthetic import make_rooms_map
+
+
+def reference_geodesic_distance(free, sources):
+    h, w = free.shape
+    cost = np.full(free.shape, np.inf)
+    queue = []
+    for source in sources:
+        cost.flat[source] = 0
+        queue.append((0, divmod(int(source), w)))
+    heapq.heapify(queue)
+    while queue:
+        current, (row, col) = heapq.heappop(queue)
+        if current > cost[row, col]:
+            continue
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                r, c = row + d_row, col + d_col
+                if (d_row or d_col) and 0 <= r < h and 0 <= c < w and free[r, c]:
+                    candidate = current + (3 if d_row and d_col else 2)
+                    if candidate < cost[r, c]:
+                        cost[r, c] = candidate
+                        heapq.heappush(queue, (candidate, (r, c)))
+    return cost / 2
+
+
+def test_geodesic_distance_matches_dijkstra():
+    rng = np.random.default_rng(0)
+    free = rng.random((30, 40)) < 0.7
+    sources = rng.choice(np.flatnonzero(free), 3, replace=False)
+    assert np.array_equal(geodesic_distance(free, sources), reference_geodesic_distance(free, sources))
+
+
+def wall_environment():
+    #A wall across the middle of the map with a gap on the right
+    grid = np.ones((40, 60), dtype=np.uint8)
+    grid[19:21, :50] = 0
+    return Environment('wall', grid, pix_per_meter=10)
+
+
+def test_agents_are_routed_around_walls():
+    env = wall_environment()
+    start, goal = np.array([[-2.0, -1.0]]), np.array([[-2.0, 1.0]])
+    field = env.navigation.distance_field(env.navigation.goal_cells(goal)[0])
+    row, col = env._world_to_pixel(start)[0]
+    #The geodesic distance goes through the gap instead of the wall
+    assert field[row, col] > 3 * np.hypot(*(goal - start)[0])
+
+    positions = start.copy()
+    for _ in range(400):
+        direction = env.navigation.preferred_directions(positions, goal)
+        positions = positions + 0.1 * direction
+    assert np.hypot(*(positions - goal)[0]) < 0.15
+    assert env.navigation.distance_field(env.navigation.goal_cells(goal)[0]) is field
+
+
+def test_agents_at_their_goal_stop():
+    env = wall_environment()
+    goal = np.array([[1.0, 1.0]])
+    assert np.array_equal(env.navigation.preferred_directions(goal, goal), [[0.0, 0.0]])
+
+
+def test_navigating_agents_reuse_the_fields_of_their_goals(monkeypatch):
+    env = Environment('rooms', make_rooms_map(20, 16, seed=0))
+    monkeypatch.setattr(navigation, '_field_cache', OrderedDict())
+    calls = []
+    monkeypatch.setattr(navigation, 'geodesic_distance',
+        lambda *args: calls.append(1) or geodesic_distance(*args))
+    simulator = SocialForce(env, time_step=0.1, num_agents=60, navigate=True, num_goals=5)
+    simulator.reset(0)
+    assert len(np.unique(simulator.goals, axis=0)) <= 5
+    computed = len(calls)
+    assert 0 < computed <= 5
+    for _ in range(3):
+        simulator.step()
+    assert len(calls) == computed
+
+
+def test_field_cache_holds_a_number_of_fields(monkeypatch):
+    env = wall_environment()
+    monkeypatch.setattr(navigation, '_field_cache', OrderedDict())
+    monkeypatch.setattr(navigation, '_field_cache_size', 2)
+    for cell in ((0, 0), (0, 1), (3, 5)):
+        env.navigation.distance_field(cell)
+    assert len(navigation._field_cache) == 2
+    env.navigation.prepare(np.array([[-2.0, -1.0], [2.0, 1.0], [0.5, -1.5]]))
+    assert navigation._field_cache_size == 3 and len(navigation._field_cache) == 3
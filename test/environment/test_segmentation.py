@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from opam.aggregation.core import Aggregator
+from opam.environment import Environment
+from opam.utils.synthetic import make_episodes, make_rooms_map
+
+
+DISTRIBUTION = [0.2, 0.3, 0.5]
+
+
+def counted_environment(**kwargs):
+    env = Environment('rooms', make_rooms_map(20, 16, seed=1), **kwargs)
+    env.episodes = make_episodes(env, num_episodes=5, num_paths=3, num_steps=50, seed=0)
+    env.compute_visitation_counts()
+    return env
+
+
+def test_segmentation_mask_splits_visited_pixels_by_distribution():
+    env = counted_environment()
+    counts = np.asarray(env.visitation_counts)
+    mask = env.get_segmentation_mask(3, DISTRIBUTION)
+    assert np.all(mask[counts == 0] == 0)
+    #Class k holds the visited pixels with counts in (thresholds[k-1], thresholds[k]]
+    thresholds = env.get_segmentation_thresholds(3, DISTRIBUTION)
+    bounds = np.concatenate(([0], thresholds, [np.inf]))
+    visited = counts > 0
+    for label in range(3):
+        values = counts[visited & (mask == label)]
+        assert np.all((values > bounds[label]) & (values <= bounds[label + 1]))
+
+
+def test_tiled_counts_give_the_same_mask():
+    expected = counted_environment().get_segmentation_mask(3, DISTRIBUTION)
+    env = counted_environment(counts_storage='tiled', tile_size=32)
+    assert np.array_equal(env.get_segmentation_mask(3, DISTRIBUTION), expected)
+
+
+@pytest.mark.parametrize('storage', ['dense', 'tiled'])
+def test_parallel_masks_match_serial(storage):
+    aggregator = Aggregator()
+    for seed in range(2):
+        #Mix tiled counts, segmented tile by tile, with dense counts
+        options = dict(counts_storage=storage, tile_size=32) if seed == 1 else {}
+        env = Environment('map%d' % seed, make_rooms_map(12, 10, seed=seed), **options)
+        env.episodes = make_episodes(env, num_episodes=4, num_paths=2, num_steps=40, seed=seed)
+        env.compute_visitation_counts()
+        aggregator.maps[env.env_name] = env
+    expected = aggregator.get_segmentation_masks(3, DISTRIBUTION)
+    masks = aggregator.get_segmentation_masks(3, DISTRIBUTION, workers=2)
+    for name in expected:
+        assert np.array_equal(masks[name], expected[name]), name
+
+
+@pytest.mark.parametrize('num_classes, distribution', [(1, [1.0]), (3, [0.5, 0.5]), (2, [0.8, 0.4]),
+    (2, [-0.5, 1.5])])
+def test_invalid_class_distributions_are_rejected(num_classes, distribution):
+    env = counted_environment()
+    with pytest.raises(ValueError):
+        env.get_segmentation_mask(num_classes, distribution)
+
+
+def test_segmenting_without_counts_raises():
+    env = Environment('rooms', make_rooms_map(20, 16, seed=1))
+    with pytest.raises(ValueError):
+        env.get_segmentation_mask(2, [0.5, 0.5])
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from opam.aggregation.core import Aggregator
+from opam.environment import Environment
+from opam.utils.synthetic import make_episodes, make_rooms_map
+
+
+def walking_environment(seed=0):
+    env = Environment('rooms%d' % seed, make_rooms_map(16, 12, seed=seed))
+    env.episodes = make_episodes(env, num_episodes=4, num_paths=3, num_steps=60, seed=seed)
+    return env
+
+
+def test_a_single_bin_holds_the_visitation_counts():
+    env = walking_environment()
+    env.compute_visitation_counts()
+    temporal = env.compute_temporal_counts(bin_size=60)
+    assert temporal.num_bins == 1
+    assert np.array_equal(temporal.total(), env.visitation_counts)
+    assert env.temporal_counts is temporal
+
+
+def test_bins_are_consistent():
+    temporal = walking_environment().compute_temporal_counts(bin_size=7)
+    assert temporal.num_bins == 9
+    dense = np.stack([temporal[b] for b in range(temporal.num_bins)])
+    assert np.array_equal(temporal.total(), dense.sum(axis=0))
+    assert np.array_equal(temporal.total(2, 5), dense[2:5].sum(axis=0))
+    assert np.array_equal(temporal.bin_totals(), dense.sum(axis=(1, 2)))
+    assert np.array_equal(temporal.dense_bin(-1, out=np.ones(temporal.shape)), dense[-1])
+
+    pixels = np.argwhere(dense.sum(axis=0) > 0)[::50]
+    assert np.array_equal(temporal.series(pixels), dense[:, pixels[:, 0], pixels[:, 1]].T)
+    bins, rows, cols, counts = temporal.to_coo()
+    assert np.array_equal(dense[bins, rows, cols], counts) and counts.sum() == dense.sum()
+    with pytest.raises(IndexError):
+        temporal.sparse_bin(9)
+
+
+def test_summing_bins_adds_their_counts():
+    env = walking_environment()
+    temporal = env.compute_temporal_counts(bin_size=5)
+    summed = temporal.sum_bins(3)
+    assert summed.bin_size == 15 and summed.num_bins == 4
+    for b in range(summed.num_bins):
+        assert np.array_equal(summed[b], temporal.total(3*b, 3*b + 3))
+
+    #A path sweeping a pixel in several of the summed bins counts once per
+    #bin, while recomputing with larger bins counts it once
+    recomputed = env.compute_temporal_counts(bin_size=15)
+    assert recomputed.num_bins == summed.num_bins
+    differs = False
+    for b in range(summed.num_bins):
+        assert np.all(summed[b] >= recomputed[b])
+        differs = differs or not np.array_equal(summed[b], recomputed[b])
+    assert differs
+    with pytest.raises(ValueError):
+        temporal.sum_bins(0)
+
+
+def test_parallel_temporal_counts_match_serial():
+    aggregator = Aggregator()
+    for seed in range(2):
+        env = walking_environment(seed)
+        aggregator.maps[env.env_name] = env
+    expected = {name: env.compute_temporal_counts(bin_size=10) for name, env in aggregator.maps.items()}
+    results = aggregator.compute_all_temporal_counts(bin_size=10, workers=2)
+    for name, temporal in results.items():
+        assert np.array_equal(temporal.bin_offsets, expected[name].bin_offsets)
+        assert np.array_equal(temporal.indices, expected[name].indices)
+        assert np.array_equal(temporal.counts, expected[name].counts)
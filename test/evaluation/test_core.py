@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from opam.aggregation.core import Aggregator
+from opam.environment import Environment
+from opam.evaluation.core import class_iou, evaluate_occupancy, histogram_emd, js_divergence, kl_divergence, pearson
+from opam.learning.models import RidgeOccupancyModel
+from opam.utils.synthetic import make_episodes, make_rooms_map
+
+
+def test_divergences_match_their_definitions():
+    rng = np.random.default_rng(0)
+    p, q = rng.random(50), rng.random(50)
+    p, q = p / p.sum(), q / q.sum()
+    assert np.isclose(kl_divergence(p, q), sum(a * np.log(a / b) for a, b in zip(p, q)))
+    assert kl_divergence(p, p) == 0
+    m = (p + q) / 2
+    assert np.isclose(js_divergence(p, q), (kl_divergence(p, m) + kl_divergence(q, m)) / 2)
+    assert np.isclose(js_divergence(p, q), js_divergence(q, p))
+
+
+def test_histogram_emd_of_shifted_values():
+    values = np.random.default_rng(1).uniform(0, 0.5, 1000)
+    assert histogram_emd(values, values) == 0
+    #Shifting every value by a whole number of bins moves all the mass that far
+    assert np.isclose(histogram_emd(values, values + 0.25, bins=100), 0.25)
+
+
+def test_pearson_matches_corrcoef():
+    rng = np.random.default_rng(2)
+    a, b = rng.random(100), rng.random(100)
+    assert np.isclose(pearson(a, b), np.corrcoef(a, b)[0, 1])
+    assert np.isnan(pearson(a, np.ones(100)))
+
+
+def test_class_iou_matches_sets():
+    rng = np.random.default_rng(3)
+    true, predicted = rng.integers(0, 3, 500), rng.integers(0, 3, 500)
+    predicted[predicted == 2] = 1
+    iou = class_iou(true, predicted, 4)
+    for k in range(3):
+        assert np.isclose(iou[k], np.sum((true == k) & (predicted == k)) / np.sum((true == k) | (predicted == k)))
+    assert np.isnan(iou[3])
+
+
+def test_perfect_prediction_scores():
+    rng = np.random.default_rng(4)
+    counts = rng.integers(0, 30, (40, 50)).astype(float)
+    free = rng.random((40, 50)) < 0.8
+    scores = evaluate_occupancy(counts / 30, counts, free, num_classes=3, class_distribution=[0.3, 0.3, 0.4])
+    assert np.isclose(scores['kl'], 0) and np.isclose(scores['js'], 0)
+    assert np.isclose(scores['emd'], 0) and np.isclose(scores['pearson'], 1)
+    assert scores['mean_iou'] == 1
+    #Obstacle pixels are not scored
+    noisy = np.where(free, counts / 30, 100.0)
+    assert evaluate_occupancy(noisy, counts, free)['pearson'] == scores['pearson']
+
+
+def test_parallel_evaluation_matches_serial():
+    aggregator = Aggregator()
+    for seed in range(2):
+        env = Environment('map%d' % seed, make_rooms_map(12, 10, seed=seed))
+        env.episodes = make_episodes(env, num_episodes=4, num_paths=3, num_steps=50, seed=seed)
+        env.compute_visitation_counts()
+        aggregator.maps[env.env_name] = env
+    model = RidgeOccupancyModel(max_samples_per_map=500).fit(aggregator.maps)
+    for env in aggregator.maps.values():
+        model.predict(env)
+    options = dict(num_classes=3, class_distribution=[0.2, 0.3, 0.5])
+    expected = aggregator.evaluate(**options)
+    assert [(row['map'], row['model']) for row in expected] == [('map0', 'ridge'), ('map1', 'ridge')]
+    result = aggregator.evaluate(workers=2, **options)
+    key = lambda row: (row['map'], row['model'])
+    for a, b in zip(sorted(expected, key=key), sorted(result, key=key)):
+        assert a.keys() == b.keys()
+        assert all(a[k] == b[k] or (a[k] != a[k] and b[k] != b[k]) for k in a)
+
+
+def test_parallel_evaluation_rejects_tiled_counts():
+    aggregator = Aggregator()
+    env = Environment('rooms', make_rooms_map(12, 10, seed=0), counts_storage='tiled', tile_size=32)
+    env.episodes = make_episodes(env, num_episodes=4, num_paths=3, num_steps=50, seed=0)
+    env.compute_visitation_counts()
+    env.predicted_occupancy['uniform'] = np.ones(env.map.shape)
+    aggregator.maps[env.env_name] = env
+    assert len(aggregator.evaluate()) == 1
+    with pytest.raises(ValueError):
+        aggregator.evaluate(workers=2)
+
+
+def test_invalid_class_distribution_is_rejected():
+    with pytest.raises(ValueError):
+        Aggregator().evaluate(num_classes=2, class_distribution=[0.3, 0.3])
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from opam.environment import Environment
+from opam.learning.data import PatchDataset
+from opam.utils.synthetic import make_episodes, make_rooms_map
+
+
+def counted_environments():
+    environments = {}
+    for index, (width, height) in enumerate([(20, 16), (4, 3)]):
+        env = Environment('map%d' % index, make_rooms_map(width, height, seed=index))
+        env.episodes = make_episodes(env, num_episodes=4, num_paths=2, num_steps=40, seed=index)
+        env.compute_visitation_counts()
+        environments[env.env_name] = env
+    return environments
+
+
+def collect(batches):
+    features, labels = zip(*batches)
+    return np.concatenate(features), np.concatenate(labels)
+
+
+def test_unaugmented_samples_are_crops_of_their_map():
+    environments = counted_environments()
+    dataset = PatchDataset(environments, patch_size=48, augment=False, seed=5)
+    names = list(environments)
+    areas = np.array([env.map.size for env in environments.values()], dtype=float)
+    for index in range(20):
+        features, label = dataset.sample(index)
+        assert features.shape == label.shape == (48, 48)
+        assert features.dtype == label.dtype == np.float32
+        #Draw the map and the corner of the patch like the dataset does
+        rng = np.random.default_rng(np.random.SeedSequence([5, index]))
+        env = environments[names[int(rng.choice(len(names), p=areas / areas.sum()))]]
+        h, w = env.map.shape
+        row = int(rng.integers(min(0, h - 48), max(0, h - 48) + 1)) + 48
+        col = int(rng.integers(min(0, w - 48), max(0, w - 48) + 1)) + 48
+        #Parts of the patch outside of the map are obstacles with no visits
+        free = np.pad(env.map == env.free, 48)[row:row + 48, col:col + 48]
+        counts = np.pad(np.asarray(env.visitation_counts), 48)[row:row + 48, col:col + 48]
+        assert np.array_equal(features, free)
+        assert np.allclose(label, counts / env.visitation_counts.max())
+
+
+def test_samples_are_reproducible():
+    environments = counted_environments()
+    first, second = PatchDataset(environments, 32, seed=3), PatchDataset(environments, 32, seed=3)
+    for index in (0, 7, 123):
+        for a, b in zip(first.sample(index), second.sample(index)):
+            assert np.array_equal(a, b)
+
+
+def test_batches_do_not_depend_on_threads():
+    dataset = PatchDataset(counted_environments(), 32)
+    expected = collect(dataset.batches(batch_size=5, num_samples=23, workers=1, prefetch=1))
+    result = collect(dataset.batches(batch_size=5, num_samples=23, workers=4, prefetch=8))
+    assert len(expected[0]) == 23
+    for a, b in zip(expected, result):
+        assert np.array_equal(a, b)
+
+
+def test_shards_split_the_samples():
+    dataset = PatchDataset(counted_environments(), 32)
+    features, labels = collect(dataset.batches(batch_size=4, num_samples=30))
+    shards = [collect(dataset.batches(batch_size=4, num_samples=30, shard=s, num_shards=3)) for s in range(3)]
+    for s, (shard_features, shard_labels) in enumerate(shards):
+        assert np.array_equal(shard_features, features[s::3])
+        assert np.array_equal(shard_labels, labels[s::3])
+
+
+def test_segmentation_labels_use_the_map_thresholds():
+    environments = counted_environments()
+    dataset = PatchDataset(environments, 32, label='segmentation', num_classes=3,
+        class_distribution=[0.2, 0.3, 0.5])
+    _, label = dataset.sample(0)
+    assert label.dtype == np.uint8 and label.max() < 3
+
+
+def test_invalid_arguments_are_rejected():
+    with pytest.raises(ValueError):
+        PatchDataset(counted_environments(), label='depth')
+    with pytest.raises(ValueError):
+        PatchDataset({})
+    dataset = PatchDataset(counted_environments(), 32)
+    with pytest.raises(ValueError):
+        next(dataset.batches(shard=2, num_shards=2))
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from opam.environment import Environment
+from opam.learning.inference import blend_window, predict_tiled, tile_origins
+from opam.learning.models import RidgeOccupancyModel
+from opam.utils.synthetic import make_episodes, make_rooms_map
+
+
+class ConstantModel:
+    name = 'constant'
+
+    def predict_map(self, free, pix_per_meter):
+        return np.where(free, 2.0, 0.0).astype(np.float32)
+
+
+class PositionModel:
+    """Predicts a value that depends on the position of the pixel in its
+    tile, so blending weights show up in the result
+    """
+    name = 'position'
+
+    def predict_batch(self, tiles, pix_per_meter):
+        rows, cols = np.indices(tiles.shape[1:])
+        return np.where(tiles, rows + 2*cols, 0).astype(np.float32)
+
+
+def reference_predict_tiled(model, env, tile_size, overlap):
+    """Blend every tile with an explicit map of the summed weights"""
+    h, w = env.map.shape
+    window = blend_window(tile_size, overlap)
+    prediction = np.zeros((h, w))
+    weights = np.zeros((h, w))
+    for row in tile_origins(h, tile_size, overlap):
+        for col in tile_origins(w, tile_size, overlap):
+            free = env.map[row:row + tile_size, col:col + tile_size] == env.free
+            tile_weights = window[:free.shape[0], :free.shape[1]]
+            if free.any():
+                result = model.predict_batch(free[np.newaxis], env.pix_per_meter)[0] \
+                    if hasattr(model, 'predict_batch') else model.predict_map(free, env.pix_per_meter)
+                prediction[row:row + free.shape[0], col:col + free.shape[1]] += tile_weights * result
+            weights[row:row + free.shape[0], col:col + free.shape[1]] += tile_weights
+    return prediction / weights
+
+
+def test_tile_origins_cover_the_map():
+    assert tile_origins(50, 64, 8) == [0]
+    origins = tile_origins(100, 32, 8)
+    assert origins[0] == 0 and origins[-1] == 100 - 32
+    assert all(b - a <= 24 for a, b in zip(origins, origins[1:]))
+
+
+def test_blending_keeps_constant_predictions():
+    env = Environment('rooms', make_rooms_map(20, 16, seed=0))
+    prediction = predict_tiled(ConstantModel(), env, tile_size=48, overlap=12)
+    free = env.map == env.free
+    assert np.allclose(prediction[free], 2.0) and np.all(prediction[~free] == 0)
+    assert env.predicted_occupancy['constant'] is prediction
+
+
+@pytest.mark.parametrize('tile_size, overlap', [(48, 12), (64, 0), (37, 20), (512, 64)])
+def test_tiled_prediction_matches_explicit_weights(tile_size, overlap):
+    grid = make_rooms_map(20, 16, seed=1)
+    #An obstacle block larger than a tile, so some tiles are skipped
+    grid[:70, :90] = 0
+    env = Environment('rooms', grid)
+    model = PositionModel()
+    expected = reference_predict_tiled(model, env, tile_size, overlap)
+    for workers in (1, 3):
+        prediction = predict_tiled(model, env, tile_size, overlap, batch_size=2, workers=workers)
+        assert prediction.dtype == np.float32
+        assert np.allclose(prediction, expected, rtol=1e-5, atol=1e-4)
+
+
+def test_single_tile_prediction_matches_the_whole_map():
+    env = Environment('rooms', make_rooms_map(20, 16, seed=2))
+    env.episodes = make_episodes(env, num_episodes=4, num_paths=3, num_steps=60, seed=0)
+    env.compute_visitation_counts()
+    model = RidgeOccupancyModel(max_samples_per_map=1000).fit([env])
+    whole = model.predict_map(env.map == env.free, env.pix_per_meter)
+    tiled = predict_tiled(model, env, tile_size=1024, overlap=0)
+    assert np.allclose(tiled, whole)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from opam.environment import Environment
+from opam.learning.models import RidgeOccupancyModel, _block_mean, _box_mean, _max_filter, occupancy_features
+from opam.utils.synthetic import make_episodes, make_rooms_map
+
+
+def test_block_mean_pads_with_fill():
+    array = np.arange(35, dtype=float).reshape(5, 7)
+    result = _block_mean(array, 3, fill=1)
+    padded = np.ones((6, 9))
+    padded[:5, :7] = array
+    for row in range(2):
+        for col in range(3):
+            assert np.isclose(result[row, col], padded[3*row:3*row + 3, 3*col:3*col + 3].mean())
+
+
+@pytest.mark.parametrize('radius', [1, 2, 5])
+def test_box_mean_and_max_filter_match_windows(radius):
+    array = np.random.default_rng(radius).random((13, 17)).astype(np.float32)
+    box, maximum = _box_mean(array, radius), _max_filter(array, radius)
+    for row in range(13):
+        for col in range(17):
+            window = array[max(row - radius, 0):row + radius + 1, max(col - radius, 0):col + radius + 1]
+            assert np.isclose(box[row, col], window.mean(), atol=1e-6)
+            assert maximum[row, col] == window.max()
+
+
+def test_occupancy_features_are_computed_on_blocks():
+    free = make_rooms_map(20, 16, seed=0) == 1
+    features = occupancy_features(free, 10, feature_scale=4, blur_radii=(0.5, 1.0))
+    assert features.shape == (40, 50, 8)
+    assert np.isclose(features[..., 0], _block_mean(free, 4)).all()
+    assert np.all(features[..., 1] <= 5.0) and np.all(features[..., 1] >= 0)
+
+
+def counted_environment(seed):
+    env = Environment('map%d' % seed, make_rooms_map(16, 12, seed=seed))
+    env.episodes = make_episodes(env, num_episodes=6, num_paths=3, num_steps=60, seed=seed)
+    env.compute_visitation_counts()
+    return env
+
+
+def test_fitted_model_predicts_free_space_only():
+    environments = {env.env_name: env for env in map(counted_environment, range(2))}
+    model = RidgeOccupancyModel(max_samples_per_map=500).fit(environments)
+    assert model.coefficients.shape == (11,)
+    env = counted_environment(2)
+    prediction = model.predict(env)
+    assert prediction.shape == env.map.shape
+    assert np.all(prediction[env.map != env.free] == 0) and np.all(prediction >= 0)
+    assert env.predicted_occupancy['ridge'] is prediction
+
+
+def test_fitting_is_reproducible():
+    environments = [counted_environment(0)]
+    first = RidgeOccupancyModel(max_samples_per_map=300, seed=1).fit(environments)
+    second = RidgeOccupancyModel(max_samples_per_map=300, seed=1).fit(environments)
+    assert np.array_equal(first.coefficients, second.coefficients)
+
+
+def test_unfitted_model_and_missing_counts_raise():
+    env = Environment('rooms', make_rooms_map(16, 12, seed=0))
+    with pytest.raises(ValueError):
+        RidgeOccupancyModel().predict(env)
+    with pytest.raises(ValueError):
+        RidgeOccupancyModel().fit([env])
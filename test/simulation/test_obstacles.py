@@ -0,0 +1,48 @@
+import numpy as np
+
+from opam.environment import Environment
+from opam.simulation.obstacles import extract_obstacles, simplify_polygon, trace_obstacle_contours
+
+
+def signed_area(vertices):
+    x, y = np.asarray(vertices, dtype=float).T
+    return (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def test_contours_of_a_block_and_the_map_border():
+    obstacles = np.zeros((6, 8), dtype=bool)
+    obstacles[2:4, 3:5] = True
+    contours = sorted(trace_obstacle_contours(obstacles), key=len)
+    assert len(contours) == 2
+    block, border = contours
+    assert sorted(map(tuple, block)) == [(3, 2), (3, 4), (5, 2), (5, 4)]
+    assert sorted(map(tuple, border)) == [(0, 0), (0, 6), (8, 0), (8, 6)]
+    #Obstacles are on the left of their boundaries
+    assert signed_area(block) > 0 > signed_area(border)
+
+
+def test_diagonal_pixels_get_separate_contours():
+    obstacles = np.zeros((5, 5), dtype=bool)
+    obstacles[1, 1] = obstacles[2, 2] = True
+    assert len(trace_obstacle_contours(obstacles)) == 3
+
+
+def test_simplify_polygon():
+    square = np.array([[0, 0], [1, 0.01], [2, 0], [2, 2], [1, 2], [0, 2]])
+    assert len(simplify_polygon(square, 0.1)) == 4
+    assert np.array_equal(simplify_polygon(square, 0), square)
+    triangle = np.array([[0, 0], [1, 0], [0, 1]])
+    assert np.array_equal(simplify_polygon(triangle, 10), triangle)
+
+
+def test_extract_obstacles_in_world_coordinates():
+    grid = np.ones((20, 30), dtype=np.uint8)
+    grid[5:10, 10:15] = 0
+    env = Environment('block', grid, pix_per_meter=10)
+    obstacles = extract_obstacles(env)
+    assert obstacles is extract_obstacles(env)
+    block = min(obstacles.polygons, key=len)
+    #Pixel edges are half a pixel from the pixel centers
+    assert np.allclose(block.min(axis=0), [(10 - 15 - 0.5) / 10, (5 - 10 - 0.5) / 10])
+    assert np.allclose(block.max(axis=0), [(15 - 15 - 0.5) / 10, (10 - 10 - 0.5) / 10])
+    assert obstacles.num_vertices == 8
@@ -0,0 +1,48 @@
+import subprocess
+import sys
+from os.path import abspath, dirname, join
+
+import pytest
+
+from opam.simulation import registry
+from opam.simulation.core import Simulator
+from opam.simulation.social_force import SocialForce
+
+
+@pytest.fixture
+def simulators(monkeypatch):
+    monkeypatch.setattr(registry, '_simulators', dict(registry._simulators))
+    return registry
+
+
+def test_names_resolve_to_their_classes(simulators):
+    assert 'orca' in simulators.available_simulators()
+    assert simulators.get_simulator('social_force') is SocialForce
+    assert simulators.get_simulator(SocialForce) is SocialForce
+
+
+def test_registered_paths_are_imported_on_first_use(simulators):
+    simulators.register_simulator('base', 'opam.simulation.core:Simulator')
+    assert simulators._simulators['base'] == 'opam.simulation.core:Simulator'
+    assert simulators.get_simulator('base') is Simulator
+    assert simulators._simulators['base'] is Simulator
+    assert simulators.available_simulators() == sorted(['base', 'orca', 'social_force'])
+
+
+def test_invalid_names_and_paths_are_rejected(simulators):
+    with pytest.raises(ValueError):
+        simulators.get_simulator('unknown')
+    with pytest.raises(ValueError):
+        simulators.register_simulator('broken', 'opam.simulation.core.Simulator')
+    simulators.register_simulator('missing', 'opam.simulation.missing:Simulator')
+    with pytest.raises(ImportError):
+        simulators.get_simulator('missing')
+
+
+def test_importing_the_aggregator_skips_heavy_dependencies():
+    code = ('import sys, opam.aggregation.core; '
+        'print(",".join(m for m in ("rvo2", "PIL", "opam.simulation.orca", "opam.simulation.social_force") '
+        'if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+        cwd=abspath(join(dirname(registry.__file__), '..', '..'))).stdout
+    assert output.strip() == ''
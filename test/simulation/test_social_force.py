@@ -0,0 +1,54 @@
+import numpy as np
+
+from opam.environment import Environment
+from opam.simulation.social_force import SocialForce, neighbor_pairs, wall_distance
+from opam.utils.synthetic import make_rooms_map
+
+
+def test_neighbor_pairs_match_brute_force():
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-5, 5, (300, 2))
+    i, j = neighbor_pairs(positions, 0.7)
+    distances = np.hypot(*(positions[:, np.newaxis] - positions[np.newaxis]).transpose(2, 0, 1))
+    expected = np.argwhere((distances < 0.7) & ~np.eye(len(positions), dtype=bool))
+    assert sorted(zip(i, j)) == sorted(map(tuple, expected))
+    assert all(len(pairs) == 0 for pairs in neighbor_pairs(positions[:1], 0.7))
+
+
+def test_wall_distance_is_close_to_exact():
+    env = Environment('rooms', make_rooms_map(10, 8, seed=0), pix_per_meter=10)
+    distance = wall_distance(env)
+    obstacles = np.argwhere(env.map == env.obstacle)
+    rng = np.random.default_rng(0)
+    for row, col in zip(rng.integers(0, 80, 200), rng.integers(0, 100, 200)):
+        exact = np.hypot(*(obstacles - (row, col)).T).min() / env.pix_per_meter
+        assert abs(distance[row, col] - exact) < 0.1
+    assert wall_distance(env) is distance
+
+
+def test_agents_stay_in_free_space_and_walk_to_their_goals():
+    env = Environment('rooms', make_rooms_map(16, 16, seed=0))
+    simulator = SocialForce(env, time_step=0.1, num_agents=6)
+    simulator.reset(0)
+    start = np.hypot(*(simulator.positions - simulator.goals).T)
+    episode = simulator.get_episode_data(150)
+    assert episode.shape == (6, 150, 2)
+
+    pixels = env._world_to_pixel(episode.reshape(-1, 2))
+    assert not np.any(env.map[pixels[:, 0], pixels[:, 1]] == env.obstacle)
+    end = np.hypot(*(simulator.positions - simulator.goals).T)
+    assert end.mean() < start.mean()
+
+    simulator.reset(0)
+    assert np.array_equal(simulator.get_episode_data(150), episode)
+
+
+def test_agents_walk_straight_unless_navigating():
+    env = Environment('rooms', make_rooms_map(16, 16, seed=0))
+    simulator = SocialForce(env, time_step=0.1, num_agents=6)
+    assert not simulator.navigate
+    simulator.reset(0)
+    offsets = simulator.goals - simulator.positions
+    velocities = simulator._preferred_velocities(simulator.positions, simulator.max_speed, simulator.time_step)
+    assert np.allclose(offsets[:, 0]*velocities[:, 1] - offsets[:, 1]*velocities[:, 0], 0, atol=1e-9)
+    assert np.all(np.sum(offsets * velocities, axis=1) > 0)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from opam.utils.annotation import binary_dilate, class_thresholds, footprint_offsets, make_gaussian, segmentation_mask
+
+
+def reference_dilate(image, mask, anchor):
+    out = np.zeros(image.shape, dtype=bool)
+    rows, cols = np.nonzero(image)
+    for d_row, d_col in zip(*footprint_offsets(mask, anchor)):
+        r, c = rows + d_row, cols + d_col
+        inside = (r >= 0) & (r < image.shape[0]) & (c >= 0) & (c < image.shape[1])
+        out[r[inside], c[inside]] = True
+    return out
+
+
+@pytest.mark.parametrize('radius', [0.4, 1.5, 2.7, 6.0])
+def test_binary_dilate_matches_reference(radius):
+    rng = np.random.default_rng(0)
+    diameter = int(np.ceil(radius)) + round(radius)
+    mask = np.rint(make_gaussian(diameter, fwhm=diameter))
+    for shape in [(1, 1), (3, 40), (37, 29)]:
+        image = rng.random(shape) < 0.05
+        for anchor in range(diameter):
+            assert np.array_equal(binary_dilate(image, mask, anchor), reference_dilate(image, mask, anchor))
+
+
+def test_binary_dilate_with_ragged_mask():
+    mask = np.array([[0, 1, 1, 0], [1, 0, 0, 1], [0, 0, 1, 0], [1, 1, 1, 1]])
+    image = np.zeros((9, 11), dtype=bool)
+    image[[0, 4, 8], [10, 5, 0]] = True
+    for anchor in range(4):
+        assert np.array_equal(binary_dilate(image, mask, anchor), reference_dilate(image, mask, anchor))
+    assert not binary_dilate(image, np.zeros((3, 3)), 1).any()
+
+
+def reference_thresholds(values, class_distribution):
+    ranks = np.rint(np.cumsum(class_distribution)[:-1] * len(values)).astype(int)
+    ordered = np.sort(values)
+    return np.where(ranks > 0, ordered[np.maximum(ranks - 1, 0)], 0)
+
+
+@pytest.mark.parametrize('max_histogram_bins', [1 << 20, 0])
+def test_class_thresholds_match_sorting(max_histogram_bins):
+    rng = np.random.default_rng(0)
+    for distribution in ([0.5, 0.5], [0.2, 0.3, 0.5], [0.0, 0.7, 0.3], [0.1, 0.1, 0.1, 0.7]):
+        for values in (rng.integers(1, 50, 999), rng.geometric(0.01, 500), rng.uniform(0.1, 3, 400)):
+            assert np.array_equal(class_thresholds(values, distribution, max_histogram_bins),
+                reference_thresholds(values, distribution))
+
+
+def test_segmentation_mask_labels_counts_by_class():
+    rng = np.random.default_rng(1)
+    counts = rng.integers(0, 20, (30, 40)) * (rng.random((30, 40)) < 0.6)
+    thresholds = class_thresholds(counts[counts > 0], [0.25, 0.25, 0.5])
+    mask = segmentation_mask(counts, thresholds)
+    expected = np.zeros(counts.shape, dtype=np.uint8)
+    for row, col in zip(*np.nonzero(counts)):
+        expected[row, col] = sum(counts[row, col] > threshold for threshold in thresholds)
+    assert mask.dtype == np.uint8 and np.array_equal(mask, expected)
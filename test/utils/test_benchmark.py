@@ -0,0 +1,32 @@
+import pytest
+
+from opam.utils.benchmark import SIZES, compare_benchmarks, make_environment, run_benchmarks
+
+
+def test_run_benchmarks_times_the_selected_scenarios(monkeypatch):
+    monkeypatch.setitem(SIZES, 'tiny', dict(width=12.0, height=10.0, pix_per_meter=10, num_episodes=2,
+        num_paths=2, num_steps=20, num_agents=4, num_simulation_steps=5, num_navigated_agents=8))
+    results = run_benchmarks('tiny', layouts=('rooms', 'corridors'),
+        scenarios=['raytrace_path', 'compute_visitation_counts', 'navigated_simulation_steps'], repeats=2)
+    assert sorted(results['results']) == ['corridors/compute_visitation_counts',
+        'corridors/navigated_simulation_steps', 'corridors/raytrace_path', 'rooms/compute_visitation_counts',
+        'rooms/navigated_simulation_steps', 'rooms/raytrace_path']
+    for timing in results['results'].values():
+        assert 0 <= timing['min'] <= timing['median'] and timing['repeats'] == 2
+    assert results['meta']['size'] == 'tiny'
+
+
+def test_compare_benchmarks_flags_regressions():
+    baseline = {'results': {'a': {'min': 1.0}, 'b': {'min': 2.0}, 'c': {'min': 1.0}}}
+    current = {'results': {'a': {'min': 1.05}, 'b': {'min': 3.0}, 'd': {'min': 1.0}}}
+    rows = compare_benchmarks(baseline, current, threshold=0.1)
+    assert [row['scenario'] for row in rows] == ['a', 'b']
+    assert [row['regression'] for row in rows] == [False, True]
+    assert rows[1]['ratio'] == 1.5
+
+
+def test_unknown_sizes_and_layouts_are_rejected():
+    with pytest.raises(ValueError):
+        run_benchmarks('huge')
+    with pytest.raises(ValueError):
+        make_environment('maze', SIZES['small'])
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from opam.utils.cache import ContributionCache, content_hash
+
+
+def put(cache, key, seed):
+    indices = np.sort(np.random.default_rng(seed).choice(1 << 20, 500, replace=False))
+    cache.put(key, indices, np.ones(len(indices), dtype=np.int64))
+    return indices
+
+
+def test_content_hash():
+    array = np.arange(12).reshape(3, 4)
+    assert content_hash(array) == content_hash(np.asfortranarray(array))
+    assert content_hash(array) != content_hash(array.astype(np.int32))
+    assert content_hash(array) != content_hash(array.reshape(4, 3))
+    assert content_hash('a', 1) != content_hash('a', 2)
+
+
+def test_get_and_put(tmp_path):
+    cache = ContributionCache(str(tmp_path))
+    assert cache.get('ab' * 20) is None
+    indices = put(cache, 'ab' * 20, 0)
+    cached_indices, counts = cache.get('ab' * 20)
+    assert np.array_equal(cached_indices, indices) and np.all(counts == 1)
+    assert (cache.hits, cache.misses) == (1, 1)
+    #Another cache on the same directory sees the entry
+    assert ContributionCache(str(tmp_path)).get('ab' * 20) is not None
+
+
+def test_overwriting_an_entry_does_not_grow_the_size(tmp_path):
+    cache = ContributionCache(str(tmp_path))
+    put(cache, 'cd' * 20, 0)
+    size = cache._size
+    put(cache, 'cd' * 20, 0)
+    assert cache._size == size == sum(size for _, _, size in cache._entries())
+
+
+def test_eviction_goes_down_to_the_low_water_mark(tmp_path):
+    cache = ContributionCache(str(tmp_path), max_bytes=None, low_water=0.5)
+    put(cache, '%040x' % 0, 0)
+    entry_size = cache._size
+    cache.max_bytes = 10 * entry_size
+
+    scans = []
+    entries = cache._entries
+    cache._entries = lambda: scans.append(1) or entries()
+    for i in range(1, 30):
+        put(cache, '%040x' % i, i)
+        assert cache._size <= cache.max_bytes
+    #Each eviction makes room for 5 more entries
+    assert len(scans) == 4
+    assert len(cache._entries()) == 6
+    #The most recent entries are kept
+    assert cache.get('%040x' % 29) is not None and cache.get('%040x' % 0) is None
+
+
+def test_clear(tmp_path):
+    cache = ContributionCache(str(tmp_path))
+    put(cache, 'ef' * 20, 0)
+    cache.clear()
+    assert cache.get('ef' * 20) is None and cache._size == 0
+
+    with pytest.raises(ValueError):
+        ContributionCache(str(tmp_path), low_water=2)
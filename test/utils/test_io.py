@@ -0,0 +1,87 @@
+import io
+import json
+import numpy as np
+import pytest
+
+from opam.utils.io import EpisodeWriter, _JSONStream, convert_episode_file, episode_cache_path, \
+    is_episode_cache_fresh, iter_episodes, read_episode_cache, write_episode_cache
+
+
+def write_episode_file(path, num_episodes=3, seed=0):
+    rng = np.random.default_rng(seed)
+    episodes = [rng.normal(0, 3, (2, 4, 2)) for _ in range(num_episodes)]
+    with EpisodeWriter(str(path)) as writer:
+        for episode in episodes:
+            writer.write(episode)
+    return [episode.tolist() for episode in episodes]
+
+
+@pytest.mark.parametrize('document', [
+    '{"v": 1.25, "episodes": []}',
+    '{"tail": 1e-5, "episodes": []}',
+    '{"v": -12.5E+3, "w": [0.5, 2], "episodes": []}',
+])
+def test_numbers_split_at_chunk_boundaries(document):
+    expected = json.loads(document)
+    for chunk_size in range(1, len(document) + 1):
+        stream = _JSONStream(io.StringIO(document), chunk_size)
+        assert {key: value.value() for key, value in stream.items()} == expected, chunk_size
+
+
+def test_episode_file_split_at_every_chunk_size(tmp_path):
+    path = tmp_path / 'map.json'
+    expected = write_episode_file(path)
+    text = path.read_text()
+    #Numbers before the episodes are skipped the same way as the episodes
+    text = '{"version": 1.25, "scale": 1e-5, ' + text[1:]
+    for chunk_size in range(1, len(text) + 1):
+        assert list(iter_episodes(io.StringIO(text), chunk_size=chunk_size)) == expected, chunk_size
+
+
+def test_streaming_stops_after_num_episodes(tmp_path):
+    path = tmp_path / 'map.json'
+    expected = write_episode_file(path, num_episodes=5)
+    with open(path) as file:
+        assert list(iter_episodes(file, 2, chunk_size=64)) == expected[:2]
+        assert file.tell() < path.stat().st_size
+
+
+def test_invalid_documents_raise():
+    with pytest.raises(ValueError):
+        list(iter_episodes(io.StringIO('{"v": 1.5.2, "episodes": []}'), chunk_size=3))
+    with pytest.raises(ValueError):
+        list(iter_episodes(io.StringIO('{"episodes": [{"pedestrians": []}'), chunk_size=3))
+
+
+def test_episode_cache_round_trip(tmp_path):
+    path = tmp_path / 'map.json'
+    expected = write_episode_file(path)
+    header = convert_episode_file(str(path), map_name='map', pix_per_meter=10)
+    assert header['num_episodes'] == 3 and header['num_points'] == 24
+    assert is_episode_cache_fresh(str(path))
+
+    for mmap in (True, False):
+        store, cached_header = read_episode_cache(episode_cache_path(str(path)), mmap)
+        assert cached_header == header
+        assert np.allclose(np.asarray(store.to_lists()), expected, atol=1e-5)
+        assert isinstance(store.coords, np.memmap) == mmap
+
+
+def test_empty_episode_cache(tmp_path):
+    write_episode_cache([], str(tmp_path / 'cache'))
+    store, header = read_episode_cache(str(tmp_path / 'cache'))
+    assert len(store) == 0 and header['num_points'] == 0
+
+
+def test_interrupted_rewrite_is_not_fresh(tmp_path):
+    path = tmp_path / 'map.json'
+    write_episode_file(path)
+    convert_episode_file(str(path))
+
+    def episodes():
+        yield [[[0.0, 0.0]]]
+        raise RuntimeError('interrupted')
+
+    with pytest.raises(RuntimeError):
+        write_episode_cache(episodes(), episode_cache_path(str(path)))
+    assert not is_episode_cache_fresh(str(path))
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from os.path import getsize, join
+
+from opam.aggregation import parallel
+from opam.aggregation.core import Aggregator
+from opam.environment import Environment
+from opam.utils.io import EpisodeWriter, episode_cache_path
+from opam.utils.metrics import Metrics, metrics
+from opam.utils.synthetic import make_episodes, make_rooms_map
+
+
+def test_disabled_metrics_record_nothing():
+    recorder = Metrics()
+    with recorder.timer('load'):
+        recorder.count('episodes loaded', 3)
+    assert not recorder.timers and not recorder.counters
+
+
+def test_snapshots_merge_into_totals():
+    recorder, worker = Metrics(), Metrics()
+    recorder.enable()
+    worker.enable()
+    for target in (recorder, worker):
+        with target.timer('swept area'):
+            target.count('paths', 2)
+    recorder.merge(worker.snapshot())
+    recorder.merge(None)
+    assert recorder.counters['paths'] == 4 and recorder.timers['swept area'][1] == 2
+    report = recorder.report()
+    assert 'swept area' in report and 'paths' in report
+
+
+def write_episode_file(directory):
+    env = Environment('rooms', make_rooms_map(12, 10, seed=0))
+    episodes = make_episodes(env, num_episodes=5, num_paths=2, num_steps=30, seed=0)
+    path = join(directory, 'rooms_episodes.json')
+    with EpisodeWriter(path) as writer:
+        for episode in episodes:
+            writer.write(episode)
+    aggregator = Aggregator()
+    aggregator.maps['rooms'] = env
+    return aggregator, path
+
+
+@pytest.fixture
+def recording():
+    metrics.reset()
+    metrics.enable()
+    yield metrics
+    metrics.disable()
+    metrics.reset()
+
+
+def test_bytes_read_are_counted_for_files_and_caches(tmp_path, recording):
+    aggregator, path = write_episode_file(str(tmp_path))
+    aggregator.load_episodes(str(tmp_path) + '/', num_episodes=0, use_cache=False)
+    assert recording.counters['bytes read'] == getsize(path)
+    assert recording.counters['episodes loaded'] == 5
+
+    aggregator.load_episodes(str(tmp_path) + '/', num_episodes=0, build_cache=True)
+    recording.reset()
+    aggregator.load_episodes(str(tmp_path) + '/', num_episodes=2)
+    cache = episode_cache_path(path)
+    store = aggregator.maps['rooms'].episodes
+    #The header and offsets are read whole, the coordinates of the two kept episodes as accessed
+    expected = sum(getsize(join(cache, name)) for name in ('header.json', 'path_offsets.npy', 'episode_offsets.npy')) \
+        + 2 * 2 * 30 * 2 * store.coords.itemsize
+    assert recording.counters['bytes read'] == expected
+    assert recording.counters['episodes loaded'] == 2
+
+
+def test_failed_shards_stop_recording(recording):
+    env = Environment('rooms', make_rooms_map(12, 10, seed=0))
+    missing = parallel.SharedArray('opam_missing_block', (1,), np.dtype(np.float32).str)
+    task = parallel._ShardTask('rooms', parallel.detached_environment(env), missing, None, {}, missing,
+        np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), None, True, None)
+    with pytest.raises(FileNotFoundError):
+        parallel._annotate_shard(task)
+    assert not metrics.enabled
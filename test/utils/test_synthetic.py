@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from opam.environment import Environment
+from opam.environment.free_space import connected_components
+from opam.utils.synthetic import make_corridors_map, make_episodes, make_rooms_map
+
+
+@pytest.mark.parametrize('generator', [make_rooms_map, make_corridors_map])
+def test_maps_are_reproducible_and_connected(generator):
+    grid = generator(30, 20, pix_per_meter=10, seed=3)
+    assert grid.shape == (200, 300) and grid.dtype == np.uint8
+    assert set(np.unique(grid)) == {0, 1}
+    assert np.array_equal(grid, generator(30, 20, pix_per_meter=10, seed=3))
+    _, labels = connected_components(grid == 1)
+    assert labels.max() == 0
+
+
+def test_rooms_map_is_enclosed():
+    grid = make_rooms_map(20, 16, seed=0)
+    assert not grid[0].any() and not grid[-1].any() and not grid[:, 0].any() and not grid[:, -1].any()
+
+
+def test_episodes_stay_in_free_space():
+    env = Environment('rooms', make_rooms_map(20, 16, seed=0))
+    episodes = make_episodes(env, num_episodes=3, num_paths=4, num_steps=80, seed=1)
+    assert len(episodes) == 3 and episodes[0].shape == (4, 80, 2)
+    pixels = env._world_to_pixel(np.concatenate(episodes).reshape(-1, 2))
+    assert not env.configuration_space[pixels[:, 0], pixels[:, 1]].any()
+    #Walkers keep moving instead of getting stuck at a wall
+    steps = np.diff(np.concatenate(episodes), axis=1)
+    assert np.mean(np.hypot(steps[..., 0], steps[..., 1]) > 0) > 0.5
+    for a, b in zip(episodes, make_episodes(env, num_episodes=3, num_paths=4, num_steps=80, seed=1)):
+        assert np.array_equal(a, b)
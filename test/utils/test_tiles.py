@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from opam.utils.tiles import TiledArray
+
+
+def test_reads_and_writes_match_dense_array():
+    rng = np.random.default_rng(0)
+    dense = np.zeros((70, 45), dtype=np.int64)
+    tiled = TiledArray(dense.shape, np.int64, tile_size=16)
+    for _ in range(20):
+        row, col = rng.integers(0, 70), rng.integers(0, 45)
+        value = rng.integers(1, 9)
+        dense[row:row + 5, col:col + 7] = value
+        tiled[row:row + 5, col:col + 7] = value
+    assert np.array_equal(np.asarray(tiled), dense)
+    assert np.array_equal(tiled[10:50:3, ::-2], dense[10:50:3, ::-2])
+    assert tiled[-1, 3] == dense[-1, 3]
+    assert tiled.max() == dense.max() and tiled.sum() == dense.sum()
+
+    tiled[...] = 0
+    assert len(tiled.tiles) == 0 and tiled.nbytes == 0
+
+
+def test_tiles_are_allocated_where_data_lands():
+    tiled = TiledArray((1000, 1000), np.uint16, tile_size=100)
+    tiled.add_at([0, 999999, 999999])
+    assert sorted(tiled.tiles) == [(0, 0), (9, 9)]
+    assert tiled[999, 999] == 2
+    with pytest.raises(IndexError):
+        tiled[1000, 0]
+
+
+def test_add_at_saturates_integer_tiles():
+    tiled = TiledArray((4, 4), np.uint8, tile_size=3)
+    tiled.add_at([5, 5, 6], [200, 100, 7])
+    assert tiled[1, 1] == 255 and tiled[1, 2] == 7
+
+
+@pytest.mark.parametrize('dtype', [np.int32, np.int64])
+def test_add_at_accumulates_integers_exactly(dtype):
+    large = np.iinfo(dtype).max // 2 - 1
+    tiled = TiledArray((4, 4), dtype, tile_size=3)
+    tiled.add_at([5, 5, 6], [large, 3, 1])
+    tiled.add_at([5], [1])
+    assert tiled[1, 1] == large + 4 and tiled[1, 2] == 1
+
+
+def test_memory_mapped_tiles(tmp_path):
+    tiled = TiledArray((10, 10), np.uint32, tile_size=4, spill_dir=str(tmp_path))
+    tiled.add_at(np.arange(100), 3)
+    tiled.flush()
+    assert len(list(tmp_path.iterdir())) == 9
+    assert all(isinstance(tile, np.memmap) for tile in tiled.tiles.values())
+    assert tiled.sum() == 300
@@ -0,0 +1,87 @@
+import json
+import numpy as np
+import pytest
+from os.path import exists, join
+
+from opam.visualization.core import MANIFEST_NAME, colormap_lut, export_tile_pyramid, max_zoom, reduce_2x
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def test_colormap_lut_interpolates_anchors():
+    lut = colormap_lut('gray')
+    assert lut.shape == (256, 3) and lut.dtype == np.uint8
+    assert np.array_equal(lut[:, 0], np.arange(256))
+    assert tuple(colormap_lut('inferno')[-1]) == (252, 255, 164)
+    with pytest.raises(ValueError):
+        colormap_lut('jet')
+
+
+def test_reduce_2x_sums_padded_blocks():
+    array = np.arange(15).reshape(3, 5)
+    reduced = reduce_2x(array)
+    padded = np.zeros((4, 6))
+    padded[:3, :5] = array
+    for row in range(2):
+        for col in range(3):
+            assert reduced[row, col] == padded[2*row:2*row + 2, 2*col:2*col + 2].sum()
+
+
+def test_max_zoom_fits_the_map_in_one_tile():
+    assert max_zoom((256, 100), 256) == 0
+    assert max_zoom((257, 100), 256) == 1
+    assert max_zoom((1000, 3000), 256) == 4
+
+
+def heatmap(seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 20, (150, 230)).astype(float)
+    free = rng.random((150, 230)) < 0.8
+    return values, free
+
+
+def test_pyramid_tiles_cover_every_level(tmp_path):
+    values, free = heatmap()
+    directory = str(tmp_path)
+    summary = export_tile_pyramid(values, free, directory, tile_size=64)
+    assert summary['max_zoom'] == 2
+    #64 pixel tiles over the 150 x 230 map, its 75 x 115 and 38 x 58 halves
+    assert summary['written'] == 3*4 + 2*2 + 1 and summary['skipped'] == summary['removed'] == 0
+    with open(join(directory, MANIFEST_NAME)) as file:
+        assert len(json.load(file)['tiles']) == summary['written']
+
+    tile = np.asarray(Image.open(join(directory, '2/3/2.png')))
+    assert tile.shape == (64, 64, 4)
+    #Outside of the map the tile is transparent
+    assert np.all(tile[:150 - 128, :230 - 192, 3] == 255) and np.all(tile[150 - 128:, :, 3] == 0)
+    top = np.asarray(Image.open(join(directory, '0/0/0.png')))
+    assert np.all(top[:38, :58, 3] == 255) and np.all(top[38:, :, 3] == 0)
+
+
+def test_unchanged_tiles_are_skipped(tmp_path):
+    values, free = heatmap()
+    directory = str(tmp_path)
+    export_tile_pyramid(values, free, directory, tile_size=64, vmax=20)
+    assert export_tile_pyramid(values, free, directory, tile_size=64, vmax=20)['written'] == 0
+
+    #A change in one full resolution tile renders it and the tiles above it again
+    values[10, 10] += 5
+    summary = export_tile_pyramid(values, free, directory, tile_size=64, vmax=20)
+    assert summary['written'] == 3 and summary['removed'] == 0
+
+    #A smaller map drops the tiles past its end
+    summary = export_tile_pyramid(values[:60, :60], free[:60, :60], directory, tile_size=64, vmax=20)
+    assert summary['max_zoom'] == 0 and summary['removed'] == 16
+    assert not exists(join(directory, '2/0/0.png'))
+
+
+def test_obstacles_get_their_color(tmp_path):
+    values = np.ones((32, 32))
+    free = np.ones((32, 32), dtype=bool)
+    free[:, :16] = False
+    export_tile_pyramid(values, free, str(tmp_path), tile_size=32, colormap='gray', scale='linear',
+        obstacle_color=(1, 2, 3))
+    tile = np.asarray(Image.open(join(str(tmp_path), '0/0/0.png')))
+    assert np.all(tile[:, :16, :3] == (1, 2, 3)) and np.all(tile[:, 16:, :3] == 255)
+    with pytest.raises(ValueError):
+        export_tile_pyramid(values, free[:10], str(tmp_path))